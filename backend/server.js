@@ -5,6 +5,7 @@ const path = require('path');
 const fs = require('fs');
 const axios = require('axios');
 const FormData = require('form-data');
+const crypto = require('crypto');
 
 const app = express();
 const port = 5000;
@@ -12,6 +13,14 @@ const port = 5000;
 app.use(cors());
 app.use(express.json()); // Middleware to parse JSON bodies
 
+// Tag every request with a trace ID and forward it to the Python AI engine,
+// so its spans and logs can be matched to the request that caused them.
+app.use((req, res, next) => {
+  req.requestId = req.get('x-request-id') || crypto.randomUUID();
+  res.set('X-Request-ID', req.requestId);
+  next();
+});
+
 const uploadsDir = path.join(__dirname, 'uploads');
 if (!fs.existsSync(uploadsDir)) {
   fs.mkdirSync(uploadsDir);
@@ -22,10 +31,71 @@ const storage = multer.diskStorage({
   filename: (req, file, cb) => cb(null, Date.now() + '-' + file.originalname)
 });
 
-const upload = multer({ storage: storage });
+// Uploads over the limit are cut off while they are still arriving (see the error handler below).
+const MAX_UPLOAD_MB = Number(process.env.MAX_UPLOAD_MB) || 200;
+const upload = multer({ storage: storage, limits: { fileSize: MAX_UPLOAD_MB * 1024 * 1024 } });
 
 const PYTHON_API_URL = 'http://localhost:8000/api';
 
+// Local handoff: when the AI engine can read this server's uploads/ folder (same
+// machine or a shared volume, with its LOCAL_HANDOFF_DIR pointing at it), set
+// LOCAL_HANDOFF=true to send it the saved file's path instead of re-uploading the bytes.
+const LOCAL_HANDOFF = process.env.LOCAL_HANDOFF === 'true';
+
+// Hands a saved upload to the AI engine's `route` (/process-document or /jobs).
+function sendToEngine(route, req) {
+  const headers = { 'X-Request-ID': req.requestId };
+  if (LOCAL_HANDOFF) {
+    return axios.post(`${PYTHON_API_URL}${route}/local`, {
+      path: path.resolve(req.file.path),
+      filename: req.file.originalname,
+      mime_type: req.file.mimetype,
+      previous_document_id: req.body.previousDocumentId || null
+    }, { headers });
+  }
+
+  const form = new FormData();
+  form.append('file', fs.createReadStream(req.file.path), {
+    filename: req.file.originalname,
+    contentType: req.file.mimetype,
+    knownLength: req.file.size
+  });
+  // An amended version of an already processed document.
+  if (req.body.previousDocumentId) {
+    form.append('previous_document_id', req.body.previousDocumentId);
+  }
+  return axios.post(`${PYTHON_API_URL}${route}`, form, {
+    headers: { ...form.getHeaders(), ...headers },
+    maxBodyLength: Infinity
+  });
+}
+
+// The AI engine refuses uploads over its size or page limits (413) and files it cannot accept (400).
+function relayRejectedUpload(error, res) {
+  const status = error.response && error.response.status;
+  if (status !== 400 && status !== 413) {
+    return false;
+  }
+  res.status(status).json({ error: error.response.data.detail || 'The AI engine refused the upload.' });
+  return true;
+}
+
+// The AI engine answers 503 (or 429) with Retry-After when it is at capacity.
+// Pass that on unchanged, so the browser knows to back off rather than fail.
+function relayOverload(error, res) {
+  const status = error.response && error.response.status;
+  if (status !== 503 && status !== 429) {
+    return false;
+  }
+  const retryAfter = error.response.headers['retry-after'];
+  if (retryAfter) {
+    res.set('Retry-After', retryAfter);
+  }
+  const message = 'The AI engine is busy. Please try again shortly.';
+  res.status(status).json({ error: message, detail: message, retryAfter: Number(retryAfter) || null });
+  return true;
+}
+
 // === API ENDPOINTS ===
 
 // Endpoint to serve the documents for the viewer
@@ -45,21 +115,11 @@ app.post('/api/upload', upload.single('document'), async (req, res) => {
     return res.status(400).json({ error: 'No file uploaded.' });
   }
 
-  console.log(`File '${req.file.filename}' saved. Forwarding to Python for processing...`);
-
-  const form = new FormData();
-  form.append('file', fs.createReadStream(req.file.path), {
-    filename: req.file.originalname,
-    contentType: req.file.mimetype,
-  });
+  console.log(`[trace=${req.requestId}] File '${req.file.filename}' saved. Forwarding to Python for processing...`);
 
   try {
     // Call the Python AI engine's /process-document endpoint
-    const processResponse = await axios.post(`${PYTHON_API_URL}/process-document`, form, {
-      headers: {
-        ...form.getHeaders()
-      }
-    });
+    const processResponse = await sendToEngine('/process-document', req);
 
     console.log('Python processing successful. Document ID:', processResponse.data.document_id);
 
@@ -74,6 +134,7 @@ app.post('/api/upload', upload.single('document'), async (req, res) => {
 
   } catch (error) {
     console.error("Error calling Python AI for processing:", error.response ? error.response.data : error.message);
+    if (relayOverload(error, res) || relayRejectedUpload(error, res)) return;
     res.status(500).json({ error: 'Failed to process document with AI engine.' });
   }
 });
@@ -86,24 +147,121 @@ app.post('/api/chat', async (req, res) => {
         return res.status(400).json({ error: 'Question and documentId are required.' });
     }
 
-    console.log(`Forwarding question to Python AI for doc ID ${documentId}`);
+    console.log(`[trace=${req.requestId}] Forwarding question to Python AI for doc ID ${documentId}`);
 
     try {
         // Call the Python AI engine's /ask endpoint
         const pythonResponse = await axios.post(`${PYTHON_API_URL}/ask`, {
             question: question,
             document_id: documentId
+        }, {
+            headers: { 'X-Request-ID': req.requestId }
         });
 
         res.json(pythonResponse.data);
 
     } catch (error) {
         console.error("Error calling Python AI for chat:", error.response ? error.response.data : error.message);
+        if (relayOverload(error, res)) return;
         const errorDetail = error.response ? error.response.data.detail : "AI service is unavailable.";
         res.status(500).json({ error: "Failed to get response from AI engine.", detail: errorDetail });
     }
 });
 
+// 2b. STREAMING CHAT: relay the AI engine's server-sent events as they arrive
+app.post('/api/chat/stream', async (req, res) => {
+    const { question, documentId } = req.body;
+
+    if (!question || !documentId) {
+        return res.status(400).json({ error: 'Question and documentId are required.' });
+    }
+
+    console.log(`[trace=${req.requestId}] Streaming answer from Python AI for doc ID ${documentId}`);
+
+    try {
+        const pythonResponse = await axios.post(`${PYTHON_API_URL}/ask/stream`, {
+            question: question,
+            document_id: documentId
+        }, {
+            headers: { 'X-Request-ID': req.requestId },
+            responseType: 'stream'
+        });
+
+        res.set({
+            'Content-Type': 'text/event-stream',
+            'Cache-Control': 'no-cache',
+            'Connection': 'keep-alive',
+            'X-Accel-Buffering': 'no'
+        });
+        res.flushHeaders();
+        pythonResponse.data.pipe(res);
+        // Stop generating if the browser goes away mid-answer.
+        res.on('close', () => pythonResponse.data.destroy());
+        pythonResponse.data.on('error', (error) => {
+            console.error("Answer stream from Python AI failed:", error.message);
+            res.end();
+        });
+
+    } catch (error) {
+        console.error("Error calling Python AI for chat:", error.message);
+        if (relayOverload(error, res)) return;
+        const status = error.response && error.response.status === 404 ? 404 : 500;
+        res.status(status).json({ error: "Failed to get response from AI engine.", detail: status === 404 ? "Document not found. Please re-process it." : "AI service is unavailable." });
+    }
+});
+
+// 3. ASYNC UPLOAD: queue processing on the AI engine and return a job ID immediately
+app.post('/api/upload/async', upload.single('document'), async (req, res) => {
+  if (!req.file) {
+    return res.status(400).json({ error: 'No file uploaded.' });
+  }
+
+  console.log(`File '${req.file.filename}' saved. Queuing it for processing in Python...`);
+
+  try {
+    const jobResponse = await sendToEngine('/jobs', req);
+
+    console.log('Processing job queued. Job ID:', jobResponse.data.job_id);
+
+    res.status(202).json({
+      message: 'File queued for processing.',
+      filePath: `/api/documents/${req.file.filename}`,
+      jobId: jobResponse.data.job_id,
+      statusUrl: `/api/jobs/${jobResponse.data.job_id}`
+    });
+
+  } catch (error) {
+    console.error("Error queuing document with Python AI:", error.response ? error.response.data : error.message);
+    if (relayOverload(error, res) || relayRejectedUpload(error, res)) return;
+    res.status(500).json({ error: 'Failed to queue document with AI engine.' });
+  }
+});
+
+// 4. JOB STATUS: per-stage progress and partial results for a queued upload
+app.get('/api/jobs/:jobId', async (req, res) => {
+    const { jobId } = req.params;
+
+    try {
+        const jobResponse = await axios.get(`${PYTHON_API_URL}/jobs/${encodeURIComponent(jobId)}`, {
+            headers: { 'X-Request-ID': req.requestId }
+        });
+        res.json(jobResponse.data);
+
+    } catch (error) {
+        const status = error.response ? error.response.status : 500;
+        const errorDetail = error.response ? error.response.data.detail : "AI service is unavailable.";
+        res.status(status).json({ error: "Failed to get job status from AI engine.", detail: errorDetail });
+    }
+});
+
+// Multer reports an upload over MAX_UPLOAD_MB here, after removing the partial file.
+app.use((err, req, res, next) => {
+  if (err instanceof multer.MulterError && err.code === 'LIMIT_FILE_SIZE') {
+    return res.status(413).json({ error: `The file exceeds the ${MAX_UPLOAD_MB} MB upload limit.` });
+  }
+  next(err);
+});
+
 app.listen(port, () => {
   console.log(`Node.js backend is running on http://localhost:${port}`);
 });
\ No newline at end of file
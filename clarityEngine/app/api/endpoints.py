@@ -1,14 +1,23 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
-import uuid
-from app.core.document_processor import process_document_with_docai
-from app.core.clarity_engine import (
-    get_semantic_chunks_from_gemini, 
-    get_answer_from_gemini, 
-    get_summary_from_gemini,
-    get_document_structure_from_gemini,
-    get_summary_for_section_from_gemini
-)
-from app.core.vector_store import embed_and_store_chunks, query_vector_store
+import json
+from datetime import datetime
+import numpy as np
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from app.config import settings
+from app.core.admission import admission, work_priority, INTERACTIVE, BULK
+from app.core.concurrency import run_io, run_cpu, stream_io
+from app.core.answer_cache import CachedAnswer, answer_cache
+from app.core.clarity_engine import get_answer_from_gemini, stream_answer_from_gemini, ANSWER_ERROR_MESSAGE
+from app.core.corpus import corpus_index
+from app.core.embeddings import embedding_service
+from app.core.jobs import job_queue
+from app.core.lexical_index import lookup_exact_references, search_lexical
+from app.core.metrics import span, cache_requests, retrieval_paths
+from app.core.pipeline import run_processing_pipeline
+from app.core.retrieval import Candidate, select_context, fuse_candidates, rescore_with_vectors
+from app.core.uploads import MultipartUpload, Upload, UploadRejected, open_local_upload, discard_upload
+from app.core.vector_store import search_document, get_chunk_vectors, has_document, embed_query
 from app.cache import document_chunk_cache
 from pydantic import BaseModel
 
@@ -16,126 +25,457 @@ class AskRequest(BaseModel):
     question: str
     document_id: str
 
+class LocalUploadRequest(BaseModel):
+    path: str
+    filename: str | None = None
+    mime_type: str = "application/pdf"
+    previous_document_id: str | None = None
+
+class CorpusQuery(BaseModel):
+    question: str
+    document_ids: list[str] | None = None
+    document_type: str | None = None
+    uploaded_after: datetime | None = None
+    uploaded_before: datetime | None = None
+    top_k: int = 10
+
 router = APIRouter()
 
 @router.get("/", tags=["API Root"])
 def api_root():
     return {"message": "This is the root of the Clarity Engine API"}
 
-@router.post("/process-document", tags=["Document Processing"])
-async def process_document(file: UploadFile = File(...)):
+async def _check_previous_document(previous_document_id: str | None):
+    if previous_document_id and await run_io(document_chunk_cache.get, previous_document_id) is None:
+        raise HTTPException(status_code=404, detail="Previous document ID not found.")
+
+async def _check_upload_request(mime_type: str | None, previous_document_id: str | None):
+    if not mime_type == "application/pdf":
+        raise HTTPException(status_code=400, detail="Invalid file type. Please upload a PDF.")
+    await _check_previous_document(previous_document_id)
+
+# The multipart form the upload endpoints read from the request body themselves.
+_UPLOAD_FORM = {
+    "requestBody": {
+        "required": True,
+        "content": {"multipart/form-data": {"schema": {
+            "type": "object",
+            "required": ["file"],
+            "properties": {
+                "file": {"type": "string", "format": "binary"},
+                "previous_document_id": {"type": "string"}
+            }
+        }}}
+    }
+}
+
+async def _receive_upload(request: Request) -> tuple[Upload, MultipartUpload]:
     """
-    Accepts a document, extracts text, generates a high-level summary,
-    identifies and summarizes sections, and prepares the document for Q&A.
+    Streams the multipart body into a spool file as it arrives, enforcing the size and
+    page limits, then checks the file type and previous_document_id.
     """
-    if not file.content_type == "application/pdf":
-        raise HTTPException(status_code=400, detail="Invalid file type. Please upload a PDF.")
+    try:
+        form = MultipartUpload(request.headers.get("content-type"))
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    try:
+        pending = bytearray()
+        async for chunk in request.stream():
+            pending.extend(chunk)
+            if len(pending) >= settings.upload_chunk_bytes:
+                await run_io(form.feed, bytes(pending))
+                pending.clear()
+        await run_io(form.feed, bytes(pending))
+        upload = await run_io(form.finish)
+    except UploadRejected as e:
+        await run_io(form.abort)
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except BaseException:
+        await run_io(form.abort)
+        raise
+    try:
+        await _check_upload_request(form.mime_type, form.fields.get("previous_document_id") or None)
+    except BaseException:
+        await run_io(discard_upload, upload)
+        raise
+    return upload, form
+
+async def _open_local(request: LocalUploadRequest) -> Upload:
+    """Accepts a file the Node backend wrote to the shared upload directory, in place."""
+    try:
+        return await run_io(open_local_upload, request.path, request.mime_type)
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
 
+async def _process_upload(upload: Upload, mime_type: str, filename: str | None, previous_document_id: str | None):
     try:
-        file_content = await file.read()
+        async with admission.admit(BULK):
+            try:
+                return await run_processing_pipeline(
+                    upload_path=upload.path,
+                    mime_type=mime_type,
+                    filename=filename,
+                    previous_document_id=previous_document_id,
+                    content_hash=upload.content_hash
+                )
 
-        # --- STAGE 1: Text Extraction with Document AI ---
-        print("Stage 1: Extracting text with Document AI...")
-        extracted_text = process_document_with_docai(
-            file_content=file_content,
-            mime_type=file.content_type
+            except Exception as e:
+                print(f"An error occurred in the processing pipeline: {e}")
+                raise HTTPException(status_code=500, detail=f"An error occurred in the processing pipeline: {str(e)}")
+    finally:
+        await run_io(discard_upload, upload)
+
+async def _queue_upload(upload: Upload, mime_type: str, filename: str | None, previous_document_id: str | None) -> dict:
+    try:
+        job_id = await job_queue.submit(
+            upload=upload,
+            filename=filename,
+            mime_type=mime_type,
+            previous_document_id=previous_document_id
         )
-        print("Text extraction complete.")
-
-        # --- STAGE 2: High-Level Summary Generation ---
-        print("Stage 2: Generating high-level summary...")
-        summary = get_summary_from_gemini(extracted_text)
-        
-        # --- STAGE 3: Section Identification & Summarization ---
-        print("Stage 3: Identifying and summarizing document sections...")
-        document_sections = get_document_structure_from_gemini(extracted_text)
-        
-        structured_summaries = []
-        for title, text in document_sections:
-            section_summary = get_summary_for_section_from_gemini(title, text)
-            structured_summaries.append({
-                "title": title,
-                "summary": section_summary
-            })
-        print("Section summarization complete.")
-
-        # --- STAGE 4: Semantic Chunking for Q&A ---
-        print("Stage 4: Generating semantic chunks for Q&A...")
-        semantic_chunks = get_semantic_chunks_from_gemini(extracted_text)
-        print("Semantic chunking complete.")
-
-        # --- STAGE 5: Embed and Store in Vector Search ---
-        if semantic_chunks:
-            document_id = str(uuid.uuid4())
-            print(f"Stage 5: Embedding and storing chunks for document ID: {document_id}")
-            
-            # Cache the text chunks for later retrieval during Q&A
-            document_chunk_cache[document_id] = semantic_chunks
-            embed_and_store_chunks(chunks=semantic_chunks)
-            print("Knowledge storing complete.")
-        else:
-            document_id = None
-            print("No chunks were generated for Q&A, skipping embedding stage.")
+    except BaseException:
+        await run_io(discard_upload, upload)
+        raise
+    return {
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": f"/api/jobs/{job_id}"
+    }
 
-        return {
-            "message": "Document processed successfully.",
-            "document_id": document_id,
-            "filename": file.filename,
-            "summary": summary,
-            "sections": structured_summaries,
-            "chunk_count": len(semantic_chunks)
-        }
-    
-    except Exception as e:
-        print(f"An error occurred in the processing pipeline: {e}")
-        raise HTTPException(status_code=500, detail=f"An error occurred in the processing pipeline: {str(e)}")
+@router.post("/process-document", tags=["Document Processing"], openapi_extra=_UPLOAD_FORM)
+async def process_document(request: Request):
+    """
+    Accepts a document, extracts text, generates a high-level summary,
+    identifies and summarizes sections, and prepares the document for Q&A.
+    Pass previous_document_id when the upload amends an already processed document.
+    """
+    upload, form = await _receive_upload(request)
+    return await _process_upload(
+        upload, form.mime_type, form.filename, form.fields.get("previous_document_id") or None
+    )
+
+@router.post("/process-document/local", tags=["Document Processing"])
+async def process_local_document(request: LocalUploadRequest):
+    """
+    Like /process-document, for a file the caller has already written under the
+    shared local_handoff_dir: only its path is sent, and it is read in place.
+    """
+    await _check_upload_request(request.mime_type, request.previous_document_id)
+    upload = await _open_local(request)
+    return await _process_upload(upload, request.mime_type, request.filename, request.previous_document_id)
     
-@router.post("/ask", tags=["Q&A"])
-async def ask_question(request: AskRequest):
+@router.post("/jobs", status_code=202, tags=["Document Processing"], openapi_extra=_UPLOAD_FORM)
+async def submit_processing_job(request: Request):
     """
-    Receives a question, retrieves context using FAISS, and generates a final answer.
+    Queues a document for background processing and returns a job ID immediately.
+    Poll /jobs/{job_id} for per-stage progress and partial results.
     """
-    print(f"Received question for document ID {request.document_id}: '{request.question}'")
+    job_queue.ensure_capacity()
+    upload, form = await _receive_upload(request)
+    return await _queue_upload(
+        upload, form.mime_type, form.filename, form.fields.get("previous_document_id") or None
+    )
 
-    # --- STAGE 1: Retrieve chunk INDICES from the vector store ---
-    relevant_chunk_indices = query_vector_store(request.question)
+@router.post("/jobs/local", status_code=202, tags=["Document Processing"])
+async def submit_local_processing_job(request: LocalUploadRequest):
+    """Like /jobs, for a file already written under the shared local_handoff_dir; it is not copied."""
+    await _check_upload_request(request.mime_type, request.previous_document_id)
+    job_queue.ensure_capacity()
+    upload = await _open_local(request)
+    return await _queue_upload(upload, request.mime_type, request.filename, request.previous_document_id)
 
-    if not relevant_chunk_indices:
-        return {
-            "question": request.question,
-            "answer": "Could not find any relevant information in the document to answer this question."
-        }
+@router.get("/jobs/{job_id}", tags=["Document Processing"])
+async def get_processing_job(job_id: str):
+    """
+    Reports a processing job's status, per-stage progress, and whatever results are ready:
+    the summary as soon as it is generated, and section summaries as each one finishes.
+    """
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job ID not found.")
+
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "filename": job["filename"],
+        "stages": job["stages"],
+        "partial_result": job["partial_result"],
+        "result": job.get("result"),
+        "error": job.get("error")
+    }
+
+def _cached_response(request: AskRequest, cached_answer: CachedAnswer) -> dict:
+    return {
+        "question": request.question,
+        "answer": cached_answer.answer,
+        "retrieved_context": cached_answer.context,
+        "cached": True
+    }
+
+async def _prepare_answer(request: AskRequest) -> tuple[dict | None, list[str], np.ndarray | None, list[int] | None]:
+    """
+    Runs the /ask steps that come before generation.
+
+    Returns (response, None, None, None) when the question is settled without Gemini
+    (cached answer, nothing relevant found), else (None, context chunks, query embedding,
+    exact chunk indices). When exact references settled the context, the query embedding
+    is None and the chunk indices are what the answer is cached under; otherwise they are None.
+    Raises 404 for an unknown document.
+    """
+    print(f"Received question for document ID {request.document_id}: '{request.question}'")
 
-    # --- STAGE 2: Map INDICES back to Text using the cache ---
-    retrieved_chunks_text = []
-    cached_chunks = document_chunk_cache.get(request.document_id, [])
+    cached_chunks = await run_io(document_chunk_cache.get, request.document_id, [])
 
-    if not cached_chunks:
+    if not cached_chunks or not await run_io(has_document, request.document_id):
          raise HTTPException(
              status_code=404,
              detail="Document ID not found or chunks are not cached. Please re-process the document."
          )
 
-    print(f"Mapping indices to text chunks: {relevant_chunk_indices}")
-    for index in relevant_chunk_indices:
-        if index < len(cached_chunks):
-            retrieved_chunks_text.append(cached_chunks[index])
+    # --- Exact references (a section number, a quoted term, an amount) need no embedding ---
+    if settings.exact_reference_lookup:
+        with span("exact_reference"):
+            exact = await run_cpu(lookup_exact_references, request.document_id, request.question, cached_chunks)
+        if exact:
+            retrieval_paths.inc(path="exact")
+            print(f"Exact references matched chunks {exact}; skipping the embedding and vector search.")
+            cached_answer = answer_cache.lookup_exact(request.document_id, request.question, exact)
+            cache_requests.inc(cache="answer", outcome="miss" if cached_answer is None else "hit")
+            if cached_answer is not None:
+                print("Answer cache hit (same question about the same chunks).")
+                return _cached_response(request, cached_answer), None, None, None
+            return None, [cached_chunks[i] for i in exact], None, exact
+
+    # --- STAGE 0: Reuse the answer to a near-identical earlier question ---
+    with span("query_embedding"):
+        query_embedding = await run_io(embed_query, request.question)
+    cached_answer = answer_cache.lookup(request.document_id, query_embedding)
+    cache_requests.inc(cache="answer", outcome="miss" if cached_answer is None else "hit")
+    if cached_answer is not None:
+        print(f"Answer cache hit (matched earlier question: '{cached_answer.question}').")
+        return _cached_response(request, cached_answer), None, None, None
+
+    # --- STAGE 1: Retrieve scored candidate chunks from the document's vector store ---
+    with span("vector_search"):
+        matches = await run_cpu(search_document, request.document_id, query_embedding)
 
-    if not retrieved_chunks_text:
+    if not matches:
+        return {
+            "question": request.question,
+            "answer": "Could not find any relevant information in the document to answer this question."
+        }, None, None, None
+
+    candidates = [
+        Candidate(index, cached_chunks[index], similarity)
+        for index, similarity in matches if index < len(cached_chunks)
+    ]
+    if settings.retrieval_mode == "hybrid":
+        with span("lexical_search"):
+            lexical_matches = await run_cpu(search_lexical, request.document_id, request.question, cached_chunks)
+        candidates = fuse_candidates(candidates, lexical_matches, cached_chunks)
+    retrieval_paths.inc(path=settings.retrieval_mode)
+    if not candidates:
         return {
             "question": request.question,
             "answer": "Found some related sections, but could not retrieve specific text to form an answer. The document might be structured in an unusual way."
-        }
+        }, None, None, None
 
-    # --- STAGE 3: Generate the Final Answer ---
-    print(f"Generating final answer with {len(retrieved_chunks_text)} context chunks...")
-    final_answer = get_answer_from_gemini(
-        context=retrieved_chunks_text,
-        question=request.question
-    )
+    # --- STAGE 2: Choose the context: similarity cutoff, re-ranking, MMR, token budget ---
+    with span("context_selection", candidates=len(candidates)):
+        vectors = await run_cpu(get_chunk_vectors, request.document_id, [c.chunk_index for c in candidates])
+        if vectors is not None:
+            rescore_with_vectors(candidates, vectors, query_embedding)
+        retrieved = await run_cpu(select_context, request.question, candidates, vectors)
+    print(f"Selected chunks {retrieved.chunk_indices} for the answer: {retrieved.stats}")
+    return None, retrieved.chunks, query_embedding, None
+
+def _remember_answer(request: AskRequest, answer: str, context: list[str],
+                     query_embedding: np.ndarray | None, exact: list[int] | None):
+    if query_embedding is not None or exact is not None:
+        answer_cache.store(request.document_id, request.question, query_embedding, answer, context, exact)
+
+@router.post("/ask", tags=["Q&A"])
+async def ask_question(request: AskRequest):
+    """
+    Receives a question, retrieves context using FAISS, and generates a final answer.
+    """
+    async with admission.admit(INTERACTIVE):
+        response, retrieved_chunks_text, query_embedding, exact = await _prepare_answer(request)
+        if response is not None:
+            return response
+
+        # --- STAGE 3: Generate the Final Answer ---
+        print(f"Generating final answer with {len(retrieved_chunks_text)} context chunks...")
+        with span("answer", context_chunks=len(retrieved_chunks_text)):
+            final_answer = await run_io(
+                get_answer_from_gemini,
+                context=retrieved_chunks_text,
+                question=request.question
+            )
+
+    if final_answer != ANSWER_ERROR_MESSAGE:
+        _remember_answer(request, final_answer, retrieved_chunks_text, query_embedding, exact)
 
     return {
         "question": request.question,
         "answer": final_answer,
-        "retrieved_context": retrieved_chunks_text
-    }
\ No newline at end of file
+        "retrieved_context": retrieved_chunks_text,
+        "cached": False
+    }
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@router.post("/ask/stream", tags=["Q&A"])
+async def ask_question_stream(request: AskRequest):
+    """
+    Streaming /ask as server-sent events: a `context` event with the retrieved
+    chunks, `token` events with answer text as Gemini generates it, then `done`
+    with the full answer (or `error`).
+    """
+    # The slot is held until the stream ends, not just until this handler returns.
+    ticket = await admission.acquire(INTERACTIVE)
+    try:
+        with work_priority(INTERACTIVE):
+            response, retrieved_chunks_text, query_embedding, exact = await _prepare_answer(request)
+    except BaseException:
+        admission.release(ticket)
+        raise
+
+    async def events():
+        try:
+            with work_priority(INTERACTIVE):
+                async for event in _answer_events():
+                    yield event
+        finally:
+            admission.release(ticket)
+
+    async def _answer_events():
+        if response is not None:
+            yield _sse("context", {"retrieved_context": response.get("retrieved_context", []), "cached": response.get("cached", False)})
+            yield _sse("token", {"text": response["answer"]})
+            yield _sse("done", {"answer": response["answer"], "cached": response.get("cached", False)})
+            return
+
+        yield _sse("context", {"retrieved_context": retrieved_chunks_text, "cached": False})
+        fragments = []
+        try:
+            with span("answer_stream", context_chunks=len(retrieved_chunks_text)):
+                async for text in stream_io(stream_answer_from_gemini, retrieved_chunks_text, request.question):
+                    fragments.append(text)
+                    yield _sse("token", {"text": text})
+        except Exception as e:
+            print(f"An error occurred while streaming the answer: {e}")
+            yield _sse("error", {"message": ANSWER_ERROR_MESSAGE})
+            return
+
+        final_answer = "".join(fragments).strip()
+        if final_answer and final_answer != ANSWER_ERROR_MESSAGE:
+            _remember_answer(request, final_answer, retrieved_chunks_text, query_embedding, exact)
+        yield _sse("done", {"answer": final_answer, "cached": False})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # Tell proxies not to buffer, or tokens arrive all at once at the end.
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # Frees the slot if the stream is never started (release is idempotent).
+        background=BackgroundTask(admission.release, ticket)
+    )
+
+@router.get("/answer-cache/stats", tags=["Q&A"])
+def answer_cache_stats():
+    """Hit/miss counters and size of the semantic answer cache."""
+    return answer_cache.stats()
+
+@router.get("/embeddings/stats", tags=["Q&A"])
+def embedding_stats():
+    """Throughput, batching and cache counters of the embedding service."""
+    return embedding_service.stats()
+
+async def _search_corpus(query: CorpusQuery) -> list[dict]:
+    """Embeds the question and returns the best matching chunks across the corpus, with their documents."""
+    with span("query_embedding"):
+        query_embedding = await run_io(embed_query, query.question)
+    with span("corpus_search", top_k=query.top_k):
+        hits = await run_cpu(
+            corpus_index.search, query_embedding, max(1, min(query.top_k, 100)),
+            document_ids=query.document_ids,
+            document_type=query.document_type,
+            uploaded_after=query.uploaded_after.timestamp() if query.uploaded_after else None,
+            uploaded_before=query.uploaded_before.timestamp() if query.uploaded_before else None
+        )
+
+    results = []
+    for hit in hits:
+        chunks = await run_io(document_chunk_cache.get, hit.document_id, [])
+        if hit.chunk_index >= len(chunks):
+            continue
+        results.append({
+            "document_id": hit.document_id,
+            "filename": hit.filename,
+            "document_type": hit.document_type,
+            "chunk_index": hit.chunk_index,
+            "score": hit.score,
+            "text": chunks[hit.chunk_index]
+        })
+    return results
+
+@router.post("/corpus/search", tags=["Corpus"])
+async def search_corpus(query: CorpusQuery):
+    """
+    Finds the chunks most similar to the question across every processed document.
+    Optional filters: document IDs, document type (e.g. "lease") and upload date range.
+    """
+    async with admission.admit(INTERACTIVE):
+        return {"question": query.question, "results": await _search_corpus(query)}
+
+@router.post("/corpus/ask", tags=["Corpus"])
+async def ask_corpus(query: CorpusQuery):
+    """Answers a question from the best matching chunks across the corpus, citing their documents."""
+    async with admission.admit(INTERACTIVE):
+        results = await _search_corpus(query)
+        if not results:
+            return {
+                "question": query.question,
+                "answer": "Could not find any relevant information in the selected documents to answer this question.",
+                "sources": []
+            }
+
+        # Label each excerpt with its document so the answer can say where a term comes from.
+        candidates = [
+            Candidate(
+                r["chunk_index"],
+                f"[Document: {r['filename'] or r['document_id']}"
+                f"{' (' + r['document_type'] + ')' if r['document_type'] else ''}]\n{r['text']}",
+                r["score"],
+                document_id=r["document_id"]
+            )
+            for r in results
+        ]
+        with span("context_selection", candidates=len(candidates)):
+            retrieved = await run_cpu(select_context, query.question, candidates)
+        selected = set(zip(retrieved.document_ids, retrieved.chunk_indices))
+        sources = [r for r in results if (r["document_id"], r["chunk_index"]) in selected]
+
+        print(f"Generating corpus answer from {len(retrieved.chunks)} chunks in {len({r['document_id'] for r in sources})} documents...")
+        with span("answer", context_chunks=len(retrieved.chunks)):
+            answer = await run_io(get_answer_from_gemini, context=retrieved.chunks, question=query.question)
+
+        return {"question": query.question, "answer": answer, "sources": sources}
+
+@router.get("/corpus/documents", tags=["Corpus"])
+async def list_corpus_documents():
+    """Documents in the corpus index with the metadata available for filtering."""
+    documents = await run_io(corpus_index.documents)
+    return [
+        {
+            "document_id": d.document_id,
+            "filename": d.filename,
+            "document_type": d.document_type,
+            "uploaded_at": datetime.fromtimestamp(d.uploaded_at).isoformat(),
+            "chunk_count": d.vector_count,
+            "superseded_by": d.superseded_by
+        }
+        for d in documents
+    ]
@@ -1 +1,58 @@
-document_chunk_cache = {}
\ No newline at end of file
+import threading
+from collections import OrderedDict
+
+from app.config import settings
+from app.core import document_store
+
+
+class DocumentChunkCache:
+    """
+    Maps document IDs to their text chunks.
+
+    Writes go straight to the on-disk document store. Reads are served from a
+    small LRU of memory-mapped chunk views and fall back to mapping the
+    document from disk, so chunks survive restarts and are shared by workers.
+    """
+
+    def __init__(self, max_documents: int):
+        self._max_documents = max_documents
+        self._entries: "OrderedDict[str, document_store.MappedChunks]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __setitem__(self, document_id: str, chunks: list[str]):
+        document_store.save_chunks(document_id, chunks)
+        with self._lock:
+            # Re-map from disk on next read so every worker reads the same pages.
+            self._entries.pop(document_id, None)
+
+    def __contains__(self, document_id: str) -> bool:
+        return self.get(document_id) is not None
+
+    def get(self, document_id: str, default=None):
+        with self._lock:
+            chunks = self._entries.get(document_id)
+            if chunks is not None:
+                self._entries.move_to_end(document_id)
+                return chunks
+
+        try:
+            chunks = document_store.load_chunks(document_id)
+        except ValueError:
+            return default
+        if chunks is None:
+            return default
+
+        with self._lock:
+            self._entries[document_id] = chunks
+            self._entries.move_to_end(document_id)
+            while len(self._entries) > self._max_documents:
+                self._entries.popitem(last=False)
+        return chunks
+
+    def pop(self, document_id: str, default=None):
+        with self._lock:
+            chunks = self._entries.pop(document_id, default)
+        return chunks
+
+
+document_chunk_cache = DocumentChunkCache(max_documents=settings.vector_store_max_documents)
@@ -3,10 +3,210 @@ from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
     """Loads and validates application settings from environment variables."""
-    google_cloud_project: str 
+    google_cloud_project: str
     google_cloud_location: str
     docai_processor_id: str
 
+    # --- Vector store registry ---
+    # Upper bounds for the per-document FAISS indexes kept in memory.
+    vector_store_max_documents: int = 256
+    vector_store_max_bytes: int = 512 * 1024 * 1024
+
+    # --- Persistent document store ---
+    # Per-document FAISS indexes and chunk files live here and are shared by all workers.
+    document_store_dir: str = "data/documents"
+
+    # --- Text extraction ---
+    # PDF pages with a usable text layer are read locally; the rest go to Document AI
+    # in page ranges of at most docai_pages_per_request (the synchronous API limit),
+    # with at most docai_max_concurrent_requests ranges in flight.
+    pdf_text_layer_enabled: bool = True
+    pdf_text_layer_min_chars: int = 40
+    docai_pages_per_request: int = 15
+    docai_max_concurrent_requests: int = 4
+
+    # --- Uploads ---
+    # Uploads are spooled to disk in upload_chunk_bytes pieces and refused once they pass
+    # max_upload_bytes or max_upload_pages. local_handoff_dir, when set, is a directory shared
+    # with the Node backend (its uploads/ folder): /process-document/local and /jobs/local then
+    # take a path under it instead of the file's bytes.
+    max_upload_bytes: int = 200 * 1024 * 1024
+    max_upload_pages: int = 2000
+    upload_chunk_bytes: int = 1024 * 1024
+    local_handoff_dir: str | None = None
+
+    # --- Processing pipeline ---
+    # Maximum section summaries in flight at once, and the timeout for any single LLM call.
+    section_summary_concurrency: int = 8
+    llm_call_timeout_seconds: float = 120.0
+
+    # --- Long document mode ---
+    # Text longer than one window is summarized and sectioned per window in parallel, then merged.
+    long_document_window_tokens: int = 25000
+    section_window_tokens: int = 2000
+    long_document_concurrency: int = 8
+
+    # --- Chunking for Q&A ---
+    # "local" (regex/layout clause chunker), "llm" (Gemini chunks the whole text),
+    # or "local+llm" (local chunks refined by Gemini window by window).
+    chunking_mode: str = "local"
+    chunk_min_tokens: int = 64
+    chunk_max_tokens: int = 400
+    chunk_overlap_tokens: int = 40
+
+    # --- Execution layer ---
+    # Thread pools for blocking network calls (Document AI, Gemini) and CPU work (embedding, FAISS).
+    io_executor_workers: int = 32
+    cpu_executor_workers: int = 2
+
+    # --- Admission control ---
+    # Concurrency cap, queue length and maximum queueing time per priority class
+    # ("interactive" questions, "section" summaries, "bulk" uploads; see app.core.admission).
+    # A negative queue length means unbounded. Requests turned away get 503 with a Retry-After
+    # of at most admission_max_retry_after_seconds. job_max_queued bounds the /jobs backlog.
+    admission_max_concurrent: dict[str, int] = {"interactive": 16, "section": 12, "bulk": 4}
+    admission_max_queued: dict[str, int] = {"interactive": 64, "section": -1, "bulk": 8}
+    admission_max_wait_seconds: dict[str, float] = {"interactive": 15.0, "bulk": 60.0}
+    admission_max_retry_after_seconds: int = 120
+    job_max_queued: int = 100
+
+    # --- Background processing jobs ---
+    # Job records and spooled uploads are kept on disk so unfinished jobs resume after a restart.
+    # Every server process polls the shared store every job_poll_seconds and claims queued jobs
+    # atomically. A claim is a lease of job_lease_seconds that the running process renews; a job
+    # whose lease runs out (its host died) is put back in the queue by any process. A job that
+    # fails with a transient error (Gemini or Document AI overloaded, timeouts) is retried after
+    # a jittered exponential backoff (job_retry_base_seconds doubling per attempt, at most
+    # job_retry_max_seconds) until it has been attempted job_max_attempts times; other errors
+    # fail it at once.
+    job_store_path: str = "data/jobs.sqlite3"
+    job_spool_dir: str = "data/uploads"
+    job_workers: int = 2
+    job_max_attempts: int = 3
+    job_poll_seconds: float = 5.0
+    job_lease_seconds: float = 60.0
+    job_retry_base_seconds: float = 30.0
+    job_retry_max_seconds: float = 600.0
+
+    # --- Processing result cache ---
+    # Results keyed by the SHA-256 of the uploaded PDF; least-recently-used entries go first.
+    result_cache_dir: str = "data/results"
+    result_cache_max_bytes: int = 2 * 1024 * 1024 * 1024
+
+    # --- Semantic answer cache ---
+    # A question reuses a stored answer when its embedding is at least this similar (cosine).
+    # Questions answered from exact references are not embedded; they reuse an answer to the
+    # same question (ignoring case and spacing) about the same chunks.
+    answer_cache_similarity_threshold: float = 0.92
+    answer_cache_ttl_seconds: float = 6 * 60 * 60
+    answer_cache_max_entries_per_document: int = 256
+
+    # --- Embedding service ---
+    # Concurrent uploads and queries are encoded together in micro-batches of up to
+    # embedding_batch_size texts; identical texts are served from a content-hash cache.
+    # Backend: "torch", "onnx" or "onnx-int8" (needs sentence-transformers[onnx]).
+    # embedding_threads=0 keeps the library's default thread count.
+    embedding_backend: str = "torch"
+    embedding_device: str = "cpu"
+    embedding_threads: int = 0
+    embedding_onnx_int8_file: str = "onnx/model_qint8_avx512.onnx"
+    embedding_batch_size: int = 64
+    embedding_batch_wait_ms: float = 5.0
+    embedding_cache_max_entries: int = 100_000
+
+    # --- Vector indexes ---
+    # "auto" uses exact search up to vector_index_flat_max vectors, HNSW up to
+    # vector_index_hnsw_max and IVF-PQ beyond; or pin "flat", "hnsw" or "ivfpq".
+    # hnsw_ef_search and ivf_nprobe trade recall for query latency.
+    vector_index_type: str = "auto"
+    vector_index_flat_max: int = 50_000
+    vector_index_hnsw_max: int = 2_000_000
+    hnsw_m: int = 32
+    hnsw_ef_construction: int = 200
+    hnsw_ef_search: int = 64
+    ivf_nprobe: int = 16
+    ivfpq_subquantizers: int = 48
+    ivfpq_bits: int = 8
+    vector_search_neighbours: int = 25
+
+    # --- Answer context selection ---
+    # Of the vector_search_neighbours candidates, keep those at least retrieval_min_similarity
+    # (cosine) and within retrieval_relative_margin of the best match, optionally re-rank them
+    # ("none", "lexical" or "cross-encoder"), then pick by MMR, skipping near-duplicates,
+    # until the token budget is used.
+    retrieval_min_similarity: float = 0.2
+    retrieval_relative_margin: float = 0.2
+    retrieval_min_chunks: int = 2
+    retrieval_reranker: str = "none"
+    retrieval_rerank_weight: float = 0.3
+    retrieval_cross_encoder_model: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+    retrieval_mmr_lambda: float = 0.7
+    retrieval_duplicate_similarity: float = 0.97
+    retrieval_context_token_budget: int = 1500
+
+    # --- Hybrid retrieval ---
+    # "hybrid" merges the vector and BM25 (app.core.lexical_index) rankings of a document's
+    # chunks by reciprocal-rank fusion (constant retrieval_rrf_k); "vector" uses FAISS alone.
+    # The retrieval_lexical_keep best lexical matches survive the similarity cutoff. A question
+    # whose exact references (section numbers, quoted terms, amounts) match at most
+    # exact_reference_max_chunks chunks is answered from those chunks without embedding it.
+    retrieval_mode: str = "hybrid"
+    retrieval_rrf_k: int = 60
+    retrieval_lexical_keep: int = 2
+    exact_reference_lookup: bool = True
+    exact_reference_max_chunks: int = 3
+
+    # --- Corpus-wide search ---
+    # One index over every document's chunks. Filters that leave at most
+    # corpus_exact_search_max_vectors vectors are searched exactly; larger ones
+    # are applied inside the ANN search.
+    corpus_dir: str = "data/corpus"
+    corpus_save_interval_seconds: float = 30.0
+    corpus_exact_search_max_vectors: int = 20_000
+
+    # --- Gemini client ---
+    # Every Gemini call goes through app.core.llm_client. Requests are paced per model by a
+    # token bucket (llm_requests_per_minute, bursts of llm_burst) shared by all requests, and
+    # retryable errors (429, 5xx, timeouts) are retried with jittered exponential backoff.
+    # Tasks in llm_hedge_tasks send a second request when the first has not answered after
+    # llm_hedge_after_seconds (0 disables hedging). llm_task_models routes tasks to another
+    # model; the rest use llm_default_model. Streamed answers (/ask/stream) run on the "answer"
+    # model but are never hedged. gemini_api_endpoint (e.g. "http://localhost:8090") points the
+    # client at another server, such as a local fake Gemini.
+    llm_default_model: str = "gemini-2.5-pro"
+    llm_task_models: dict[str, str] = {
+        "section_summary": "gemini-2.5-flash",
+        "section_titles": "gemini-2.5-flash",
+    }
+    llm_requests_per_minute: dict[str, float] = {"gemini-2.5-pro": 150, "gemini-2.5-flash": 1000}
+    llm_burst: int = 10
+    llm_max_attempts: int = 4
+    llm_backoff_base_seconds: float = 1.0
+    llm_backoff_max_seconds: float = 30.0
+    llm_hedge_after_seconds: float = 0.0
+    llm_hedge_tasks: list[str] = ["answer", "section_summary", "section_titles"]
+    gemini_api_endpoint: str | None = None
+
+    # --- Document context ---
+    # A document that fits in one long-document window is uploaded once to Gemini's context
+    # cache, and the summary, structure and section-summary prompts refer to the cached text
+    # instead of resending it. A cache belongs to one model: it is created for
+    # document_context_model (unset: the section_summary model, the task with the most calls),
+    # and a task routed to another model keeps that model and sends its text inline. Gemini
+    # does not cache fewer than 1,024 tokens (2.5 Flash) and small documents gain little, so
+    # shorter texts are sent inline as before.
+    document_context_enabled: bool = True
+    document_context_model: str | None = None
+    document_context_min_tokens: int = 2048
+    document_context_ttl_seconds: int = 900
+
+    # --- Shared resources and startup ---
+    # Load the embedding model and FAISS and create clients at startup. In the background
+    # the server accepts requests at once and GET /ready reports when warm-up is done.
+    preload_models: bool = True
+    warm_up_in_background: bool = True
+    docai_client_pool_size: int = 4
+
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
@@ -0,0 +1,173 @@
+import asyncio
+import contextvars
+import math
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from app.config import settings
+from app.core.metrics import admission_in_flight, admission_queue_depth, admission_wait, admission_rejections
+
+# --- Admission Control ---
+# Every unit of work runs in one of three priority classes:
+#   interactive  questions and searches (/ask, /ask/stream, /corpus/*)
+#   section      section summaries of documents being processed
+#   bulk         processing an upload (/process-document and job workers)
+# Each class runs at most admission_max_concurrent[class] units at once. The
+# rest wait in a bounded queue; a request that finds the queue full, or waits
+# longer than admission_max_wait_seconds[class], is turned away with 503 and
+# a Retry-After estimated from how long the class's work has been taking.
+# Internal work (job workers, section summaries) waits instead of failing.
+#
+# The class also sets the priority of the work's Gemini requests (the rate
+# limiter serves waiting requests in priority order) so a burst of uploads
+# cannot push questions to the back of the shared quota.
+
+INTERACTIVE = "interactive"
+SECTION = "section"
+BULK = "bulk"
+
+# Lower runs first; the same convention as the embedding service.
+PRIORITIES = {INTERACTIVE: 0, SECTION: 1, BULK: 2}
+
+_priority_var: contextvars.ContextVar[int] = contextvars.ContextVar("work_priority", default=PRIORITIES[BULK])
+
+
+def current_priority() -> int:
+    """Priority of the work running in this context (carried into run_io / run_cpu threads)."""
+    return _priority_var.get()
+
+
+@contextmanager
+def work_priority(work_class: str):
+    token = _priority_var.set(PRIORITIES[work_class])
+    try:
+        yield
+    finally:
+        _priority_var.reset(token)
+
+
+class Overloaded(Exception):
+    """Raised when a work class cannot take more work. The API answers 503 with Retry-After."""
+
+    def __init__(self, work_class: str, retry_after: int):
+        super().__init__(f"The server is busy with {work_class} work; retry in {retry_after}s.")
+        self.work_class = work_class
+        self.retry_after = retry_after
+
+
+class _WorkClass:
+    def __init__(self, name: str, max_concurrent: int, max_queued: int, max_wait: float | None):
+        self.name = name
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queued = max_queued
+        self.max_wait = max_wait
+        self.semaphore = asyncio.Semaphore(self.max_concurrent)
+        self.running = 0
+        self.waiting = 0
+        # Exponentially weighted average of how long one unit of work holds its slot.
+        self.average_seconds = 1.0
+
+    def retry_after(self) -> int:
+        queued_rounds = (self.waiting + self.max_concurrent) / self.max_concurrent
+        return max(1, min(settings.admission_max_retry_after_seconds, math.ceil(self.average_seconds * queued_rounds)))
+
+
+class Ticket:
+    """A slot held in a work class; hand it back with AdmissionController.release."""
+
+    def __init__(self, work_class: _WorkClass):
+        self.work_class = work_class
+        self.started = time.perf_counter()
+        self.released = False
+
+
+class AdmissionController:
+    """
+    Per-class concurrency caps with bounded waiting queues. Usable as soon as it is
+    built; start() rebuilds the classes from the current settings when the server starts.
+    """
+
+    def __init__(self):
+        self._classes = self._build_classes()
+
+    @staticmethod
+    def _build_classes() -> dict[str, _WorkClass]:
+        return {
+            name: _WorkClass(
+                name,
+                settings.admission_max_concurrent.get(name, 1),
+                settings.admission_max_queued.get(name, -1),
+                settings.admission_max_wait_seconds.get(name)
+            )
+            for name in PRIORITIES
+        }
+
+    def start(self):
+        self._classes = self._build_classes()
+
+    async def acquire(self, work_class: str, reject: bool = True) -> Ticket:
+        """
+        Waits for a slot in the class. With reject=True raises Overloaded when the
+        queue is full or the wait exceeds the class's limit; otherwise waits as long as needed.
+        """
+        cls = self._classes[work_class]
+        if reject and cls.max_queued >= 0 and cls.semaphore.locked() and cls.waiting >= cls.max_queued:
+            raise self.reject(work_class, "queue_full")
+
+        start = time.perf_counter()
+        cls.waiting += 1
+        admission_queue_depth.set(cls.waiting, work_class=work_class)
+        try:
+            await asyncio.wait_for(cls.semaphore.acquire(), timeout=cls.max_wait if reject else None)
+        except asyncio.TimeoutError:
+            raise self.reject(work_class, "wait_timeout") from None
+        finally:
+            cls.waiting -= 1
+            admission_queue_depth.set(cls.waiting, work_class=work_class)
+        admission_wait.observe(time.perf_counter() - start, work_class=work_class)
+
+        cls.running += 1
+        admission_in_flight.set(cls.running, work_class=work_class)
+        return Ticket(cls)
+
+    def release(self, ticket: Ticket):
+        """Frees the ticket's slot. Releasing a ticket twice is a no-op."""
+        if ticket.released:
+            return
+        ticket.released = True
+        cls = ticket.work_class
+        held = time.perf_counter() - ticket.started
+        cls.average_seconds = 0.8 * cls.average_seconds + 0.2 * held
+        cls.running -= 1
+        admission_in_flight.set(cls.running, work_class=cls.name)
+        cls.semaphore.release()
+
+    def reject(self, work_class: str, reason: str) -> Overloaded:
+        """Counts a rejection and returns the Overloaded error to raise."""
+        admission_rejections.inc(work_class=work_class, reason=reason)
+        return Overloaded(work_class, self._classes[work_class].retry_after())
+
+    @asynccontextmanager
+    async def admit(self, work_class: str, reject: bool = True):
+        """Holds a slot in the class, at the class's priority, for the duration of the block."""
+        ticket = await self.acquire(work_class, reject=reject)
+        try:
+            with work_priority(work_class):
+                yield
+        finally:
+            self.release(ticket)
+
+    def stats(self) -> dict:
+        return {
+            name: {
+                "running": cls.running,
+                "waiting": cls.waiting,
+                "max_concurrent": cls.max_concurrent,
+                "max_queued": cls.max_queued,
+                "average_seconds": round(cls.average_seconds, 3)
+            }
+            for name, cls in self._classes.items()
+        }
+
+
+admission = AdmissionController()
@@ -0,0 +1,188 @@
+import math
+
+import numpy as np
+
+from app.config import settings
+
+# --- Vector Index Factory ---
+# All indexes use inner product over L2-normalized vectors, i.e. cosine
+# similarity; search scores are higher-is-better. The index type follows the
+# number of vectors unless vector_index_type pins it:
+#   flat   exact IndexFlatIP          up to vector_index_flat_max vectors
+#   hnsw   IndexHNSWFlat graph        up to vector_index_hnsw_max vectors
+#   ivfpq  IndexIVFPQ, trained        beyond that (compressed, approximate)
+# Every type supports add() after it is built, without retraining or rebuilding.
+# Recall/latency is tuned per search with hnsw_ef_search and ivf_nprobe.
+# faiss is imported on first use (see app.core.resources).
+
+INDEX_FLAT = "flat"
+INDEX_HNSW = "hnsw"
+INDEX_IVFPQ = "ivfpq"
+INDEX_TYPES = (INDEX_FLAT, INDEX_HNSW, INDEX_IVFPQ)
+
+# Below this many training vectors per centroid k-means is unreliable (FAISS warns at 39).
+_MIN_POINTS_PER_CENTROID = 39
+
+
+def normalize(embeddings: np.ndarray) -> np.ndarray:
+    """Returns a float32, C-contiguous, L2-normalized copy of the embeddings."""
+    import faiss
+
+    vectors = np.array(embeddings, dtype=np.float32, order="C", copy=True).reshape(-1, embeddings.shape[-1])
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def choose_index_type(num_vectors: int) -> str:
+    if settings.vector_index_type != "auto":
+        return settings.vector_index_type
+    if num_vectors <= settings.vector_index_flat_max:
+        return INDEX_FLAT
+    if num_vectors <= settings.vector_index_hnsw_max:
+        return INDEX_HNSW
+    return INDEX_IVFPQ
+
+
+def _build_ivfpq(vectors: np.ndarray) -> "faiss.Index | None":
+    """Trains an IVF-PQ index on the vectors. Returns None if there are too few to train it."""
+    import faiss
+
+    num_vectors, dim = vectors.shape
+    min_training_size = 2 ** settings.ivfpq_bits * _MIN_POINTS_PER_CENTROID
+    if num_vectors < min_training_size or dim % settings.ivfpq_subquantizers != 0:
+        return None
+    # The usual sqrt(n) rule of thumb, capped so every list gets enough training points.
+    nlist = max(1, min(4 * int(math.sqrt(num_vectors)), num_vectors // _MIN_POINTS_PER_CENTROID))
+    quantizer = faiss.IndexFlatIP(dim)
+    index = faiss.IndexIVFPQ(
+        quantizer, dim, nlist, settings.ivfpq_subquantizers, settings.ivfpq_bits, faiss.METRIC_INNER_PRODUCT
+    )
+    training_size = min(num_vectors, max(nlist * 256, min_training_size))
+    sample = vectors[np.random.default_rng(0).choice(num_vectors, training_size, replace=False)]
+    index.train(sample)
+    # The index must own its quantizer, or it is freed when this function returns.
+    index.own_fields = True
+    quantizer.this.disown()
+    return index
+
+
+def build_index(embeddings: np.ndarray, index_type: str | None = None) -> "faiss.Index":
+    """
+    Builds a cosine-similarity index over the embeddings.
+
+    Args:
+        embeddings: float array of shape (n, dim). Normalized here; the input is not modified.
+        index_type: One of INDEX_TYPES, or None to choose by size and settings.
+    """
+    import faiss
+
+    vectors = normalize(embeddings)
+    num_vectors, dim = vectors.shape
+    index_type = index_type or choose_index_type(num_vectors)
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown vector index type: {index_type!r}")
+
+    index = None
+    if index_type == INDEX_IVFPQ:
+        index = _build_ivfpq(vectors)
+        if index is None:
+            print(f"Too few vectors ({num_vectors}) to train IVF-PQ; using HNSW instead.")
+            index_type = INDEX_HNSW
+    if index_type == INDEX_HNSW:
+        index = faiss.IndexHNSWFlat(dim, settings.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = settings.hnsw_ef_construction
+    if index_type == INDEX_FLAT:
+        index = faiss.IndexFlatIP(dim)
+
+    index.add(vectors)
+    return index
+
+
+def index_type_of(index: "faiss.Index") -> str:
+    import faiss
+
+    if isinstance(index, faiss.IndexIVF):
+        return INDEX_IVFPQ
+    if isinstance(index, faiss.IndexHNSW):
+        return INDEX_HNSW
+    return INDEX_FLAT
+
+
+def add_to_index(index: "faiss.Index", embeddings: np.ndarray):
+    """Adds embeddings to an existing, writable index. New vectors get the next sequential ids."""
+    import faiss
+
+    if index.metric_type == faiss.METRIC_INNER_PRODUCT:
+        index.add(normalize(embeddings))
+    else:
+        index.add(np.ascontiguousarray(embeddings, dtype=np.float32))
+
+
+def _search_parameters(index: "faiss.Index", selector, selected_fraction: float):
+    import faiss
+
+    # A filter hides most graph neighbours / list entries; widen the search to compensate.
+    widen = min(16.0, 1.0 / max(selected_fraction, 1e-6))
+    extra = {"sel": selector} if selector is not None else {}
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(efSearch=int(settings.hnsw_ef_search * widen), **extra)
+    if isinstance(index, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(nprobe=min(index.nlist, int(settings.ivf_nprobe * widen)), **extra)
+    if selector is not None:
+        return faiss.SearchParameters(**extra)
+    return None
+
+
+def search(
+    index: "faiss.Index",
+    query_embeddings: np.ndarray,
+    k: int,
+    selector=None,
+    selected_fraction: float = 1.0
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns (scores, ids) for the k nearest vectors of each query, best first.
+
+    Cosine indexes return similarities. Indexes built before the switch to
+    cosine (IndexFlatL2) are searched as they were and return L2 distances.
+    Pass a faiss IDSelector to restrict the search to some ids, along with the
+    fraction of the index it selects. Missing results have id -1.
+    """
+    import faiss
+
+    if index.metric_type == faiss.METRIC_INNER_PRODUCT:
+        queries = normalize(query_embeddings)
+    else:
+        queries = np.ascontiguousarray(query_embeddings, dtype=np.float32)
+    k = min(k, index.ntotal)
+    if k <= 0:
+        return np.zeros((len(queries), 0), dtype=np.float32), np.zeros((len(queries), 0), dtype=np.int64)
+    params = _search_parameters(index, selector, selected_fraction)
+    if params is None:
+        return index.search(queries, k)
+    return index.search(queries, k, params=params)
+
+
+def to_similarity(index: "faiss.Index", scores: np.ndarray) -> np.ndarray:
+    """
+    Converts search scores to cosine similarity. Inner-product scores already are;
+    squared L2 distances from older IndexFlatL2 indexes over unit vectors map as 1 - d/2.
+    """
+    import faiss
+
+    if index.metric_type == faiss.METRIC_L2:
+        return 1.0 - scores / 2.0
+    return scores
+
+
+def index_size_bytes(index: "faiss.Index") -> int:
+    """Approximate memory footprint of an index."""
+    import faiss
+
+    if isinstance(index, faiss.IndexIVFPQ):
+        # PQ code plus a 64-bit id per vector, and the coarse centroids.
+        return index.ntotal * (index.pq.code_size + 8) + index.nlist * index.d * 4
+    if isinstance(index, faiss.IndexHNSW):
+        # Full vectors plus roughly 2*M neighbour links (int32) on the base level.
+        return index.ntotal * (index.d * 4 + index.hnsw.nb_neighbors(0) * 4)
+    return index.ntotal * index.d * 4
@@ -0,0 +1,143 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+
+from app.config import settings
+
+
+@dataclass
+class CachedAnswer:
+    question: str
+    answer: str
+    context: list[str]
+    # None for answers found by exact references, which are never embedded.
+    embedding: np.ndarray | None
+    created_at: float
+    # The chunks exact references selected; None for answers found by embedding.
+    chunk_indices: tuple[int, ...] | None = None
+
+
+class SemanticAnswerCache:
+    """
+    Per-document cache of answered questions, looked up by embedding similarity.
+
+    A new question reuses a stored answer when its (normalized) query embedding
+    has cosine similarity >= `similarity_threshold` with a previously answered
+    question for the same document. Questions answered from exact references
+    have no embedding; they are looked up by their normalized text and the
+    chunks the references selected (lookup_exact). Entries expire after
+    `ttl_seconds`; each document keeps at most `max_entries_per_document`
+    answers, and at most `max_documents` documents are tracked, both evicted
+    least-recently-used.
+    """
+
+    def __init__(self, similarity_threshold: float, ttl_seconds: float,
+                 max_entries_per_document: int, max_documents: int):
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries_per_document = max_entries_per_document
+        self.max_documents = max_documents
+        self.hits = 0
+        self.misses = 0
+        self._documents: "OrderedDict[str, OrderedDict[str, CachedAnswer]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(embedding: np.ndarray) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    @staticmethod
+    def _key(question: str) -> str:
+        return " ".join(question.lower().split())
+
+    def _live_entries(self, document_id: str) -> "OrderedDict[str, CachedAnswer] | None":
+        """The document's unexpired entries, marked recently used. Call with the lock held."""
+        entries = self._documents.get(document_id)
+        if not entries:
+            return None
+        now = time.time()
+        for key in [k for k, e in entries.items() if now - e.created_at > self.ttl_seconds]:
+            del entries[key]
+        self._documents.move_to_end(document_id)
+        return entries
+
+    def lookup(self, document_id: str, query_embedding: np.ndarray) -> CachedAnswer | None:
+        query = self._normalize(query_embedding)
+        with self._lock:
+            entries = self._live_entries(document_id)
+            keys = [k for k, e in (entries or {}).items() if e.embedding is not None]
+            if not keys:
+                self.misses += 1
+                return None
+
+            similarities = np.stack([entries[k].embedding for k in keys]) @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.similarity_threshold:
+                self.misses += 1
+                return None
+
+            entries.move_to_end(keys[best])
+            self.hits += 1
+            return entries[keys[best]]
+
+    def lookup_exact(self, document_id: str, question: str, chunk_indices: list[int]) -> CachedAnswer | None:
+        """The answer to the same question (up to case and spacing) from the same chunks."""
+        with self._lock:
+            entries = self._live_entries(document_id)
+            entry = entries.get(self._key(question)) if entries else None
+            if entry is None or entry.chunk_indices != tuple(chunk_indices):
+                self.misses += 1
+                return None
+            entries.move_to_end(self._key(question))
+            self.hits += 1
+            return entry
+
+    def store(self, document_id: str, question: str, query_embedding: np.ndarray | None,
+              answer: str, context: list[str], chunk_indices: list[int] | None = None):
+        """Stores an answer under its query embedding, or, for exact references, under the chunks they selected."""
+        entry = CachedAnswer(
+            question=question,
+            answer=answer,
+            context=list(context),
+            embedding=None if query_embedding is None else self._normalize(query_embedding),
+            created_at=time.time(),
+            chunk_indices=None if chunk_indices is None else tuple(chunk_indices)
+        )
+        key = self._key(question)
+        with self._lock:
+            entries = self._documents.setdefault(document_id, OrderedDict())
+            self._documents.move_to_end(document_id)
+            entries[key] = entry
+            entries.move_to_end(key)
+            while len(entries) > self.max_entries_per_document:
+                entries.popitem(last=False)
+            while len(self._documents) > self.max_documents:
+                self._documents.popitem(last=False)
+
+    def invalidate(self, document_id: str):
+        with self._lock:
+            self._documents.pop(document_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "documents": len(self._documents),
+                "entries": sum(len(entries) for entries in self._documents.values())
+            }
+
+
+answer_cache = SemanticAnswerCache(
+    similarity_threshold=settings.answer_cache_similarity_threshold,
+    ttl_seconds=settings.answer_cache_ttl_seconds,
+    max_entries_per_document=settings.answer_cache_max_entries_per_document,
+    max_documents=settings.vector_store_max_documents
+)
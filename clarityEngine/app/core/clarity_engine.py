@@ -1,26 +1,40 @@
-import os
-import google.generativeai as genai
 import json
 import re
-from dotenv import load_dotenv
-
-load_dotenv()
-api_key = os.getenv("GEMINI_API_KEY")
-genai.configure(api_key=api_key)
-
-LATEST_MODEL = 'gemini-2.5-pro'
-
-def get_summary_from_gemini(full_text: str) -> str:
+import time
+from collections.abc import Iterator
+from app.config import settings
+from app.core import llm_client
+from app.core.document_context import DocumentContext, describe_excerpt
+from app.core.metrics import record_llm_call, llm_time_to_first_token
+from app.core.segmentation import FALLBACK_TITLE, SectionSpan, segment_sections
+
+# Tasks not routed elsewhere by settings.llm_task_models use this model.
+LATEST_MODEL = settings.llm_default_model
+# Bump whenever a prompt below changes, so cached results built with the old prompt are invalidated.
+PROMPT_VERSION = 4
+
+ANSWER_ERROR_MESSAGE = "An error occurred while generating the answer. Please try again."
+# get_semantic_chunks_from_gemini reports failures as a single chunk starting with this text.
+CHUNKING_ERROR_PREFIX = "Error processing document:"
+
+def get_summary_from_gemini(full_text: str, context: DocumentContext | None = None) -> str:
     """
     Generates a high-level summary of the provided text using the Gemini API.
+    With a context, the prompt refers to the cached copy of the text instead of including it.
     """
     print("Generating document summary with Gemini...")
     
     # Limit the text to avoid exceeding model token limits for very large documents
     max_chars = 100000
     truncated_text = full_text[:max_chars]
+    if context is not None:
+        document = "The document is the text provided in your context."
+    else:
+        document = f"""Here is the document text:
+        ---
+        {truncated_text}
+        ---"""
 
-    model = genai.GenerativeModel(LATEST_MODEL)
     
     prompt = f"""
         You are an expert document analyst. 
@@ -36,15 +50,12 @@ def get_summary_from_gemini(full_text: str) -> str:
         - Keep it professional, neutral, and free of filler phrases (e.g., avoid "Of course," "I have analyzed," etc.).
         - Do not add commentary or interpretations beyond the text.
 
-        Here is the document text:
-        ---
-        {truncated_text}
-        ---
+        {document}
         """
 
     
     try:
-        response = model.generate_content(prompt)
+        response = llm_client.generate("summary", prompt, cached_content=context and context.cache)
         summary = response.text
         print("Summary generation successful.")
         return summary
@@ -52,16 +63,23 @@ def get_summary_from_gemini(full_text: str) -> str:
         print(f"An error occurred during summary generation: {e}")
         return "Could not generate a summary for this document."
 
-def get_document_structure_from_gemini(full_text: str) -> list:
+def get_section_titles_from_gemini(text: str, context: DocumentContext | None = None) -> list[str]:
     """
-    Analyzes the full text to identify and extract the main sections.
-    Returns a list of tuples, where each tuple is (section_title, section_text).
+    Asks Gemini for the titles of the main sections in the text, in document order.
+    Returns an empty list if no numbered titles could be parsed from the response.
+    Raises on API errors so callers can choose their own fallback.
+    With a context, `text` must be the whole cached text.
     """
-    print("Identifying document structure with Gemini...")
-    model = genai.GenerativeModel(LATEST_MODEL)
 
     # Limit text to a reasonable size to ensure performance and avoid token limits
-    truncated_text = full_text[:100000]
+    truncated_text = text[:100000]
+    if context is not None:
+        document = "the document provided in your context."
+    else:
+        document = f"""
+    ---
+    {truncated_text}
+    ---"""
 
     prompt = f"""
     Analyze the following document text and identify its primary sections.
@@ -80,61 +98,51 @@ def get_document_structure_from_gemini(full_text: str) -> list:
     4. Term and Termination (Part 2)
     5. Governing Law
 
-    DOCUMENT TEXT:
-    ---
-    {truncated_text}
-    ---
+    DOCUMENT TEXT: {document}
     """
 
-    try:
-        response = model.generate_content(prompt)
-        # Use regex to find all lines that start with a number, a dot, and a space
-        section_titles = re.findall(r"^\s*\d+\.\s*(.+)$", response.text, re.MULTILINE)
-
-        if not section_titles:
-            return [("Overall Summary", full_text)]
-
-        structured_content = []
-        # Create a regex pattern to split the text by any of the found titles
-        split_pattern = '|'.join([re.escape(title.strip()) for title in section_titles])
-        
-        parts = re.split(f'({split_pattern})', full_text, flags=re.IGNORECASE)
-        
-        content_cursor = 0
-        if len(parts) > 1:
-            # The first part is everything before the first title
-            content_cursor = parts.index(next((s for s in parts if s.strip() in section_titles), None)) + 1
-
-        for title in section_titles:
-            title = title.strip()
-            # Find the index of the title in the split parts list
-            try:
-                # Find the title (case-insensitive) in the parts list starting from the cursor
-                temp_parts = [p.lower().strip() for p in parts[content_cursor:]]
-                title_index_in_temp = temp_parts.index(title.lower())
-                title_index_in_parts = content_cursor + title_index_in_temp
-
-                # The content is the very next item in the list
-                content = parts[title_index_in_parts + 1]
-                structured_content.append((title, content))
-                content_cursor = title_index_in_parts + 2
-            except (ValueError, IndexError):
-                continue
+    response = llm_client.generate("section_titles", prompt, cached_content=context and context.cache)
+    # Use regex to find all lines that start with a number, a dot, and a space
+    return re.findall(r"^\s*\d+\.\s*(.+)$", response.text, re.MULTILINE)
 
-        print(f"Successfully identified {len(structured_content)} sections.")
-        return structured_content
+def get_document_structure_from_gemini(full_text: str, context: DocumentContext | None = None) -> list[SectionSpan]:
+    """
+    Analyzes the full text to identify the main sections.
+    Returns (section_title, start, end) spans into full_text.
+    """
+    print("Identifying document structure with Gemini...")
+    try:
+        section_titles = get_section_titles_from_gemini(full_text, context)
+        return segment_sections(full_text, section_titles)
 
     except Exception as e:
         print(f"An error occurred during structure identification: {e}")
-        return [("Overall Summary", full_text)]
+        return [SectionSpan(FALLBACK_TITLE, 0, len(full_text))]
 
 
-def get_summary_for_section_from_gemini(section_title: str, section_text: str) -> str:
+def get_summary_for_section_from_gemini(
+    section_title: str,
+    section_text: str,
+    context: DocumentContext | None = None,
+    start: int | None = None
+) -> str:
     """
     Generates a concise summary for a specific section of the document.
+    With a context and the section's offset in the cached text, the section is
+    identified there instead of being included, when it can be told apart.
     """
     print(f"Summarizing section: '{section_title}'...")
-    model = genai.GenerativeModel(LATEST_MODEL)
+    excerpt = None
+    if context is not None and start is not None:
+        excerpt = describe_excerpt(context, start, start + len(section_text))
+    if excerpt is not None:
+        section = f"{excerpt} (in your context)."
+    else:
+        context = None
+        section = f"""
+        ---
+        {section_text[:8000]} 
+        ---"""
 
     prompt = f"""
         You are an expert legal assistant. Provide a **concise, executive-level summary** of the following document section. 
@@ -148,28 +156,98 @@ def get_summary_for_section_from_gemini(section_title: str, section_text: str) -
 
         **SECTION TITLE:** "{section_title}"
 
-        **SECTION TEXT:**
-        ---
-        {section_text[:8000]} 
-        ---
+        **SECTION TEXT:** {section}
         """
 
 
     try:
-        response = model.generate_content(prompt)
+        response = llm_client.generate("section_summary", prompt, cached_content=context and context.cache)
         return response.text.strip()
     except Exception as e:
         print(f"Could not summarize section '{section_title}': {e}")
         return "Summary could not be generated for this section."
 
+def get_partial_summary_from_gemini(window_text: str, part_number: int, total_parts: int) -> str:
+    """
+    Summarizes one window of a document too long to summarize in a single call.
+    The partial summaries are merged by get_combined_summary_from_gemini.
+    """
+    print(f"Summarizing document window {part_number}/{total_parts}...")
+
+    prompt = f"""
+        You are an expert document analyst. The text below is part {part_number} of {total_parts} of a longer document.
+        Summarize this part so it can later be merged with the summaries of the other parts.
+
+        Instructions:
+        - If this part reveals the **document type**, **primary purpose** or **key parties**, state them.
+        - Capture the **most important terms, obligations, dates, amounts, and details** in this part.
+        - Use concise Markdown bullet points with **bold text** for key terms.
+        - Do not add commentary, introductions, or interpretations beyond the text.
+
+        Here is part {part_number} of the document text:
+        ---
+        {window_text}
+        ---
+        """
+
+    try:
+        response = llm_client.generate("partial_summary", prompt)
+        return response.text.strip()
+    except Exception as e:
+        print(f"Could not summarize document window {part_number}: {e}")
+        return ""
+
+def get_combined_summary_from_gemini(partial_summaries: list[str], section_title: str | None = None) -> str:
+    """
+    Merges summaries of consecutive parts into a single summary.
+    With a section_title, the result follows the section-summary format; otherwise the document-summary format.
+    """
+    print(f"Combining {len(partial_summaries)} partial summaries...")
+    joined = "\n\n".join(
+        f"PART {i} SUMMARY:\n{summary}" for i, summary in enumerate(partial_summaries, start=1)
+    )
+
+    if section_title is None:
+        instructions = """
+        - Do NOT define or explain what the document type is.
+        - Clearly state the **document type** at the start (e.g., "Lease Agreement", "Résumé", "Policy Document").
+        - Identify the **primary purpose** of the document.
+        - List the **key parties** (if applicable).
+        - Highlight the **most important terms, obligations, dates, or details**."""
+        subject = "the entire document"
+    else:
+        instructions = """
+        - Focus only on the key points, obligations, and takeaways from this section.
+        - Include a final **Conclusion** section summarizing the overall implications or action items."""
+        subject = f'the document section "{section_title}"'
+
+    prompt = f"""
+        You are an expert document analyst. The summaries below cover consecutive parts of {subject}, in order.
+        Merge them into a single **concise, high-level** summary of {subject}.
+
+        Instructions:{instructions}
+        - Remove repetition between parts; keep every distinct important fact.
+        - Use Markdown with headings, bullet points, and **bold text** for readability.
+        - Keep it professional, neutral, and free of filler phrases (e.g., avoid "Of course," "I have analyzed," etc.).
+        - Do not add commentary or interpretations beyond the summaries.
+
+        Here are the partial summaries:
+        ---
+        {joined}
+        ---
+        """
+
+    try:
+        response = llm_client.generate("combined_summary", prompt)
+        return response.text.strip()
+    except Exception as e:
+        print(f"An error occurred while combining partial summaries: {e}")
+        # Concatenating the parts still covers the whole text.
+        return "\n\n".join(summary for summary in partial_summaries if summary)
+
 def get_semantic_chunks_from_gemini(text_content: str) -> list[str]:
     
     try:
-        model = genai.GenerativeModel(
-            LATEST_MODEL,
-            generation_config={"response_mime_type": "application/json"}
-        )
-
         prompt = f"""
         You are an expert AI assistant specializing in legal document processing.
         Your task is to break down the following legal document into its core semantic chunks.
@@ -188,19 +266,19 @@ def get_semantic_chunks_from_gemini(text_content: str) -> list[str]:
         ---
         """
 
-        response = model.generate_content(prompt)
+        response = llm_client.generate(
+            "chunking", prompt, generation_config={"response_mime_type": "application/json"}
+        )
         chunks_data = json.loads(response.text)
         return chunks_data.get("chunks", [])
     except Exception as e:
         print(f"An error occurred while calling the Gemini API: {e}")
-        return [f"Error processing document: {e}"]
+        return [f"{CHUNKING_ERROR_PREFIX} {e}"]
     
-def get_answer_from_gemini(context: list[str], question: str) -> str:
-    try:
-        model = genai.GenerativeModel(LATEST_MODEL)
-        context_string = "\n\n---\n\n".join(context)
+def _build_answer_prompt(context: list[str], question: str) -> str:
+    context_string = "\n\n---\n\n".join(context)
 
-        prompt = f"""
+    return f"""
         You are a helpful AI advisor named "Clarity," explaining a legal document to a client.
         Your purpose is to help users understand complex legal information in simple terms.
         You will be given a context containing relevant excerpts from a document and a user's question.
@@ -225,8 +303,39 @@ def get_answer_from_gemini(context: list[str], question: str) -> str:
         ANSWER:
         """
 
-        response = model.generate_content(prompt)
+def get_answer_from_gemini(context: list[str], question: str) -> str:
+    try:
+        prompt = _build_answer_prompt(context, question)
+
+        response = llm_client.generate("answer", prompt)
         return response.text.strip()
     except Exception as e:
         print(f"An error occurred during final answer generation: {e}")
-        return "An error occurred while generating the answer. Please try again."
\ No newline at end of file
+        return ANSWER_ERROR_MESSAGE
+
+def stream_answer_from_gemini(context: list[str], question: str) -> Iterator[str]:
+    """
+    Same answer as get_answer_from_gemini, yielded as text fragments while Gemini generates them.
+    Raises on API errors, including mid-stream, so the caller can tell the client.
+    Runs on the "answer" task's model; metrics label it "answer_stream".
+    """
+    prompt = _build_answer_prompt(context, question)
+    model_name = llm_client.model_for_task("answer")
+
+    start = time.perf_counter()
+    response = None
+    first_fragment = True
+    try:
+        model_name, response = llm_client.open_stream("answer", prompt, label="answer_stream")
+        for chunk in response:
+            text = chunk.text
+            if not text:
+                continue
+            if first_fragment:
+                llm_time_to_first_token.observe(time.perf_counter() - start, task="answer_stream", model=model_name)
+                first_fragment = False
+            yield text
+    except Exception as e:
+        record_llm_call("answer_stream", model_name, prompt, None, time.perf_counter() - start, error=e)
+        raise
+    record_llm_call("answer_stream", model_name, prompt, response, time.perf_counter() - start)
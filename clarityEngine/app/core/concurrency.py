@@ -0,0 +1,140 @@
+import asyncio
+import contextvars
+import functools
+import inspect
+import threading
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterable, Iterator
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import TypeVar
+
+from app.config import settings
+
+T = TypeVar("T")
+
+# --- Execution Layer ---
+# Blocking work never runs on the event loop. Network-bound SDK calls
+# (Document AI, Gemini) go to a wide I/O pool where threads mostly wait;
+# CPU-bound work (embedding, FAISS search) goes to a narrow pool sized so
+# concurrent uploads queue for cores instead of thrashing them. Embedding
+# calls wait on the I/O pool too: the encoding itself runs on the embedding
+# service's own thread (see app.core.embeddings).
+io_executor = ThreadPoolExecutor(
+    max_workers=settings.io_executor_workers, thread_name_prefix="clarity-io"
+)
+cpu_executor = ThreadPoolExecutor(
+    max_workers=settings.cpu_executor_workers, thread_name_prefix="clarity-cpu"
+)
+
+
+async def _run_in_executor(executor: Executor, func: Callable[..., T], args, kwargs, timeout: float | None) -> T:
+    loop = asyncio.get_running_loop()
+    # Carry context variables (e.g. the request's trace ID) into the worker thread.
+    context = contextvars.copy_context()
+    future = loop.run_in_executor(executor, functools.partial(context.run, func, *args, **kwargs))
+    return await asyncio.wait_for(future, timeout)
+
+
+async def run_io(func: Callable[..., T], *args, timeout: float | None = None, **kwargs) -> T:
+    """
+    Runs a blocking network call (Document AI, Gemini) on the I/O pool and awaits its result.
+
+    Args:
+        func: The blocking callable.
+        timeout: Seconds to wait before raising asyncio.TimeoutError. None waits forever.
+
+    Note: on timeout the worker thread is abandoned, not killed; its result is discarded.
+    """
+    return await _run_in_executor(io_executor, func, args, kwargs, timeout)
+
+
+async def run_cpu(func: Callable[..., T], *args, timeout: float | None = None, **kwargs) -> T:
+    """Runs CPU-bound work (embedding, FAISS search) on the CPU pool and awaits its result."""
+    return await _run_in_executor(cpu_executor, func, args, kwargs, timeout)
+
+
+async def run_llm_call(func: Callable[..., T], *args, fallback: T) -> T:
+    """
+    Runs one blocking LLM call on the I/O pool with the configured per-call timeout.
+    A call that times out yields `fallback` instead of failing the whole pipeline.
+    """
+    try:
+        return await run_io(func, *args, timeout=settings.llm_call_timeout_seconds)
+    except asyncio.TimeoutError:
+        print(f"{func.__name__} timed out after {settings.llm_call_timeout_seconds}s.")
+        return fallback
+
+
+async def stream_io(func: Callable[..., Iterator[T]], *args, **kwargs) -> AsyncIterator[T]:
+    """
+    Runs a blocking generator (e.g. a streaming Gemini call) on the I/O pool and
+    yields its items as they are produced. If the consumer stops early, the
+    generator is closed after its next item.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    finished = object()
+    stopped = threading.Event()
+
+    def send(item, error=None):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, (item, error))
+        except RuntimeError:
+            # The event loop has shut down; nobody is listening any more.
+            stopped.set()
+
+    def produce():
+        try:
+            for item in func(*args, **kwargs):
+                if stopped.is_set():
+                    break
+                send(item)
+        except BaseException as e:
+            send(finished, e)
+        else:
+            send(finished)
+
+    context = contextvars.copy_context()
+    loop.run_in_executor(io_executor, context.run, produce)
+    try:
+        while True:
+            item, error = await queue.get()
+            if item is finished:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stopped.set()
+
+
+async def gather_bounded(awaitables: Iterable[Awaitable[T]], limit: int) -> list[T]:
+    """
+    Awaits every awaitable with at most `limit` of them running at once.
+    Results are returned in input order, like asyncio.gather. If one raises,
+    the rest are cancelled (and waited for) before the error propagates.
+    """
+    semaphore = asyncio.Semaphore(max(1, limit))
+
+    async def _bounded(awaitable: Awaitable[T]) -> T:
+        async with semaphore:
+            return await awaitable
+
+    awaitables = list(awaitables)
+    tasks = [asyncio.ensure_future(_bounded(a)) for a in awaitables]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # Coroutines still queued for a slot never started; close them so they are not left unawaited.
+        for awaitable in awaitables:
+            if inspect.iscoroutine(awaitable) and inspect.getcoroutinestate(awaitable) == inspect.CORO_CREATED:
+                awaitable.close()
+        raise
+
+
+def shutdown_executors():
+    """Stops accepting work and lets in-flight calls finish. Called on application shutdown."""
+    io_executor.shutdown(wait=False, cancel_futures=True)
+    cpu_executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,519 @@
+import asyncio
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+import numpy as np
+
+from app.config import settings
+from app.core import ann_index, document_store
+from app.core.concurrency import cpu_executor, run_io
+
+# --- Corpus-wide Index ---
+# Every processed document's chunk embeddings are also added to one corpus
+# index, so a question can be asked across all documents at once:
+#   <corpus_dir>/corpus.sqlite3   one row per document: metadata and its vector id range
+#   <corpus_dir>/index.faiss      the corpus FAISS index (built by app.core.ann_index)
+# A document's vectors occupy one contiguous id range, so a hit maps back to
+# (document, chunk position) with a binary search and a metadata filter
+# becomes a set of ranges.
+#
+# Filters are applied before the search when they leave few vectors (exact
+# search over just those vectors) and during it otherwise (an IDSelector
+# bitmap passed to FAISS). The catalog is written on every add; the index is
+# saved periodically and at shutdown, and vectors missing from it after a
+# crash are re-added from the per-document indexes on load.
+#
+# Several server processes may share the directory. The catalog is the
+# source of truth: id ranges are allocated inside a catalog write
+# transaction, and each process keeps its in-memory index in step with the
+# catalog, adding documents other processes cataloged from their
+# per-document indexes. Searches share the index; adding vectors and
+# swapping in a rebuilt index (built off the lock as the corpus grows)
+# briefly take it exclusively.
+#
+# A document superseded by a newer version (see app.core.versions) stays in
+# the index but is left out of searches unless it is asked for by ID.
+
+CATALOG_FILENAME = "corpus.sqlite3"
+INDEX_FILENAME = "index.faiss"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    ordinal INTEGER PRIMARY KEY,
+    document_id TEXT NOT NULL UNIQUE,
+    filename TEXT,
+    document_type TEXT,
+    uploaded_at REAL NOT NULL,
+    first_vector INTEGER NOT NULL,
+    vector_count INTEGER NOT NULL,
+    superseded_by TEXT
+)
+"""
+
+# How many vectors the index file on disk holds, so a process never overwrites it with a shorter one.
+_SAVED_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS saved_index (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    vector_count INTEGER NOT NULL
+)
+"""
+
+_DOCUMENT_TYPE_LINE = re.compile(r"document\s+type\W*\s*(.+)", re.IGNORECASE)
+
+
+def extract_document_type(summary: str) -> str | None:
+    """
+    Reads the document type from a Gemini summary, which states it at the start
+    (e.g. "**Document Type:** Residential Lease Agreement" or "# Lease Agreement").
+    """
+    lines = [line.strip() for line in (summary or "").splitlines() if line.strip()]
+    for line in lines[:5]:
+        match = _DOCUMENT_TYPE_LINE.search(line)
+        if match:
+            return match.group(1).strip(" *_#:").strip() or None
+    if lines:
+        first = lines[0].strip(" *_#:").strip()
+        if 0 < len(first) <= 80:
+            return first
+    return None
+
+
+@dataclass
+class CorpusDocument:
+    document_id: str
+    filename: str | None
+    document_type: str | None
+    uploaded_at: float
+    first_vector: int
+    vector_count: int
+    superseded_by: str | None = None
+
+
+@dataclass
+class CorpusHit:
+    document_id: str
+    filename: str | None
+    document_type: str | None
+    chunk_index: int
+    score: float
+
+
+class _ReadWriteLock:
+    """Many readers or one writer. A waiting writer goes first, so a stream of searches cannot starve an add."""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._condition:
+            while self._writing or self._writers_waiting:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._condition:
+            self._writers_waiting += 1
+            while self._writing or self._readers:
+                self._condition.wait()
+            self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+
+class CorpusIndex:
+    """
+    Cosine-similarity index over the chunks of every processed document, with document metadata.
+    Apart from start() and stop(), every method blocks; call through run_cpu / run_io.
+    The catalog and index are loaded on first use (or by the startup warm-up).
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._index = None
+        self._documents: list[CorpusDocument] = []
+        self._by_id: dict[str, CorpusDocument] = {}
+        self._first_vectors = np.zeros(0, dtype=np.int64)
+        self._superseded_count = 0
+        self._dirty = False
+        self._loaded = False
+        self._saver: asyncio.Task | None = None
+        # FAISS does not allow searching an index while vectors are being added to it:
+        # searches share the read side, adding vectors and swapping the index take the write side.
+        self._lock = _ReadWriteLock()
+        # Serializes bringing the in-memory copy up to date with the catalog.
+        self._sync_lock = threading.Lock()
+        # Kept open to read PRAGMA data_version, which changes whenever another connection commits.
+        self._watch: sqlite3.Connection | None = None
+        self._catalog_version: int | None = None
+        self._last_ordinal = 0
+        self._upgrade: Future | None = None
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(os.path.join(self.directory, CATALOG_FILENAME), timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def load(self):
+        """Opens the catalog and index, re-adding any documents the saved index is missing."""
+        if self._loaded:
+            return
+        with self._sync_lock:
+            if self._loaded:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            with self._connect() as conn:
+                conn.execute(_SCHEMA)
+                conn.execute(_SAVED_INDEX_SCHEMA)
+                columns = {row["name"] for row in conn.execute("PRAGMA table_info(documents)")}
+                if "superseded_by" not in columns:
+                    conn.execute("ALTER TABLE documents ADD COLUMN superseded_by TEXT")
+            self._watch = sqlite3.connect(
+                os.path.join(self.directory, CATALOG_FILENAME), timeout=30, check_same_thread=False
+            )
+
+            import faiss
+            index_path = os.path.join(self.directory, INDEX_FILENAME)
+            if os.path.exists(index_path):
+                self._index = faiss.read_index(index_path)
+            self._sync_catalog()
+            self._loaded = True
+            print(f"Corpus index loaded: {len(self._documents)} documents, {self.vector_count} vectors.")
+
+    def refresh(self):
+        """
+        Picks up documents other server processes added to the catalog. Skipped if
+        another thread is already doing it, so searches never queue behind a sync.
+        """
+        self.load()
+        if not self._sync_lock.acquire(blocking=False):
+            return
+        try:
+            self._sync_catalog()
+        finally:
+            self._sync_lock.release()
+
+    def _sync_catalog(self, own_vectors: dict[str, np.ndarray] | None = None):
+        """
+        Appends catalog rows added since the last sync, with their vectors, in id order.
+        Vectors come from `own_vectors` for documents this process just added and from
+        the per-document indexes otherwise. Caller holds the sync lock.
+        """
+        version = self._watch.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._catalog_version:
+            return
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT * FROM documents WHERE ordinal > ? ORDER BY ordinal", (self._last_ordinal,)
+            ).fetchall()
+            superseded = {
+                row["document_id"]: row["superseded_by"]
+                for row in conn.execute("SELECT document_id, superseded_by FROM documents WHERE superseded_by IS NOT NULL")
+            }
+
+        # Gathered before taking the write lock: reading a per-document index can take a while.
+        indexed = self.vector_count
+        documents, vectors = [], []
+        for row in rows:
+            document = CorpusDocument(
+                row["document_id"], row["filename"], row["document_type"],
+                row["uploaded_at"], row["first_vector"], row["vector_count"]
+            )
+            end = document.first_vector + document.vector_count
+            if end > indexed:
+                if document.first_vector != indexed:
+                    raise RuntimeError(f"Corpus index is inconsistent with its catalog at document {document.document_id}")
+                own = (own_vectors or {}).get(document.document_id)
+                vectors.append(own if own is not None else self._stored_vectors(document))
+                indexed = end
+            documents.append(document)
+
+        with self._lock.write():
+            if vectors:
+                self._add_vectors(np.concatenate(vectors).astype(np.float32, copy=False))
+                self._dirty = True
+            self._documents.extend(documents)
+            self._by_id.update((document.document_id, document) for document in documents)
+            if documents:
+                self._first_vectors = np.append(self._first_vectors, [d.first_vector for d in documents])
+                self._last_ordinal = rows[-1]["ordinal"]
+            for document in self._documents:
+                document.superseded_by = superseded.get(document.document_id)
+            self._superseded_count = sum(1 for document_id in superseded if document_id in self._by_id)
+            self._catalog_version = version
+        self._upgrade_if_needed()
+
+    @staticmethod
+    def _stored_vectors(document: CorpusDocument) -> np.ndarray:
+        source = document_store.load_index(document.document_id)
+        if source is None or source.ntotal != document.vector_count:
+            raise RuntimeError(f"Cannot restore corpus vectors for document {document.document_id}")
+        if ann_index.index_type_of(source) == ann_index.INDEX_IVFPQ:
+            # IVF-PQ keeps only compressed codes: the vectors it decodes are close to, not
+            # equal to, the originals. Some FAISS builds also need a direct map to find them by id.
+            import faiss
+            faiss.extract_index_ivf(source).make_direct_map()
+        return source.reconstruct_n(0, source.ntotal)
+
+    def _add_vectors(self, embeddings: np.ndarray):
+        """Caller holds the write lock."""
+        if self._index is None:
+            self._index = ann_index.build_index(embeddings)
+        else:
+            ann_index.add_to_index(self._index, embeddings)
+
+    def _upgrade_if_needed(self):
+        """
+        Starts rebuilding the index as the next type up once the corpus outgrows the
+        current one. The rebuild runs on the CPU pool without holding the lock.
+        """
+        if self._index is None or (self._upgrade is not None and not self._upgrade.done()):
+            return
+        current = ann_index.index_type_of(self._index)
+        wanted = ann_index.choose_index_type(self._index.ntotal)
+        if wanted == current or current == ann_index.INDEX_IVFPQ:
+            return
+        self._upgrade = cpu_executor.submit(self._rebuild, wanted)
+
+    def _rebuild(self, index_type: str):
+        try:
+            with self._lock.read():
+                count = self._index.ntotal
+                vectors = self._index.reconstruct_n(0, count)
+            print(f"Corpus reached {count} vectors; rebuilding its index as {index_type}...")
+            start = time.perf_counter()
+            rebuilt = ann_index.build_index(vectors, index_type)
+            with self._sync_lock, self._lock.write():
+                # Documents added while the new index was being built.
+                if self._index.ntotal > count:
+                    ann_index.add_to_index(rebuilt, self._index.reconstruct_n(count, self._index.ntotal - count))
+                self._index = rebuilt
+                self._dirty = True
+            print(f"Corpus index rebuilt in {time.perf_counter() - start:.1f}s.")
+        except Exception as e:
+            print(f"Could not rebuild the corpus index: {e}")
+
+    @property
+    def vector_count(self) -> int:
+        return self._index.ntotal if self._index is not None else 0
+
+    def has_document(self, document_id: str) -> bool:
+        self.refresh()
+        return document_id in self._by_id
+
+    def add_document(
+        self,
+        document_id: str,
+        filename: str | None,
+        summary: str,
+        embeddings: np.ndarray,
+        supersedes: str | None = None
+    ):
+        """
+        Adds a document's chunk embeddings (in chunk order) to the corpus. A document is added once.
+        `supersedes` names the earlier version this document replaces in searches.
+        """
+        self.load()
+        if len(embeddings) == 0:
+            return
+        document_type = extract_document_type(summary)
+        with self._connect() as conn:
+            # BEGIN IMMEDIATE takes the catalog's write lock, so server processes adding
+            # documents at the same time are given consecutive, non-overlapping id ranges.
+            conn.execute("BEGIN IMMEDIATE")
+            added = conn.execute("SELECT 1 FROM documents WHERE document_id = ?", (document_id,)).fetchone() is None
+            if added:
+                first_vector = conn.execute(
+                    "SELECT COALESCE(MAX(first_vector + vector_count), 0) FROM documents"
+                ).fetchone()[0]
+                conn.execute(
+                    "INSERT INTO documents (document_id, filename, document_type, uploaded_at,"
+                    " first_vector, vector_count) VALUES (?, ?, ?, ?, ?, ?)",
+                    (document_id, filename, document_type, time.time(), first_vector, len(embeddings))
+                )
+                if supersedes is not None:
+                    conn.execute(
+                        "UPDATE documents SET superseded_by = ? WHERE document_id = ?", (document_id, supersedes)
+                    )
+        with self._sync_lock:
+            self._sync_catalog(own_vectors={document_id: embeddings})
+        if added:
+            print(f"Added document ID {document_id} to the corpus index ({document_type or 'unknown type'}).")
+
+    def supersede(self, document_id: str, newer_document_id: str):
+        """Leaves document_id out of searches from now on in favour of newer_document_id."""
+        self.load()
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE documents SET superseded_by = ? WHERE document_id = ?", (newer_document_id, document_id)
+            )
+        with self._sync_lock:
+            self._sync_catalog()
+
+    def save(self):
+        """
+        Writes the index to disk if documents were added since the last save, unless
+        another server process has already saved one with at least as many vectors.
+        """
+        if not self._loaded:
+            return
+        self.refresh()
+        with self._lock.read():
+            if not self._dirty or self._index is None:
+                return
+            import faiss
+            index = self._index
+            data = faiss.serialize_index(index)
+            count = index.ntotal
+        with self._connect() as conn:
+            # Held while writing, so two processes never replace each other's newer file.
+            conn.execute("BEGIN IMMEDIATE")
+            saved = conn.execute("SELECT vector_count FROM saved_index").fetchone()
+            if saved is None or saved["vector_count"] < count:
+                document_store.atomic_write(
+                    os.path.join(self.directory, INDEX_FILENAME), lambda f: f.write(data.tobytes())
+                )
+                conn.execute("INSERT OR REPLACE INTO saved_index (id, vector_count) VALUES (0, ?)", (count,))
+        # Clean only once the index is on disk, and only if nothing was added or
+        # rebuilt while it was being written; a failed write leaves it dirty.
+        with self._lock.write():
+            if self._index is index and index.ntotal == count:
+                self._dirty = False
+
+    async def start(self, save_interval_seconds: float):
+        """Starts saving the index every save_interval_seconds."""
+        self._saver = asyncio.create_task(self._save_periodically(save_interval_seconds))
+
+    async def _save_periodically(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await run_io(self.save)
+            except OSError as e:
+                print(f"Could not save the corpus index: {e}")
+
+    async def stop(self):
+        if self._saver is not None:
+            self._saver.cancel()
+            self._saver = None
+        await run_io(self.save)
+
+    def documents(self) -> list[CorpusDocument]:
+        self.refresh()
+        with self._lock.read():
+            return list(self._documents)
+
+    def _matching_documents(self, document_ids, document_type, uploaded_after, uploaded_before) -> list[CorpusDocument]:
+        wanted_ids = set(document_ids) if document_ids else None
+        wanted_type = document_type.lower() if document_type else None
+        return [
+            document for document in self._documents
+            if (document.document_id in wanted_ids if wanted_ids is not None else document.superseded_by is None)
+            and (wanted_type is None or wanted_type in (document.document_type or "").lower())
+            and (uploaded_after is None or document.uploaded_at >= uploaded_after)
+            and (uploaded_before is None or document.uploaded_at < uploaded_before)
+        ]
+
+    def search(
+        self,
+        query_embedding: np.ndarray,
+        k: int,
+        document_ids: list[str] | None = None,
+        document_type: str | None = None,
+        uploaded_after: float | None = None,
+        uploaded_before: float | None = None
+    ) -> list[CorpusHit]:
+        """
+        Returns up to k chunks most similar to the query across the documents matching every filter.
+
+        Args:
+            document_ids: Only these documents. Without it, superseded versions are left out.
+            document_type: Case-insensitive substring of the type read from the summary, e.g. "lease".
+            uploaded_after / uploaded_before: Unix timestamps bounding the processing time.
+        """
+        self.refresh()
+        with self._lock.read():
+            if self._index is None or k <= 0:
+                return []
+            filtered = self._superseded_count > 0 or any(
+                f is not None for f in (document_ids, document_type, uploaded_after, uploaded_before)
+            )
+            if not filtered:
+                scores, ids = ann_index.search(self._index, query_embedding, k)
+            else:
+                selected = self._matching_documents(document_ids, document_type, uploaded_after, uploaded_before)
+                selected_count = sum(document.vector_count for document in selected)
+                if selected_count == 0:
+                    return []
+                if selected_count <= settings.corpus_exact_search_max_vectors and self._can_reconstruct():
+                    scores, ids = self._exact_search(query_embedding, k, selected)
+                else:
+                    scores, ids = self._selector_search(query_embedding, k, selected, selected_count)
+            return self._to_hits(scores[0], ids[0])
+
+    def _can_reconstruct(self) -> bool:
+        return ann_index.index_type_of(self._index) != ann_index.INDEX_IVFPQ
+
+    def _exact_search(self, query_embedding: np.ndarray, k: int, selected: list[CorpusDocument]):
+        """Pre-filter: brute-force cosine search over just the selected documents' vectors."""
+        ids = np.concatenate([
+            np.arange(d.first_vector, d.first_vector + d.vector_count, dtype=np.int64) for d in selected
+        ])
+        vectors = np.concatenate([self._index.reconstruct_n(d.first_vector, d.vector_count) for d in selected])
+        scores = vectors @ ann_index.normalize(query_embedding)[0]
+        top = np.argsort(-scores)[:k]
+        return scores[top][None, :], ids[top][None, :]
+
+    def _selector_search(self, query_embedding: np.ndarray, k: int, selected: list[CorpusDocument], selected_count: int):
+        """In-search filter: FAISS skips vectors outside the selected documents' id ranges."""
+        import faiss
+
+        mask = np.zeros(self._index.ntotal, dtype=bool)
+        for document in selected:
+            mask[document.first_vector:document.first_vector + document.vector_count] = True
+        bitmap = np.packbits(mask, bitorder="little")
+        selector = faiss.IDSelectorBitmap(len(mask), faiss.swig_ptr(bitmap))
+        # `bitmap` must stay alive until the search returns; the selector only points at it.
+        scores, ids = ann_index.search(
+            self._index, query_embedding, k, selector=selector, selected_fraction=selected_count / len(mask)
+        )
+        del bitmap
+        return scores, ids
+
+    def _to_hits(self, scores: np.ndarray, ids: np.ndarray) -> list[CorpusHit]:
+        hits = []
+        for score, vector_id in zip(scores.tolist(), ids.tolist()):
+            if vector_id < 0:
+                continue
+            position = int(np.searchsorted(self._first_vectors, vector_id, side="right")) - 1
+            document = self._documents[position]
+            hits.append(CorpusHit(
+                document.document_id, document.filename, document.document_type,
+                vector_id - document.first_vector, float(score)
+            ))
+        return hits
+
+
+corpus_index = CorpusIndex(settings.corpus_dir)
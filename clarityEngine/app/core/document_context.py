@@ -0,0 +1,105 @@
+from dataclasses import dataclass, field
+
+from google.generativeai import caching
+
+from app.config import settings
+from app.core import llm_client
+
+# --- Document Context ---
+# The summary, the section titles and every section summary are prompts about
+# the same extracted text. Instead of pasting the text (or a slice of it) into
+# each prompt, the pipeline uploads it once to Gemini's context cache and each
+# prompt refers to it:
+#   - the summary and title prompts refer to "the document in your context",
+#   - a section-summary prompt identifies its section by title and by the
+#     shortest runs of opening and closing words that occur nowhere else in
+#     the text; a passage that is short or cannot be told apart that way
+#     (repeated boilerplate) is sent inline.
+# Gemini bills cached tokens at a reduced rate and each request carries only
+# its instructions. A cache belongs to one model, so only tasks that run on
+# that model use it and the others keep their model and send text inline.
+# The cache is deleted when the pipeline finishes and expires after
+# document_context_ttl_seconds in any case. When it cannot be created, every
+# prompt falls back to sending its text inline.
+
+_CONTEXT_TEMPLATE = """The user's document follows. Later requests about "the document" refer to this text.
+
+DOCUMENT TEXT:
+---
+{text}
+---
+"""
+
+# Lengths, in words, tried in turn for a passage's opening and closing anchors.
+_ANCHOR_WORDS = (8, 16, 32)
+
+
+@dataclass
+class DocumentContext:
+    """
+    A document's extracted text, uploaded once to Gemini's context cache for one model.
+    `normalized_text` is the text with its whitespace collapsed, computed once for describe_excerpt.
+    """
+    text: str
+    model: str
+    cache: caching.CachedContent
+    normalized_text: str = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.normalized_text = " ".join(self.text.split())
+
+
+def context_model() -> str:
+    """The model caches are created for: document_context_model, else the section_summary model."""
+    return settings.document_context_model or llm_client.model_for_task("section_summary")
+
+
+def create_document_context(text: str) -> DocumentContext | None:
+    """
+    Uploads the text to Gemini's context cache. Returns None if the upload fails,
+    in which case callers send the text inline. Blocking; call through run_io.
+    """
+    model = context_model()
+    try:
+        cache = llm_client.create_cache(model, _CONTEXT_TEMPLATE.format(text=text), settings.document_context_ttl_seconds)
+    except Exception as e:
+        print(f"Could not cache the document text with Gemini ({e}); sending it with each prompt instead.")
+        return None
+    print(f"Cached the document text with Gemini as {cache.name}.")
+    return DocumentContext(text, model, cache)
+
+
+def context_for_task(context: DocumentContext | None, task: str) -> DocumentContext | None:
+    """The context if `task` runs on the cache's model; otherwise None, and the task sends its text inline."""
+    if context is None or llm_client.model_for_task(task) != context.model:
+        return None
+    return context
+
+
+def close_document_context(context: DocumentContext):
+    """Deletes the cache. Blocking; call through run_io."""
+    llm_client.delete_cache(context.cache)
+
+
+def _unique_anchor(normalized_text: str, words: list[str], from_end: bool) -> str | None:
+    for count in _ANCHOR_WORDS:
+        anchor = " ".join(words[-count:] if from_end else words[:count])
+        if normalized_text.count(anchor) == 1:
+            return anchor
+    return None
+
+
+def describe_excerpt(context: DocumentContext, start: int, end: int) -> str | None:
+    """
+    Identifies context.text[start:end] by opening and closing words that occur once in the
+    text, for prompts that refer to the cached copy. Returns None if the passage is short or
+    cannot be told apart that way; the caller then sends the passage itself.
+    """
+    words = context.text[start:end].split()
+    if len(words) <= 2 * _ANCHOR_WORDS[-1]:
+        return None
+    opening = _unique_anchor(context.normalized_text, words, from_end=False)
+    closing = _unique_anchor(context.normalized_text, words, from_end=True)
+    if opening is None or closing is None:
+        return None
+    return f'the passage of the document that begins with "{opening}" and ends with "{closing}"'
@@ -1,5 +1,56 @@
+import io
+from dataclasses import dataclass
+
 from google.cloud import documentai
+from pypdf import PdfReader, PdfWriter
+
 from app.config import settings
+from app.core.concurrency import run_io, run_cpu, gather_bounded
+from app.core.resources import get_docai_client
+from app.core.uploads import read_upload
+
+# --- Text Extraction ---
+# extract_document_text() is the pipeline's extraction stage:
+#   1. Born-digital PDF pages are read from their text layer with pypdf.
+#   2. The remaining pages (scans, images) are grouped into contiguous ranges of
+#      at most docai_pages_per_request pages and sent to Document AI in
+#      parallel, bounded by docai_max_concurrent_requests. Each range is
+#      written out as a small PDF only when its request starts.
+#   3. Page texts are joined in page order; ExtractedDocument.page_offsets keeps
+#      where each page starts in the joined text.
+# Non-PDF uploads, and PDFs pypdf cannot read, go to Document AI in one request.
+# The upload is read from its spool file: pypdf seeks through it instead of
+# loading it, so only the OCR page ranges in flight (or a document that goes to
+# Document AI whole) are ever held in memory.
+
+PAGE_SEPARATOR = "\n\n"
+
+
+@dataclass
+class ExtractedDocument:
+    text: str
+    # Character offset in `text` where each page starts.
+    page_offsets: list[int]
+    text_layer_pages: int = 0
+    ocr_pages: int = 0
+
+    @property
+    def page_count(self) -> int:
+        return len(self.page_offsets)
+
+
+def _process(file_content: bytes, mime_type: str) -> documentai.Document:
+    client = get_docai_client()
+
+    name = client.processor_path(
+        settings.google_cloud_project, settings.google_cloud_location, settings.docai_processor_id
+    )
+    raw_document = documentai.RawDocument(content=file_content, mime_type=mime_type)
+
+    request = documentai.ProcessRequest(name=name, raw_document=raw_document)
+    result = client.process_document(request=request)
+    return result.document
+
 
 def process_document_with_docai(
     file_content: bytes,
@@ -11,22 +62,140 @@ def process_document_with_docai(
     Args:
         file_content: The raw bytes of the file.
         mime_type: The MIME type of the file (e.g., 'application/pdf')
-    
+
     Returns:
         The extracted text content of the document as a single string.
     """
-    opts = {"api_endpoint": f"{settings.google_cloud_location}-documentai.googleapis.com"}
-    
+    return _process(file_content, mime_type).text
 
-    client = documentai.DocumentProcessorServiceClient(client_options=opts)
 
-    name = client.processor_path(
-        settings.google_cloud_project, settings.google_cloud_location, settings.docai_processor_id
-    )
-    raw_document = documentai.RawDocument(content=file_content, mime_type=mime_type)
+def process_pages_with_docai(file_content: bytes, mime_type: str) -> list[str]:
+    """Like process_document_with_docai, but returns the text of each page separately."""
+    document = _process(file_content, mime_type)
+    pages = []
+    for page in document.pages:
+        segments = page.layout.text_anchor.text_segments
+        pages.append("".join(document.text[int(s.start_index):int(s.end_index)] for s in segments))
+    return pages or [document.text]
 
-    request = documentai.ProcessRequest(name=name, raw_document=raw_document)
-    result = client.process_document(request=request)
 
-    document = result.document
-    return document.text
\ No newline at end of file
+def _has_usable_text_layer(text: str) -> bool:
+    """False for scanned pages: no text layer, or a few stray characters from headers or OCR noise."""
+    visible = "".join(text.split())
+    if len(visible) < settings.pdf_text_layer_min_chars:
+        return False
+    readable = sum(1 for c in visible if c.isalnum())
+    return readable / len(visible) >= 0.5
+
+
+def _page_ranges(page_numbers: list[int], max_pages: int) -> list[list[int]]:
+    """Splits sorted page numbers into runs of consecutive pages, each at most max_pages long."""
+    ranges = []
+    for page_number in page_numbers:
+        if ranges and page_number == ranges[-1][-1] + 1 and len(ranges[-1]) < max_pages:
+            ranges[-1].append(page_number)
+        else:
+            ranges.append([page_number])
+    return ranges
+
+
+def _open_pdf(f) -> PdfReader:
+    reader = PdfReader(f)
+    if reader.is_encrypted:
+        reader.decrypt("")
+    return reader
+
+
+def _split_pdf(upload_path: str) -> tuple[list[str | None], list[list[int]]]:
+    """
+    Reads the text layer of every page and groups the pages without one into ranges
+    for Document AI. Returns (page texts with None for OCR pages, [page numbers per range]).
+    """
+    # Given a path, pypdf would read the whole file into memory; given a file it seeks.
+    with open(upload_path, "rb") as f:
+        reader = _open_pdf(f)
+        texts: list[str | None] = []
+        for page in reader.pages:
+            text = None
+            if settings.pdf_text_layer_enabled:
+                try:
+                    text = page.extract_text() or ""
+                except Exception as e:
+                    print(f"Could not read the text layer of page {len(texts) + 1}: {e}")
+                    text = ""
+                if not _has_usable_text_layer(text):
+                    text = None
+            texts.append(text)
+
+    ocr_pages = [number for number, text in enumerate(texts) if text is None]
+    return texts, _page_ranges(ocr_pages, max(1, settings.docai_pages_per_request))
+
+
+def _write_pdf_slice(upload_path: str, page_numbers: list[int]) -> bytes:
+    """The given pages of the upload as a PDF of their own, for one Document AI request."""
+    with open(upload_path, "rb") as f:
+        reader = _open_pdf(f)
+        writer = PdfWriter()
+        for number in page_numbers:
+            writer.add_page(reader.pages[number])
+        buffer = io.BytesIO()
+        writer.write(buffer)
+        return buffer.getvalue()
+
+
+def _join_pages(page_texts: list[str]) -> tuple[str, list[int]]:
+    offsets, position = [], 0
+    for text in page_texts:
+        offsets.append(position)
+        position += len(text) + len(PAGE_SEPARATOR)
+    return PAGE_SEPARATOR.join(page_texts), offsets
+
+
+async def extract_document_text(upload_path: str, mime_type: str) -> ExtractedDocument:
+    """
+    Extracts the text of an upload spooled at upload_path, reading PDF text layers
+    locally and sending only the pages that need OCR to Document AI, in parallel page ranges.
+    """
+    if mime_type == "application/pdf":
+        try:
+            page_texts, ocr_ranges = await run_cpu(_split_pdf, upload_path)
+        except Exception as e:
+            print(f"Could not split the PDF locally ({e}); sending it to Document AI whole.")
+        else:
+            return await _extract_pdf_pages(upload_path, page_texts, ocr_ranges)
+
+    file_content = await run_io(read_upload, upload_path)
+    text = await run_io(process_document_with_docai, file_content=file_content, mime_type=mime_type)
+    return ExtractedDocument(text=text, page_offsets=[0], ocr_pages=1)
+
+
+async def _extract_pdf_pages(
+    upload_path: str,
+    page_texts: list[str | None],
+    ocr_ranges: list[list[int]]
+) -> ExtractedDocument:
+    ocr_page_count = sum(len(page_numbers) for page_numbers in ocr_ranges)
+    print(f"PDF has {len(page_texts)} pages: {len(page_texts) - ocr_page_count} read from the text layer, "
+          f"{ocr_page_count} sent to Document AI in {len(ocr_ranges)} request(s).")
+
+    async def ocr(page_numbers: list[int]):
+        # Written here, inside the bounded task, so only the ranges in flight are in memory.
+        content = await run_cpu(_write_pdf_slice, upload_path, page_numbers)
+        pages = await run_io(process_pages_with_docai, content, "application/pdf")
+        if len(pages) != len(page_numbers):
+            # Page boundaries were not reported; keep the range's text on its first page.
+            pages = ["\n".join(pages)] + [""] * (len(page_numbers) - 1)
+        for number, text in zip(page_numbers, pages):
+            page_texts[number] = text
+
+    await gather_bounded(
+        (ocr(page_numbers) for page_numbers in ocr_ranges),
+        limit=max(1, settings.docai_max_concurrent_requests)
+    )
+    text, offsets = _join_pages(page_texts)
+    return ExtractedDocument(
+        text=text,
+        page_offsets=offsets,
+        text_layer_pages=len(page_texts) - ocr_page_count,
+        ocr_pages=ocr_page_count
+    )
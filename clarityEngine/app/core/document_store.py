@@ -0,0 +1,246 @@
+import json
+import mmap
+import os
+import shutil
+import tempfile
+import uuid
+from collections.abc import Callable, Sequence
+
+import numpy as np
+
+from app.config import settings
+
+# --- On-disk Document Store ---
+# Each processed document gets its own directory:
+#   <document_store_dir>/<document_id>/index.faiss        FAISS index
+#   <document_store_dir>/<document_id>/chunks.json        names the current generation <g> of the chunk files
+#   <document_store_dir>/<document_id>/chunks.<g>.idx     uint64 offsets (.npy), len(chunks) + 1 entries
+#   <document_store_dir>/<document_id>/chunks.<g>.bin     UTF-8 blob of every chunk, back to back
+#   <document_store_dir>/<document_id>/version.json       version record (see app.core.versions)
+#   <document_store_dir>/<document_id>/lexicon.json       names the current generation of the three files below
+#   <document_store_dir>/<document_id>/lexicon.<g>.idx    BM25 vocabulary, sorted, in the chunks' format
+#   <document_store_dir>/<document_id>/lexicon.<g>.bin
+#   <document_store_dir>/<document_id>/postings.<g>.npy   BM25 postings as one uint32 array (see app.core.lexical_index)
+# Files are written to a temporary name and renamed into place, so readers
+# never see a partially written file. Files that are only meaningful
+# together are written under a new generation name and published by
+# replacing the small manifest that names it, so a reader never pairs one
+# generation's offsets with another's blob. Documents stored before
+# manifests existed keep the unversioned names (chunks.idx, ...) until
+# rewritten. faiss is imported on first use so that importing the app does
+# not load it (see app.core.resources).
+
+INDEX_FILENAME = "index.faiss"
+CHUNKS_MANIFEST_FILENAME = "chunks.json"
+CHUNK_OFFSETS_FILENAME = "chunks.idx"
+CHUNK_BLOB_FILENAME = "chunks.bin"
+VERSION_FILENAME = "version.json"
+LEXICON_MANIFEST_FILENAME = "lexicon.json"
+LEXICON_OFFSETS_FILENAME = "lexicon.idx"
+LEXICON_BLOB_FILENAME = "lexicon.bin"
+POSTINGS_FILENAME = "postings.npy"
+
+# A reader that loses the race with a writer deleting the generation it was opening re-reads the manifest.
+_LOAD_ATTEMPTS = 3
+
+
+class MappedChunks(Sequence):
+    """
+    Read-only, list-like view over a document's chunks backed by mmap.
+
+    Chunks are decoded on access, so opening a document costs two mmaps
+    regardless of its size and the pages are shared between workers.
+    """
+
+    def __init__(self, offsets: np.ndarray, blob: mmap.mmap | bytes):
+        self._offsets = offsets
+        self._blob = blob
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("chunk index out of range")
+        start, end = int(self._offsets[index]), int(self._offsets[index + 1])
+        return self._blob[start:end].decode("utf-8")
+
+
+def _document_dir(document_id: str) -> str:
+    # document ids are generated server-side, but never let one escape the store
+    if not document_id or os.path.basename(document_id) != document_id or document_id in (".", ".."):
+        raise ValueError(f"Invalid document ID: {document_id!r}")
+    return os.path.join(settings.document_store_dir, document_id)
+
+
+def atomic_write(path: str, write):
+    """Calls write(file_obj) on a temp file in the target directory, then renames it over path."""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _current_generation(directory: str, manifest_filename: str) -> str | None:
+    """The generation the manifest names, or None if there is no manifest."""
+    try:
+        with open(os.path.join(directory, manifest_filename), "rb") as f:
+            return json.load(f)["generation"]
+    except FileNotFoundError:
+        return None
+
+
+def _generation_path(directory: str, filename: str, generation: str | None) -> str:
+    """Where a generation keeps `filename` ("chunks.idx" -> "chunks.<generation>.idx"); None is the unversioned name."""
+    if generation is None:
+        return os.path.join(directory, filename)
+    stem, extension = os.path.splitext(filename)
+    return os.path.join(directory, f"{stem}.{generation}{extension}")
+
+
+def _save_generation(directory: str, manifest_filename: str, writers: dict[str, Callable]):
+    """
+    Writes each file with its writer under a new generation, then points the manifest
+    at it and removes the generation it replaced.
+    """
+    previous = _current_generation(directory, manifest_filename)
+    generation = uuid.uuid4().hex
+    for filename, write in writers.items():
+        atomic_write(_generation_path(directory, filename, generation), write)
+    manifest = json.dumps({"generation": generation}).encode("utf-8")
+    atomic_write(os.path.join(directory, manifest_filename), lambda f: f.write(manifest))
+    # Readers that already mapped the old files keep them until they close; new readers follow the manifest.
+    for old_generation in {previous, None}:
+        for filename in writers:
+            try:
+                os.remove(_generation_path(directory, filename, old_generation))
+            except FileNotFoundError:
+                pass
+
+
+def _load_generation(directory: str, manifest_filename: str, open_files: Callable):
+    """
+    Calls open_files(path_of) for the generation the manifest names, where path_of maps a
+    file name to that generation's path. Returns None if the files are not on disk.
+    """
+    for _ in range(_LOAD_ATTEMPTS):
+        generation = _current_generation(directory, manifest_filename)
+        try:
+            return open_files(lambda filename: _generation_path(directory, filename, generation))
+        except FileNotFoundError:
+            if _current_generation(directory, manifest_filename) == generation:
+                return None
+    return None
+
+
+def _string_writers(offsets_filename: str, blob_filename: str, strings: list[str]) -> dict[str, Callable]:
+    encoded = [string.encode("utf-8") for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+    if encoded:
+        offsets[1:] = np.cumsum([len(b) for b in encoded], dtype=np.uint64)
+    return {
+        blob_filename: lambda f: f.writelines(encoded),
+        offsets_filename: lambda f: np.save(f, offsets),
+    }
+
+
+def _open_strings(offsets_path: str, blob_path: str) -> MappedChunks:
+    """Maps an offsets table and its blob. Raises FileNotFoundError if either is missing."""
+    offsets = np.load(offsets_path, mmap_mode="r")
+    with open(blob_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # mmap refuses empty files; a document of empty chunks needs no pages anyway
+            blob = b""
+        else:
+            blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return MappedChunks(offsets, blob)
+
+
+def save_chunks(document_id: str, chunks: list[str]):
+    """Persists the chunk texts as an offsets table plus a single UTF-8 blob."""
+    _save_generation(
+        _document_dir(document_id), CHUNKS_MANIFEST_FILENAME,
+        _string_writers(CHUNK_OFFSETS_FILENAME, CHUNK_BLOB_FILENAME, chunks)
+    )
+
+
+def load_chunks(document_id: str) -> MappedChunks | None:
+    """Memory-maps a document's chunks. Returns None if the document is not on disk."""
+    return _load_generation(
+        _document_dir(document_id), CHUNKS_MANIFEST_FILENAME,
+        lambda path_of: _open_strings(path_of(CHUNK_OFFSETS_FILENAME), path_of(CHUNK_BLOB_FILENAME))
+    )
+
+
+def save_lexical_index(document_id: str, terms: list[str], postings: np.ndarray):
+    """Persists a BM25 index: the sorted vocabulary and its packed postings array."""
+    writers = _string_writers(LEXICON_OFFSETS_FILENAME, LEXICON_BLOB_FILENAME, terms)
+    writers[POSTINGS_FILENAME] = lambda f: np.save(f, postings)
+    _save_generation(_document_dir(document_id), LEXICON_MANIFEST_FILENAME, writers)
+
+
+def load_lexical_index(document_id: str) -> tuple[MappedChunks, np.ndarray] | None:
+    """Memory-maps a document's BM25 vocabulary and postings. Returns None if they are not on disk."""
+    def open_files(path_of):
+        terms = _open_strings(path_of(LEXICON_OFFSETS_FILENAME), path_of(LEXICON_BLOB_FILENAME))
+        return terms, np.load(path_of(POSTINGS_FILENAME), mmap_mode="r")
+
+    return _load_generation(_document_dir(document_id), LEXICON_MANIFEST_FILENAME, open_files)
+
+
+def save_index(document_id: str, index: "faiss.Index"):
+    import faiss
+
+    path = os.path.join(_document_dir(document_id), INDEX_FILENAME)
+    atomic_write(path, lambda f: f.write(faiss.serialize_index(index).tobytes()))
+
+
+def load_index(document_id: str, writable: bool = False) -> "faiss.Index | None":
+    """
+    Opens a document's FAISS index read-only via mmap. Returns None if it is not on disk.
+    Pass writable=True for an in-memory copy that accepts add(); a mapped index does not.
+    """
+    import faiss
+
+    path = os.path.join(_document_dir(document_id), INDEX_FILENAME)
+    if not os.path.exists(path):
+        return None
+    if writable:
+        return faiss.read_index(path)
+    # Zero-copy mmap of flat index codes when this FAISS build supports it.
+    flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+    return faiss.read_index(path, flags)
+
+
+def save_version(document_id: str, record: dict):
+    payload = json.dumps(record, ensure_ascii=False).encode("utf-8")
+    atomic_write(os.path.join(_document_dir(document_id), VERSION_FILENAME), lambda f: f.write(payload))
+
+
+def load_version(document_id: str) -> dict | None:
+    """Returns a document's version record, or None for documents processed before versions were recorded."""
+    path = os.path.join(_document_dir(document_id), VERSION_FILENAME)
+    try:
+        with open(path, "rb") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def has_index(document_id: str) -> bool:
+    return os.path.exists(os.path.join(_document_dir(document_id), INDEX_FILENAME))
+
+
+def delete_document(document_id: str):
+    shutil.rmtree(_document_dir(document_id), ignore_errors=True)
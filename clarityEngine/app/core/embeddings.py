@@ -0,0 +1,258 @@
+import hashlib
+import itertools
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+
+from app.config import settings
+from app.core.metrics import cache_requests, embedding_batch_texts
+
+# --- Embedding Service ---
+# Every embedding in the app goes through one EmbeddingService:
+#   - Texts are looked up by SHA-256 in an in-memory LRU cache first, so
+#     boilerplate clauses shared by many contracts are encoded once.
+#   - Cache misses are queued and encoded by a single worker thread that
+#     collects requests from concurrent uploads and queries into micro-batches
+#     (up to batch_size texts, waiting at most max_wait_ms for more).
+#     A text already queued by another caller is waited on, not queued again.
+#   - Queries jump ahead of bulk document chunks, so an /ask is not stuck
+#     behind a long upload.
+# One encoder using all its threads beats several encoders contending for
+# the same cores. The backend ("torch", "onnx" or "onnx-int8") and its thread
+# count come from settings.
+
+EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
+
+QUERY_PRIORITY = 0
+BULK_PRIORITY = 1
+
+
+def _text_key(text: str) -> bytes:
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+
+def load_embedding_model(model_name: str, backend: str, device: str, threads: int):
+    """Loads a SentenceTransformer with the requested backend, device and CPU thread count."""
+    # Imported here: sentence-transformers pulls in torch, which takes seconds.
+    from sentence_transformers import SentenceTransformer
+
+    if backend == "torch":
+        if threads > 0:
+            import torch
+            torch.set_num_threads(threads)
+        return SentenceTransformer(model_name, device=device)
+
+    if backend not in ("onnx", "onnx-int8"):
+        raise ValueError(f"Unknown embedding backend: {backend!r}")
+    # Needs the ONNX extra: pip install "sentence-transformers[onnx]"
+    model_kwargs = {"provider": "CPUExecutionProvider"}
+    if threads > 0:
+        import onnxruntime
+        session_options = onnxruntime.SessionOptions()
+        session_options.intra_op_num_threads = threads
+        model_kwargs["session_options"] = session_options
+    if backend == "onnx-int8":
+        model_kwargs["file_name"] = settings.embedding_onnx_int8_file
+    return SentenceTransformer(model_name, device="cpu", backend="onnx", model_kwargs=model_kwargs)
+
+
+class _EmbeddingRequest:
+    def __init__(self, keys: list[bytes], texts: list[str]):
+        self.keys = keys
+        self.texts = texts
+        self.future: Future = Future()
+
+
+class EmbeddingService:
+    """
+    Batched, deduplicated text embedding with a content-hash cache.
+
+    embed() is thread-safe and blocking; call it from a worker thread.
+    The model is loaded on first use (or by warm_up()).
+    """
+
+    def __init__(self, model_name: str, batch_size: int, max_wait_ms: float, cache_max_entries: int):
+        self.model_name = model_name
+        self.batch_size = max(1, batch_size)
+        self.max_wait_seconds = max_wait_ms / 1000
+        self.cache_max_entries = cache_max_entries
+        self.model = None
+        self._model_lock = threading.Lock()
+        self._cache: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        # Texts queued or being encoded, mapped to the request that will produce them.
+        self._in_flight: dict[bytes, _EmbeddingRequest] = {}
+        self._cache_lock = threading.Lock()
+        self._queue: queue.PriorityQueue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._worker: threading.Thread | None = None
+        self._worker_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._texts_requested = 0
+        self._cache_hits = 0
+        self._texts_encoded = 0
+        self._batches = 0
+        self._encode_seconds = 0.0
+
+    def load_model(self):
+        if self.model is not None:
+            return self.model
+        # A request arriving during startup warm-up waits for it instead of loading a second copy.
+        with self._model_lock:
+            if self.model is None:
+                print(f"Loading local embedding model ({self.model_name}, backend={settings.embedding_backend})...")
+                self.model = load_embedding_model(
+                    self.model_name, settings.embedding_backend, settings.embedding_device, settings.embedding_threads
+                )
+                print("Embedding model loaded.")
+        return self.model
+
+    def warm_up(self):
+        """Loads the model and runs one encode outside the cache, so the first request pays for neither."""
+        self.load_model().encode(["warm-up"], convert_to_numpy=True, show_progress_bar=False)
+
+    @property
+    def dimension(self) -> int:
+        return self.load_model().get_sentence_embedding_dimension()
+
+    def embed(self, texts: list[str], priority: int = BULK_PRIORITY) -> np.ndarray:
+        """Returns a float32 array of shape (len(texts), dim), in input order."""
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+
+        keys = [_text_key(text) for text in texts]
+        vectors: dict[bytes, np.ndarray] = {}
+        missing: dict[bytes, str] = {}
+        waiting: set[_EmbeddingRequest] = set()
+        new_requests = []
+        with self._cache_lock:
+            for key, text in zip(keys, texts):
+                if key in vectors or key in missing:
+                    continue
+                vector = self._cache.get(key)
+                if vector is not None:
+                    self._cache.move_to_end(key)
+                    vectors[key] = vector
+                elif key in self._in_flight:
+                    waiting.add(self._in_flight[key])
+                else:
+                    missing[key] = text
+            # Split large documents so queries can be interleaved between their batches.
+            missing_keys = list(missing)
+            for start in range(0, len(missing_keys), self.batch_size):
+                piece = missing_keys[start:start + self.batch_size]
+                request = _EmbeddingRequest(piece, [missing[key] for key in piece])
+                self._in_flight.update((key, request) for key in piece)
+                new_requests.append(request)
+
+        # Only texts served from the stored cache are hits; waiting on another
+        # caller's encode, or repeating a missing text in the same call, is not.
+        hits = sum(1 for key in keys if key in vectors)
+        with self._stats_lock:
+            self._texts_requested += len(texts)
+            self._cache_hits += hits
+        cache_requests.inc(hits, cache="embedding", outcome="hit")
+        cache_requests.inc(len(texts) - hits, cache="embedding", outcome="miss")
+
+        if new_requests:
+            self._ensure_worker()
+            for request in new_requests:
+                self._queue.put((priority, next(self._sequence), request))
+        for request in [*new_requests, *waiting]:
+            vectors.update(request.future.result())
+
+        return np.stack([vectors[key] for key in keys])
+
+    def _ensure_worker(self):
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="clarity-embedding", daemon=True)
+                self._worker.start()
+
+    def _next_batch(self) -> list[_EmbeddingRequest]:
+        _, _, first = self._queue.get()
+        batch, size = [first], len(first.texts)
+        deadline = time.monotonic() + self.max_wait_seconds
+        while size < self.batch_size:
+            try:
+                _, _, request = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            batch.append(request)
+            size += len(request.texts)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                self._encode_batch(batch)
+            except Exception as e:
+                with self._cache_lock:
+                    for request in batch:
+                        for key in request.keys:
+                            self._in_flight.pop(key, None)
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+
+    def _encode_batch(self, batch: list[_EmbeddingRequest]):
+        unique: dict[bytes, str] = {}
+        for request in batch:
+            unique.update(zip(request.keys, request.texts))
+
+        model = self.load_model()
+        start = time.perf_counter()
+        encoded = model.encode(
+            list(unique.values()), batch_size=len(unique), convert_to_numpy=True, show_progress_bar=False
+        ).astype(np.float32)
+        elapsed = time.perf_counter() - start
+        vectors = dict(zip(unique, encoded))
+
+        with self._cache_lock:
+            for key, vector in vectors.items():
+                self._cache[key] = vector
+                self._cache.move_to_end(key)
+                self._in_flight.pop(key, None)
+            while len(self._cache) > self.cache_max_entries:
+                self._cache.popitem(last=False)
+        with self._stats_lock:
+            self._texts_encoded += len(unique)
+            self._batches += 1
+            self._encode_seconds += elapsed
+        embedding_batch_texts.observe(len(unique))
+
+        for request in batch:
+            request.future.set_result({key: vectors[key] for key in request.keys})
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            requested, hits = self._texts_requested, self._cache_hits
+            encoded, batches, seconds = self._texts_encoded, self._batches, self._encode_seconds
+        with self._cache_lock:
+            cached = len(self._cache)
+        return {
+            "model": self.model_name,
+            "backend": settings.embedding_backend,
+            "texts_requested": requested,
+            "cache_hits": hits,
+            "cache_hit_rate": hits / requested if requested else 0.0,
+            "cache_entries": cached,
+            "texts_encoded": encoded,
+            "batches": batches,
+            "mean_batch_size": encoded / batches if batches else 0.0,
+            "encode_seconds": seconds,
+            "texts_per_second": encoded / seconds if seconds else 0.0,
+            "queued_requests": self._queue.qsize()
+        }
+
+
+embedding_service = EmbeddingService(
+    EMBEDDING_MODEL_NAME,
+    batch_size=settings.embedding_batch_size,
+    max_wait_ms=settings.embedding_batch_wait_ms,
+    cache_max_entries=settings.embedding_cache_max_entries
+)
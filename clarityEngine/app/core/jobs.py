@@ -0,0 +1,402 @@
+import asyncio
+import json
+import os
+import random
+import socket
+import sqlite3
+import time
+import uuid
+
+from app.config import settings
+from app.core.admission import admission, BULK
+from app.core.concurrency import run_io
+from app.core.llm_client import RETRYABLE_ERRORS
+from app.core.pipeline import PIPELINE_STAGES, run_processing_pipeline
+from app.core.uploads import Upload
+
+# --- Background Document Processing Jobs ---
+# Jobs are recorded in a local SQLite database and the uploaded bytes are
+# spooled next to it, so a job that was queued or running when the process
+# died is picked up again on the next start. A file handed off by the Node
+# backend (app.core.uploads) is not copied: the job records its path and
+# leaves it in place when done.
+#
+# Several server processes may share the store. Each polls it for queued
+# jobs and claims one with a single conditional UPDATE before running it,
+# so a job runs in one process at a time. A claim is a lease the running
+# process renews every job_lease_seconds / 3; when a lease runs out (the
+# process or its whole host is gone) any process puts the job back in the
+# queue. A job that fails with a transient error goes back to the queue
+# after a jittered exponential backoff until it has used up job_max_attempts;
+# any other error fails it at once. Its spooled upload is deleted once it
+# completes or finally fails.
+
+QUEUED, RUNNING, COMPLETED, FAILED = "queued", "running", "completed", "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    filename TEXT,
+    mime_type TEXT NOT NULL,
+    upload_path TEXT NOT NULL,
+    stages TEXT NOT NULL,
+    partial_result TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    previous_document_id TEXT,
+    owner TEXT,
+    lease_expires REAL,
+    not_before REAL
+)
+"""
+
+
+class JobStore:
+    """SQLite-backed persistence for job records. Every method is blocking; call through run_io."""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(_SCHEMA)
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "previous_document_id" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN previous_document_id TEXT")
+            for column in ("owner TEXT", "lease_expires REAL", "not_before REAL"):
+                if column.split()[0] not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column}")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def create(
+        self,
+        job_id: str,
+        filename: str,
+        mime_type: str,
+        upload_path: str,
+        previous_document_id: str | None = None
+    ):
+        now = time.time()
+        stages = {stage: {"status": "pending"} for stage in PIPELINE_STAGES}
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, filename, mime_type, upload_path, stages, partial_result,"
+                " created_at, updated_at, previous_document_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, filename, mime_type, upload_path, json.dumps(stages), "{}", now, now,
+                 previous_document_id)
+            )
+
+    def get(self, job_id: str) -> dict | None:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        for key in ("stages", "partial_result", "result"):
+            job[key] = json.loads(job[key]) if job[key] else None
+        return job
+
+    def update(self, job_id: str, **fields):
+        for key in ("stages", "partial_result", "result"):
+            if key in fields and fields[key] is not None:
+                fields[key] = json.dumps(fields[key])
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def claim(self, job_id: str, owner: str, lease_seconds: float) -> dict | None:
+        """
+        Marks a queued job whose retry time has come running for `owner`, under a lease of
+        `lease_seconds`, and counts the attempt. Returns the claimed job, or None if it is
+        not ready (another process took it, it is done, or it is backing off).
+        """
+        stages = {stage: {"status": "pending"} for stage in PIPELINE_STAGES}
+        now = time.time()
+        with self._connect() as conn:
+            claimed = conn.execute(
+                "UPDATE jobs SET status = ?, owner = ?, attempts = attempts + 1, stages = ?,"
+                " partial_result = ?, updated_at = ?, lease_expires = ?, not_before = NULL"
+                " WHERE id = ? AND status = ? AND (not_before IS NULL OR not_before <= ?)",
+                (RUNNING, owner, json.dumps(stages), "{}", now, now + lease_seconds, job_id, QUEUED, now)
+            ).rowcount
+        return self.get(job_id) if claimed else None
+
+    def renew_lease(self, job_id: str, owner: str, lease_seconds: float) -> bool:
+        """Extends the lease on a job `owner` is running. False if the job is no longer theirs."""
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE jobs SET lease_expires = ? WHERE id = ? AND status = ? AND owner = ?",
+                (time.time() + lease_seconds, job_id, RUNNING, owner)
+            ).rowcount == 1
+
+    def queued_job_ids(self) -> list[str]:
+        """Queued jobs that may run now (not backing off after a failure), oldest first."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id FROM jobs WHERE status = ? AND (not_before IS NULL OR not_before <= ?) ORDER BY created_at",
+                (QUEUED, time.time())
+            ).fetchall()
+        return [row["id"] for row in rows]
+
+    def recover_abandoned(self, owner_alive, max_attempts: int, lease_seconds: float) -> list[dict]:
+        """
+        Puts running jobs whose owning process is gone, or whose lease has run out,
+        back in the queue, or fails them if they have no attempts left. Returns the
+        jobs that were failed.
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id, owner, attempts, upload_path, lease_expires, updated_at FROM jobs WHERE status = ?",
+                (RUNNING,)
+            ).fetchall()
+        failed = []
+        now = time.time()
+        for row in rows:
+            # Jobs claimed before leases existed expire a lease after their last update.
+            expires = row["lease_expires"] if row["lease_expires"] is not None else row["updated_at"] + lease_seconds
+            if row["owner"] is not None and expires > now and owner_alive(row["owner"]):
+                continue
+            status = QUEUED if row["attempts"] < max_attempts else FAILED
+            with self._connect() as conn:
+                # Conditional, so two processes recovering at once, or a lease renewed
+                # meanwhile, do not let it be acted on twice.
+                updated = conn.execute(
+                    "UPDATE jobs SET status = ?, owner = NULL, lease_expires = NULL,"
+                    " error = COALESCE(error, ?), updated_at = ?"
+                    " WHERE id = ? AND status = ? AND owner IS ? AND lease_expires IS ?",
+                    (status, "The process running this job exited.", now, row["id"], RUNNING,
+                     row["owner"], row["lease_expires"])
+                ).rowcount
+            if updated and status == FAILED:
+                failed.append(dict(row))
+        return failed
+
+
+class JobQueue:
+    """
+    A bounded pool of asyncio workers that run the processing pipeline for submitted jobs.
+
+    Progress is kept in memory for fast polling and written through to the JobStore.
+    """
+
+    def __init__(self, store: JobStore, spool_dir: str, num_workers: int):
+        self.store = store
+        self.spool_dir = spool_dir
+        self.num_workers = num_workers
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._queue: asyncio.Queue[str] | None = None
+        self._queued_ids: set[str] = set()
+        self._workers: list[asyncio.Task] = []
+        self._retries: dict[str, asyncio.TimerHandle] = {}
+        self._live: dict[str, dict] = {}
+
+    async def start(self):
+        """Starts the workers, recovers jobs abandoned by a dead process and begins polling for queued jobs."""
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self._queue = asyncio.Queue()
+        self._queued_ids = set()
+        # At start-up, anything recorded under our own hostname:pid belongs to a
+        # previous process that had the same pid.
+        await self._recover(lambda owner: owner != self.owner and _owner_alive(owner))
+        await self._enqueue_waiting()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(max(1, self.num_workers))]
+        self._workers.append(asyncio.create_task(self._poll()))
+
+    async def stop(self):
+        for handle in self._retries.values():
+            handle.cancel()
+        self._retries.clear()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def _enqueue(self, job_id: str):
+        if job_id not in self._queued_ids:
+            self._queued_ids.add(job_id)
+            self._queue.put_nowait(job_id)
+
+    async def _enqueue_waiting(self):
+        """Queues locally every job waiting in the store, including ones submitted to other processes."""
+        for job_id in await run_io(self.store.queued_job_ids):
+            self._enqueue(job_id)
+
+    async def _recover(self, owner_alive):
+        failed = await run_io(
+            self.store.recover_abandoned, owner_alive, settings.job_max_attempts, settings.job_lease_seconds
+        )
+        for job in failed:
+            print(f"Job {job['id']} was abandoned after {job['attempts']} attempts; marking it failed.")
+            await self._discard_upload(job["upload_path"])
+
+    async def _poll(self):
+        while True:
+            await asyncio.sleep(settings.job_poll_seconds)
+            try:
+                # Picks up jobs whose owner, on any host, stopped renewing its lease.
+                await self._recover(_owner_alive)
+                await self._enqueue_waiting()
+            except Exception as e:
+                print(f"Polling the job store failed: {e}")
+
+    def _retry_later(self, job_id: str, delay: float):
+        def enqueue():
+            self._retries.pop(job_id, None)
+            self._enqueue(job_id)
+
+        self._retries[job_id] = asyncio.get_running_loop().call_later(delay, enqueue)
+
+    async def _renew_lease(self, job_id: str):
+        while True:
+            await asyncio.sleep(settings.job_lease_seconds / 3)
+            try:
+                if not await run_io(self.store.renew_lease, job_id, self.owner, settings.job_lease_seconds):
+                    print(f"Job {job_id} is no longer leased to this process.")
+                    return
+            except Exception as e:
+                print(f"Renewing the lease on job {job_id} failed: {e}")
+
+    def ensure_capacity(self):
+        """Raises Overloaded when job_max_queued jobs are already waiting."""
+        if self._queue.qsize() >= settings.job_max_queued:
+            raise admission.reject(BULK, "job_backlog")
+
+    async def submit(
+        self,
+        upload: Upload,
+        filename: str,
+        mime_type: str,
+        previous_document_id: str | None = None
+    ) -> str:
+        """Records the upload as a job and queues it. Raises Overloaded when the backlog is full."""
+        self.ensure_capacity()
+        job_id = str(uuid.uuid4())
+        upload_path = os.path.join(self.spool_dir, f"{job_id}.upload") if upload.owned else upload.path
+
+        def _record():
+            if upload.owned:
+                os.replace(upload.path, upload_path)
+            self.store.create(job_id, filename, mime_type, upload_path, previous_document_id)
+
+        await run_io(_record)
+        self._enqueue(job_id)
+        return job_id
+
+    async def get(self, job_id: str) -> dict | None:
+        job = self._live.get(job_id)
+        if job is not None:
+            return job
+        return await run_io(self.store.get, job_id)
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            self._queued_ids.discard(job_id)
+            try:
+                # Workers share the bulk class with /process-document, and wait rather than fail.
+                async with admission.admit(BULK, reject=False):
+                    await self._run(job_id)
+            except Exception as e:
+                print(f"Job {job_id} crashed outside the pipeline: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _is_spooled(self, path: str) -> bool:
+        """True for uploads copied into the spool directory, as opposed to handed-off files."""
+        return os.path.dirname(os.path.abspath(path)) == os.path.abspath(self.spool_dir)
+
+    async def _discard_upload(self, path: str):
+        if self._is_spooled(path):
+            await run_io(_remove_file, path)
+
+    async def _run(self, job_id: str):
+        job = await run_io(self.store.claim, job_id, self.owner, settings.job_lease_seconds)
+        if job is None:
+            return
+        self._live[job_id] = job
+        lease = asyncio.create_task(self._renew_lease(job_id))
+
+        async def on_progress(stage: str, status: str, data: dict):
+            stage_state = job["stages"][stage]
+            if status == "partial":
+                # Section summaries are published as each one finishes.
+                job["partial_result"].setdefault("sections", []).append(data)
+                stage_state["completed"] = stage_state.get("completed", 0) + 1
+            else:
+                stage_state["status"] = status
+                stage_state[f"{status}_at"] = time.time()
+                stage_state.update(data)
+                # A result-cache hit reports its stages completed without their data.
+                if stage == "summary" and status == "completed" and "summary" in data:
+                    job["partial_result"]["summary"] = data["summary"]
+            await run_io(self.store.update, job_id, stages=job["stages"], partial_result=job["partial_result"])
+
+        try:
+            result = await run_processing_pipeline(
+                upload_path=job["upload_path"],
+                mime_type=job["mime_type"],
+                filename=job["filename"],
+                on_progress=on_progress,
+                previous_document_id=job["previous_document_id"]
+            )
+        except Exception as e:
+            if isinstance(e, RETRYABLE_ERRORS) and job["attempts"] < settings.job_max_attempts:
+                delay = _retry_delay(job["attempts"])
+                print(f"Job {job_id} failed (attempt {job['attempts']} of {settings.job_max_attempts}), "
+                      f"retrying in {delay:.0f}s: {e}")
+                await run_io(
+                    self.store.update, job_id, status=QUEUED, owner=None, lease_expires=None,
+                    not_before=time.time() + delay, error=str(e)
+                )
+                self._retry_later(job_id, delay)
+            else:
+                print(f"Job {job_id} failed after {job['attempts']} attempts: {e}")
+                job.update(status=FAILED, error=str(e))
+                await run_io(self.store.update, job_id, status=FAILED, error=str(e))
+                await self._discard_upload(job["upload_path"])
+        else:
+            job.update(status=COMPLETED, result=result)
+            await run_io(self.store.update, job_id, status=COMPLETED, result=result)
+            await self._discard_upload(job["upload_path"])
+        finally:
+            lease.cancel()
+            self._live.pop(job_id, None)
+
+
+def _retry_delay(attempts: int) -> float:
+    """Full jitter: uniform in [0, min(max, base * 2^(attempts - 1))]."""
+    return random.uniform(0, min(settings.job_retry_max_seconds, settings.job_retry_base_seconds * 2 ** (attempts - 1)))
+
+
+def _remove_file(path: str):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def _owner_alive(owner: str) -> bool:
+    """True unless `owner` (hostname:pid) is a process on this host that no longer exists."""
+    host, _, pid = owner.rpartition(":")
+    if host != socket.gethostname():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+job_queue = JobQueue(
+    store=JobStore(settings.job_store_path),
+    spool_dir=settings.job_spool_dir,
+    num_workers=settings.job_workers
+)
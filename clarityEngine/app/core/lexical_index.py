@@ -0,0 +1,283 @@
+import bisect
+import math
+import re
+import threading
+from collections import Counter, OrderedDict
+from collections.abc import Sequence
+from dataclasses import dataclass
+
+import numpy as np
+
+from app.config import settings
+from app.core import document_store
+
+# --- Lexical Index ---
+# A BM25 inverted index over each document's chunks, built when the chunks are
+# stored, next to the FAISS index. The embedding model ranks exact references
+# ("Section 12.3", "$1,850.00", a defined term) poorly; word matching does not.
+#
+# Terms keep what matters in contracts: section numbers stay whole ("12.3",
+# not "12" and "3") and amounts are normalized ("$1,850.00" -> "$1850").
+# The index is array-backed so it can be memory-mapped:
+#   vocabulary  sorted terms, stored like the chunks (offsets + UTF-8 blob)
+#   postings    one uint32 array:
+#                 [format, chunk count, term count, posting count,
+#                  chunk lengths (chunk count),
+#                  posting offsets per term (term count + 1),
+#                  chunk index per posting, term frequency per posting]
+# Documents processed before the index existed get one built from their
+# chunks on first query.
+#
+# Exact references in a question (a section number, a quoted term, an amount)
+# are looked up in the postings directly. When they pin down at most
+# exact_reference_max_chunks chunks, those chunks are the whole context: the
+# question is not embedded and the vector index is not searched. Its answer is
+# cached under the question's text and those chunks (see app.core.answer_cache).
+
+_FORMAT = 1
+_HEADER = 4
+_TOKEN = re.compile(r"\$\s?\d[\d,]*(?:\.\d+)?|\d+(?:\.\d+)+|[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from has have how i if in is it its may my of on or "
+    "that the their there this to under what when where which who will with would you your".split()
+)
+_K1, _B = 1.2, 0.75
+
+# "§" is not a word character, so \b only guards the words.
+_SECTION_REFERENCE = re.compile(r"(?:\b(?:section|clause|article|paragraph)|§)\s*(\d+(?:\.\d+)*)", re.IGNORECASE)
+_AMOUNT_REFERENCE = re.compile(r"\$\s?\d[\d,]*(?:\.\d+)?")
+_QUOTED_TERM = re.compile(r"[\"“]([^\"“”]{2,80})[\"”]")
+
+_indexes: "OrderedDict[str, LexicalIndex]" = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def normalize_amount(amount: str) -> str:
+    """Writes an amount the way the index stores it: "$ 1,850.00" -> "$1850", "$12.50" -> "$12.5"."""
+    digits = amount.lstrip("$").strip().replace(",", "")
+    if "." in digits:
+        digits = digits.rstrip("0").rstrip(".")
+    return "$" + digits
+
+
+def index_terms(text: str) -> list[str]:
+    """The text's terms, lowercased, without stopwords and single characters (numbers are kept)."""
+    terms = []
+    for token in _TOKEN.findall(text.lower()):
+        if token.startswith("$"):
+            terms.append(normalize_amount(token))
+        elif token not in STOPWORDS and (len(token) > 1 or token.isdigit()):
+            terms.append(token)
+    return terms
+
+
+@dataclass
+class LexicalIndex:
+    terms: Sequence[str]
+    postings: np.ndarray
+
+    def __post_init__(self):
+        chunk_count, term_count, posting_count = (int(v) for v in self.postings[1:_HEADER])
+        start = _HEADER
+        self.chunk_lengths = self.postings[start:start + chunk_count]
+        start += chunk_count
+        self.posting_offsets = self.postings[start:start + term_count + 1]
+        start += term_count + 1
+        self.posting_chunks = self.postings[start:start + posting_count]
+        start += posting_count
+        self.posting_frequencies = self.postings[start:start + posting_count]
+        self.average_length = float(self.chunk_lengths.mean()) if chunk_count else 1.0
+
+    @property
+    def chunk_count(self) -> int:
+        return len(self.chunk_lengths)
+
+    def _term_id(self, term: str) -> int | None:
+        position = bisect.bisect_left(self.terms, term)
+        if position < len(self.terms) and self.terms[position] == term:
+            return position
+        return None
+
+    def chunks_with(self, term: str) -> np.ndarray:
+        """Indices of the chunks containing the term, ascending."""
+        term_id = self._term_id(term)
+        if term_id is None:
+            return self.posting_chunks[:0]
+        return self.posting_chunks[self.posting_offsets[term_id]:self.posting_offsets[term_id + 1]]
+
+    def scores(self, query: str) -> np.ndarray:
+        """BM25 score of every chunk for the query (0 for chunks sharing no term with it)."""
+        scores = np.zeros(self.chunk_count, dtype=np.float32)
+        for term in set(index_terms(query)):
+            term_id = self._term_id(term)
+            if term_id is None:
+                continue
+            start, end = int(self.posting_offsets[term_id]), int(self.posting_offsets[term_id + 1])
+            chunks = self.posting_chunks[start:end]
+            frequencies = self.posting_frequencies[start:end].astype(np.float32)
+            idf = math.log(1 + (self.chunk_count - (end - start) + 0.5) / (end - start + 0.5))
+            norms = _K1 * (1 - _B + _B * self.chunk_lengths[chunks] / self.average_length)
+            scores[chunks] += idf * frequencies * (_K1 + 1) / (frequencies + norms)
+        return scores
+
+    def search(self, query: str, k: int) -> list[tuple[int, float]]:
+        """(chunk index, BM25 score) of the k best matching chunks, best first."""
+        scores = self.scores(query)
+        matched = np.flatnonzero(scores)
+        if len(matched) > k:
+            matched = matched[np.argpartition(scores[matched], -k)[-k:]]
+        order = matched[np.argsort(-scores[matched], kind="stable")]
+        return [(int(i), float(scores[i])) for i in order]
+
+
+def build_lexical_index(chunks: Sequence[str]) -> tuple[list[str], np.ndarray]:
+    """Builds the vocabulary and packed postings array for the chunks."""
+    counts = [Counter(index_terms(chunk)) for chunk in chunks]
+    terms = sorted({term for chunk_counts in counts for term in chunk_counts})
+    term_ids = {term: position for position, term in enumerate(terms)}
+
+    postings_per_term: list[list[tuple[int, int]]] = [[] for _ in terms]
+    for chunk_index, chunk_counts in enumerate(counts):
+        for term, frequency in chunk_counts.items():
+            postings_per_term[term_ids[term]].append((chunk_index, frequency))
+
+    posting_count = sum(len(p) for p in postings_per_term)
+    offsets = np.zeros(len(terms) + 1, dtype=np.uint32)
+    offsets[1:] = np.cumsum([len(p) for p in postings_per_term], dtype=np.uint64)
+    pairs = np.array([pair for p in postings_per_term for pair in p], dtype=np.uint32).reshape(-1, 2)
+    postings = np.concatenate([
+        np.array([_FORMAT, len(chunks), len(terms), posting_count], dtype=np.uint32),
+        np.array([sum(c.values()) for c in counts], dtype=np.uint32),
+        offsets,
+        pairs[:, 0],
+        pairs[:, 1],
+    ])
+    return terms, postings
+
+
+def _register(document_id: str, index: LexicalIndex):
+    with _indexes_lock:
+        _indexes[document_id] = index
+        _indexes.move_to_end(document_id)
+        while len(_indexes) > settings.vector_store_max_documents:
+            _indexes.popitem(last=False)
+
+
+def store_lexical_index(document_id: str, chunks: Sequence[str]) -> LexicalIndex:
+    """Builds a document's BM25 index, persists it and registers it. Blocking; call through run_cpu."""
+    terms, postings = build_lexical_index(chunks)
+    document_store.save_lexical_index(document_id, terms, postings)
+    index = LexicalIndex(terms, postings)
+    _register(document_id, index)
+    return index
+
+
+def get_lexical_index(document_id: str, chunks: Sequence[str] | None = None) -> LexicalIndex | None:
+    """
+    A document's BM25 index, memory-mapped from the document store on first use.
+    If it was never built and the chunks are given, builds it from them.
+    """
+    with _indexes_lock:
+        index = _indexes.get(document_id)
+        if index is not None:
+            _indexes.move_to_end(document_id)
+            return index
+
+    try:
+        stored = document_store.load_lexical_index(document_id)
+    except ValueError:
+        return None
+    if stored is not None and int(stored[1][0]) == _FORMAT:
+        index = LexicalIndex(*stored)
+        _register(document_id, index)
+        return index
+    if not chunks:
+        return None
+    print(f"Building the lexical index for document ID {document_id}...")
+    return store_lexical_index(document_id, chunks)
+
+
+def search_lexical(document_id: str, query: str, chunks: Sequence[str], k: int | None = None) -> list[tuple[int, float]]:
+    """(chunk index, BM25 score) of the document's best lexical matches, best first."""
+    index = get_lexical_index(document_id, chunks)
+    if index is None:
+        return []
+    return index.search(query, k or settings.vector_search_neighbours)
+
+
+@dataclass
+class Reference:
+    text: str
+    # Index terms every matching chunk contains.
+    terms: list[str]
+    # What a matching chunk's text must contain, when the terms alone are not enough.
+    pattern: re.Pattern | None = None
+    # A stronger form (a section's heading, a term's definition); when some chunks have it, only they match.
+    preferred: re.Pattern | None = None
+
+
+def _phrase(words: list[str]) -> str:
+    return r"\s+".join(re.escape(word) for word in words)
+
+
+def find_references(question: str) -> list[Reference]:
+    """The section numbers, quoted terms and amounts a question refers to."""
+    references = []
+    for match in _SECTION_REFERENCE.finditer(question):
+        number = match.group(1)
+        references.append(Reference(
+            match.group(0), [number],
+            # The section itself, not every clause that cites it.
+            pattern=re.compile(
+                rf"^\s*(?:(?:section|clause|article|paragraph|§)\s*)?{re.escape(number)}\b(?!\.\d)",
+                re.IGNORECASE | re.MULTILINE
+            )
+        ))
+    for match in _AMOUNT_REFERENCE.finditer(question):
+        references.append(Reference(match.group(0), [normalize_amount(match.group(0))]))
+    for match in _QUOTED_TERM.finditer(question):
+        words = match.group(1).split()
+        terms = index_terms(match.group(1))
+        if not terms:
+            continue
+        references.append(Reference(
+            match.group(0), terms,
+            pattern=re.compile(rf"\b{_phrase(words)}\b", re.IGNORECASE),
+            preferred=re.compile(rf"[\"“]{_phrase(words)}[\"”]", re.IGNORECASE)
+        ))
+    return references
+
+
+def _chunks_matching(index: LexicalIndex, reference: Reference, chunks: Sequence[str]) -> set[int]:
+    candidates = index.chunks_with(reference.terms[0])
+    for term in reference.terms[1:]:
+        candidates = np.intersect1d(candidates, index.chunks_with(term), assume_unique=True)
+    hits = [int(i) for i in candidates if reference.pattern is None or reference.pattern.search(chunks[i])]
+    if reference.preferred is not None:
+        hits = [i for i in hits if reference.preferred.search(chunks[i])] or hits
+    return set(hits)
+
+
+def lookup_exact_references(document_id: str, question: str, chunks: Sequence[str]) -> list[int] | None:
+    """
+    Indices of the chunks the question's exact references point to, in document
+    order, or None when it has none, one is not found, or they match too many chunks.
+    """
+    references = find_references(question)
+    if not references:
+        return None
+    index = get_lexical_index(document_id, chunks)
+    if index is None:
+        return None
+
+    matches = []
+    for reference in references:
+        hits = _chunks_matching(index, reference, chunks)
+        if not hits:
+            return None
+        matches.append(hits)
+    # Chunks that satisfy every reference; failing that, each reference's own chunks.
+    selected = set.intersection(*matches) or set.union(*matches)
+    if len(selected) > settings.exact_reference_max_chunks:
+        return None
+    return sorted(selected)
@@ -0,0 +1,272 @@
+import contextvars
+import os
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FuturesTimeout, wait
+
+import google.generativeai as genai
+from dotenv import load_dotenv
+from google.generativeai import caching
+from google.api_core import exceptions as google_exceptions
+
+from app.config import settings
+from app.core.admission import current_priority
+from app.core.metrics import record_llm_call, llm_retries, llm_hedges, llm_rate_limit_wait
+from app.core.resources import get_generative_model
+
+# --- Gemini Client ---
+# The one place Gemini is called from. Each call:
+#   1. picks the model for its task (llm_task_models, else llm_default_model),
+#   2. waits for a token from that model's bucket, shared by every request in
+#      the process, so a burst of section summaries queues here instead of
+#      turning into 429s; waiting calls are served in admission priority
+#      order, so a question does not queue behind an upload's calls,
+#   3. retries 429 / 5xx / timeout errors with full-jitter exponential backoff,
+#   4. for tasks in llm_hedge_tasks, sends a second request if the first is
+#      slower than llm_hedge_after_seconds, returns whichever answers first
+#      and stops the other before it makes another attempt.
+# Calls made with a CachedContent (see app.core.document_context) send only the
+# prompt; the cached text stays on Gemini. Callers only pass a cache created
+# for the task's own model.
+# Calls block; run them on the I/O pool (run_io / run_llm_call).
+
+load_dotenv()
+if settings.gemini_api_endpoint:
+    # REST transport so a plain HTTP fake server can stand in for Gemini.
+    genai.configure(
+        api_key=os.getenv("GEMINI_API_KEY") or "local",
+        transport="rest",
+        client_options={"api_endpoint": settings.gemini_api_endpoint}
+    )
+else:
+    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+
+RETRYABLE_ERRORS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.InternalServerError,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.GatewayTimeout,
+    ConnectionError,
+    TimeoutError,
+)
+
+
+class TokenBucket:
+    """
+    Allows `rate` acquisitions per second on average, with bursts of up to `capacity`. Thread-safe.
+    A caller only takes a token while no caller of a more urgent (lower) priority is waiting.
+    """
+
+    def __init__(self, rate: float, capacity: int, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self._clock = clock
+        self._tokens = float(self.capacity)
+        self._updated = clock()
+        self._condition = threading.Condition()
+        self._waiting: Counter[int] = Counter()
+
+    def acquire(self, priority: int = 0) -> float:
+        """Blocks until a token is available. Returns the seconds spent waiting."""
+        start = self._clock()
+        with self._condition:
+            self._waiting[priority] += 1
+            try:
+                while True:
+                    now = self._clock()
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    outranked = any(count for p, count in self._waiting.items() if p < priority)
+                    if self._tokens >= 1 and not outranked:
+                        self._tokens -= 1
+                        return now - start
+                    # Woken early whenever another caller takes a token or gives up.
+                    refill = (1 - self._tokens) / self.rate if self._tokens < 1 else 1 / self.rate
+                    self._condition.wait(refill)
+            finally:
+                self._waiting[priority] -= 1
+                if not self._waiting[priority]:
+                    del self._waiting[priority]
+                self._condition.notify_all()
+
+
+_buckets: dict[str, TokenBucket | None] = {}
+_buckets_lock = threading.Lock()
+
+# Hedged calls run here, not on the I/O pool that is already running the caller.
+# Every I/O thread may be waiting on a hedged call with two requests in flight.
+_hedge_executor = ThreadPoolExecutor(
+    max_workers=2 * settings.io_executor_workers, thread_name_prefix="llm-hedge"
+)
+
+
+class _HedgeLost(Exception):
+    """Stops a hedged request once the other one has answered."""
+
+
+def model_for_task(task: str) -> str:
+    return settings.llm_task_models.get(task, settings.llm_default_model)
+
+
+def _bucket_for(model_name: str) -> TokenBucket | None:
+    with _buckets_lock:
+        if model_name not in _buckets:
+            per_minute = settings.llm_requests_per_minute.get(model_name)
+            _buckets[model_name] = TokenBucket(per_minute / 60.0, settings.llm_burst) if per_minute else None
+        return _buckets[model_name]
+
+
+def _wait_for_rate_limit(model_name: str):
+    bucket = _bucket_for(model_name)
+    if bucket is not None:
+        llm_rate_limit_wait.observe(bucket.acquire(current_priority()), model=model_name)
+
+
+def _backoff(attempt: int) -> float:
+    """Full jitter: uniform in [0, min(max, base * 2^attempt)]."""
+    return random.uniform(0, min(settings.llm_backoff_max_seconds, settings.llm_backoff_base_seconds * 2 ** attempt))
+
+
+def _with_retries(call, task: str, model_name: str, cancelled: threading.Event | None = None, sleep=time.sleep):
+    """
+    Runs call(), retrying retryable errors after a full-jitter backoff. Once `cancelled`
+    is set no further attempt is made and a backoff in progress is cut short.
+    """
+    if cancelled is not None:
+        sleep = cancelled.wait
+    attempts = max(1, settings.llm_max_attempts)
+    for attempt in range(attempts):
+        if cancelled is not None and cancelled.is_set():
+            raise _HedgeLost()
+        try:
+            return call()
+        except RETRYABLE_ERRORS as e:
+            if attempt == attempts - 1:
+                raise
+            delay = _backoff(attempt)
+            llm_retries.inc(task=task, model=model_name)
+            print(f"Gemini {task} call failed ({type(e).__name__}: {e}); retrying in {delay:.1f}s "
+                  f"(attempt {attempt + 2}/{attempts}).")
+            sleep(delay)
+
+
+def _hedged(call, task: str, model_name: str):
+    """
+    Runs call(cancelled); if it has not finished after llm_hedge_after_seconds, runs it
+    again and takes the first success. The loser is cancelled if it has not started,
+    and otherwise stops before its next attempt or wait for a rate-limit token.
+    """
+    settled = threading.Event()
+
+    def request():
+        result = call(settled)
+        # Set here, not by the caller: the worker may pick up a queued request next.
+        settled.set()
+        return result
+
+    # Each request runs in a copy of the caller's context, keeping its trace ID and priority.
+    primary = _hedge_executor.submit(contextvars.copy_context().run, request)
+    try:
+        return primary.result(timeout=settings.llm_hedge_after_seconds)
+    except FuturesTimeout:
+        pass
+
+    hedge = _hedge_executor.submit(contextvars.copy_context().run, request)
+    pending = {primary, hedge}
+    error = None
+    try:
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    llm_hedges.inc(task=task, model=model_name, winner="primary" if future is primary else "hedge")
+                    return future.result()
+                error = future.exception()
+        raise error
+    finally:
+        settled.set()
+        for future in pending:
+            # A request already waiting on Gemini cannot be interrupted; its result is discarded.
+            future.cancel()
+
+
+def generate(
+    task: str,
+    prompt: str,
+    generation_config: dict | None = None,
+    cached_content: caching.CachedContent | None = None
+):
+    """
+    Calls Gemini for one task and returns the response. Raises the last error
+    once retries are exhausted, or immediately for non-retryable errors.
+    With cached_content, the prompt is answered against the cached text.
+    """
+    if cached_content is not None:
+        model_name = cached_content.model.removeprefix("models/")
+        model = genai.GenerativeModel.from_cached_content(cached_content, generation_config=generation_config)
+    else:
+        model_name = model_for_task(task)
+        model = get_generative_model(model_name, generation_config)
+
+    def attempt():
+        _wait_for_rate_limit(model_name)
+        start = time.perf_counter()
+        try:
+            response = model.generate_content(prompt)
+        except Exception as e:
+            record_llm_call(task, model_name, prompt, None, time.perf_counter() - start, error=e)
+            raise
+        record_llm_call(task, model_name, prompt, response, time.perf_counter() - start)
+        return response
+
+    def call(cancelled: threading.Event | None = None):
+        return _with_retries(attempt, task, model_name, cancelled)
+
+    if settings.llm_hedge_after_seconds > 0 and task in settings.llm_hedge_tasks:
+        return _hedged(call, task, model_name)
+    return call()
+
+
+def create_cache(model_name: str, text: str, ttl_seconds: int) -> caching.CachedContent:
+    """Uploads text to Gemini's context cache for model_name. Rate-limited and retried like generate()."""
+    def attempt():
+        _wait_for_rate_limit(model_name)
+        start = time.perf_counter()
+        try:
+            cache = caching.CachedContent.create(model=model_name, contents=[text], ttl=ttl_seconds)
+        except Exception as e:
+            record_llm_call("context_cache", model_name, text, None, time.perf_counter() - start, error=e)
+            raise
+        record_llm_call("context_cache", model_name, text, None, time.perf_counter() - start)
+        return cache
+
+    return _with_retries(attempt, "context_cache", model_name)
+
+
+def delete_cache(cache: caching.CachedContent):
+    """Deletes a context cache before its TTL runs out. Errors are logged, not raised."""
+    try:
+        cache.delete()
+    except Exception as e:
+        print(f"Could not delete Gemini context cache {cache.name}: {e}")
+
+
+def open_stream(task: str, prompt: str, label: str | None = None) -> tuple[str, object]:
+    """
+    Starts a streaming Gemini call for `task` and returns (model name, response iterator).
+    The model is the task's own; `label` (default: the task) names the call in metrics.
+    Starting the call is rate-limited and retried; errors while iterating are not.
+    A stream is never hedged: the client is already reading the first request's text.
+    """
+    model_name = model_for_task(task)
+    model = get_generative_model(model_name)
+
+    def attempt():
+        _wait_for_rate_limit(model_name)
+        return model.generate_content(prompt, stream=True)
+
+    return model_name, _with_retries(attempt, label or task, model_name)
@@ -0,0 +1,157 @@
+import hashlib
+import re
+
+from app.core.tokens import CHARS_PER_TOKEN, estimate_tokens
+
+# --- Local Deterministic Chunker ---
+# Splits extracted text into clause-level chunks without an LLM call:
+#   1. Lines that look like clause/article/section headings start a new unit.
+#   2. Units longer than max_tokens are split at sentence boundaries, carrying
+#      up to overlap_tokens of trailing sentences into the next piece.
+#   3. Units shorter than min_tokens are merged into the following unit.
+# A sentence is never split unless it alone exceeds max_tokens.
+
+_HEADING = re.compile(
+    r"""^\s*(?:
+        \d+(?:\.\d+)+\.?\s+\S                                  # 12.3 Term / 12.3. Term
+      | \d+[.)]\s+\S                                           # 4. Rent / 4) Rent
+      | \([a-zA-Z]\)\s+\S                                      # (a) ...
+      | \((?:i|ii|iii|iv|v|vi|vii|viii|ix|x|xi|xii)\)\s+\S        # (iv) ...
+      | [IVXLC]+\.\s+\S                                         # IV. Remedies
+      | [A-Z][A-Z0-9 ,&'/-]{3,80}$                               # ALL-CAPS HEADING
+    )""",
+    re.VERBOSE
+)
+_ARTICLE_WORDS = re.compile(
+    r"^\s*(?:article|section|clause|schedule|exhibit|appendix|annex|part|chapter)\s+[\dIVXLC]",
+    re.IGNORECASE
+)
+_SENTENCE_END = re.compile(r"(?<=[.!?;])\s+(?=[\"'(\[]?[A-Z0-9])")
+
+
+def _is_heading(line: str) -> bool:
+    stripped = line.strip()
+    if not stripped or len(stripped) > 200:
+        return False
+    return bool(_ARTICLE_WORDS.match(stripped) or _HEADING.match(stripped))
+
+
+def _split_units(text: str) -> list[str]:
+    """Splits text into units, each starting at a heading line (the first may have none)."""
+    units, current = [], []
+    for line in text.splitlines():
+        if current and _is_heading(line):
+            units.append("\n".join(current).strip())
+            current = []
+        current.append(line)
+    if current:
+        units.append("\n".join(current).strip())
+    return [unit for unit in units if unit]
+
+
+def _split_sentences(text: str) -> list[str]:
+    return [s for s in _SENTENCE_END.split(text) if s.strip()]
+
+
+def _split_oversized(unit: str, max_tokens: int, overlap_tokens: int) -> list[str]:
+    """Splits a unit longer than max_tokens at sentence boundaries, with sentence-level overlap."""
+    pieces = []
+    current, current_tokens = [], 0
+    for sentence in _split_sentences(unit):
+        sentence_tokens = estimate_tokens(sentence)
+        if sentence_tokens > max_tokens:
+            # A single run-on "sentence" (tables, lists without punctuation): hard split at whitespace.
+            if current:
+                pieces.append(" ".join(current))
+                current, current_tokens = [], 0
+            max_chars = max_tokens * CHARS_PER_TOKEN
+            start = 0
+            while start < len(sentence):
+                cut = start + max_chars
+                if cut < len(sentence):
+                    space = sentence.rfind(" ", start, cut)
+                    cut = space if space > start else cut
+                pieces.append(sentence[start:cut].strip())
+                start = cut
+            continue
+
+        if current and current_tokens + sentence_tokens > max_tokens:
+            pieces.append(" ".join(current))
+            # Carry trailing sentences forward as overlap.
+            overlap, overlap_size = [], 0
+            for previous in reversed(current):
+                previous_tokens = estimate_tokens(previous)
+                if overlap_size + previous_tokens > overlap_tokens:
+                    break
+                overlap.insert(0, previous)
+                overlap_size += previous_tokens
+            current, current_tokens = overlap, overlap_size
+        current.append(sentence)
+        current_tokens += sentence_tokens
+    if current:
+        pieces.append(" ".join(current))
+    return [piece for piece in pieces if piece]
+
+
+def chunk_text_locally(text: str, min_tokens: int = 64, max_tokens: int = 400, overlap_tokens: int = 40) -> list[str]:
+    """
+    Chunks a legal document by clause structure using regex and layout cues.
+
+    Args:
+        text: The extracted document text.
+        min_tokens: Units smaller than this are merged with the next unit.
+        max_tokens: Units larger than this are split at sentence boundaries.
+        overlap_tokens: Trailing context repeated at the start of the next piece of a split unit.
+
+    Returns:
+        The chunks, in document order.
+    """
+    chunks = []
+    pending = ""
+    for unit in _split_units(text):
+        if pending:
+            unit = f"{pending}\n{unit}"
+            pending = ""
+        if estimate_tokens(unit) < min_tokens:
+            pending = unit
+            continue
+        if estimate_tokens(unit) > max_tokens:
+            chunks.extend(_split_oversized(unit, max_tokens, overlap_tokens))
+        else:
+            chunks.append(unit)
+
+    if pending:
+        if chunks and estimate_tokens(chunks[-1]) + estimate_tokens(pending) <= max_tokens:
+            chunks[-1] = f"{chunks[-1]}\n{pending}"
+        else:
+            chunks.append(pending)
+    return chunks
+
+
+def _is_window_boundary(chunk: str) -> bool:
+    """True for about one chunk in four, decided by the chunk's content alone."""
+    return hashlib.blake2b(chunk.encode("utf-8"), digest_size=2).digest()[0] % 4 == 0
+
+
+def group_chunks_into_windows(chunks: list[str], max_tokens: int) -> list[list[str]]:
+    """
+    Groups consecutive chunks so each group's text fits in one LLM window.
+
+    Once a window is half full it also ends after any boundary chunk (chosen by
+    content, not position), so an edit only moves the boundaries of the windows
+    around it and an amended document keeps most of its windows unchanged.
+    """
+    windows, current, current_tokens = [], [], 0
+    for chunk in chunks:
+        chunk_tokens = estimate_tokens(chunk)
+        if current and current_tokens + chunk_tokens > max_tokens:
+            windows.append(current)
+            current, current_tokens = [], 0
+        current.append(chunk)
+        current_tokens += chunk_tokens
+        if current_tokens >= max_tokens // 2 and _is_window_boundary(chunk):
+            windows.append(current)
+            current, current_tokens = [], 0
+    if current:
+        windows.append(current)
+    return windows
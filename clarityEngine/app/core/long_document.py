@@ -0,0 +1,206 @@
+import re
+
+from app.config import settings
+from app.core.concurrency import gather_bounded, run_cpu, run_io, run_llm_call
+from app.core.clarity_engine import (
+    get_summary_from_gemini,
+    get_partial_summary_from_gemini,
+    get_combined_summary_from_gemini,
+    get_section_titles_from_gemini,
+    get_summary_for_section_from_gemini
+)
+from app.core.document_context import DocumentContext, context_for_task, create_document_context
+from app.core.segmentation import FALLBACK_TITLE, SectionSpan, segment_sections
+from app.core.tokens import CHARS_PER_TOKEN, estimate_tokens
+
+# --- Map-Reduce Long Document Mode ---
+# Text that fits in one token-budgeted window goes to Gemini in one call, as
+# before. Longer text is split into windows that are processed in parallel
+# (map) and, for summaries, merged hierarchically (reduce), so the output
+# covers the whole document and cost grows linearly with its length.
+# Text that fits in one window may instead be cached with Gemini once (see
+# app.core.document_context); every function below then takes the context.
+
+# How many partial summaries one reduce call merges at most.
+REDUCE_FAN_IN = 8
+
+_SENTENCE_END = re.compile(r"(?<=[.!?;:])\s+")
+
+
+def split_into_windows(text: str, max_tokens: int) -> list[str]:
+    """
+    Splits text into consecutive windows of at most `max_tokens` (estimated),
+    breaking at paragraph boundaries, then sentence boundaries, then whitespace.
+    The windows concatenate back to the original text.
+    """
+    max_chars = max(1, max_tokens * CHARS_PER_TOKEN)
+    windows = []
+    start = 0
+    while len(text) - start > max_chars:
+        limit = start + max_chars
+        cut = text.rfind("\n\n", start, limit)
+        if cut <= start:
+            cut = text.rfind("\n", start, limit)
+        if cut <= start:
+            sentence_ends = [m.end() for m in _SENTENCE_END.finditer(text, start, limit)]
+            cut = sentence_ends[-1] if sentence_ends else -1
+        if cut <= start:
+            cut = text.rfind(" ", start, limit)
+        if cut <= start:
+            cut = limit
+        windows.append(text[start:cut])
+        start = cut
+    windows.append(text[start:])
+    return windows
+
+
+async def _reduce_summaries(partial_summaries: list[str], section_title: str | None = None) -> str:
+    """Merges partial summaries in groups of REDUCE_FAN_IN (and within the window budget) until one remains."""
+    window_chars = settings.long_document_window_tokens * CHARS_PER_TOKEN
+    summaries = [summary for summary in partial_summaries if summary]
+    if not summaries:
+        return ""
+
+    while len(summaries) > 1:
+        groups, current, current_chars = [], [], 0
+        for summary in summaries:
+            if current and (len(current) == REDUCE_FAN_IN or current_chars + len(summary) > window_chars):
+                groups.append(current)
+                current, current_chars = [], 0
+            current.append(summary)
+            current_chars += len(summary)
+        groups.append(current)
+
+        if len(groups) == len(summaries):
+            # Every summary fills a window on its own; merging pairwise still makes progress.
+            groups = [summaries[i:i + 2] for i in range(0, len(summaries), 2)]
+
+        print(f"Reducing {len(summaries)} partial summaries in {len(groups)} groups...")
+        summaries = await gather_bounded(
+            (
+                run_llm_call(
+                    get_combined_summary_from_gemini, group, section_title,
+                    fallback="\n\n".join(group)
+                ) if len(group) > 1 else _passthrough(group[0])
+                for group in groups
+            ),
+            limit=settings.long_document_concurrency
+        )
+    return summaries[0]
+
+
+async def _passthrough(summary: str) -> str:
+    return summary
+
+
+async def open_document_context(full_text: str) -> DocumentContext | None:
+    """
+    Caches the text with Gemini if it fits in one window and is long enough to be
+    worth caching (settings.document_context_*). Returns None otherwise.
+    """
+    if not settings.document_context_enabled:
+        return None
+    tokens = estimate_tokens(full_text)
+    if not settings.document_context_min_tokens <= tokens <= settings.long_document_window_tokens:
+        return None
+    return await run_io(create_document_context, full_text)
+
+
+async def summarize_document(full_text: str, context: DocumentContext | None = None) -> str:
+    """High-level summary of the whole document, map-reducing over windows when it is long."""
+    context = context_for_task(context, "summary")
+    windows = split_into_windows(full_text, settings.long_document_window_tokens)
+    if len(windows) == 1 or context is not None:
+        return await run_llm_call(
+            get_summary_from_gemini, full_text, context,
+            fallback="Could not generate a summary for this document."
+        )
+
+    print(f"Long document: summarizing {len(windows)} windows in parallel...")
+    partial_summaries = await gather_bounded(
+        (
+            run_llm_call(get_partial_summary_from_gemini, window, i, len(windows), fallback="")
+            for i, window in enumerate(windows, start=1)
+        ),
+        limit=settings.long_document_concurrency
+    )
+    summary = await _reduce_summaries(partial_summaries)
+    return summary or "Could not generate a summary for this document."
+
+
+async def identify_document_sections(full_text: str, context: DocumentContext | None = None) -> list[SectionSpan]:
+    """
+    Identifies the document's sections across every window.
+    Returns (section_title, start, end) spans covering the whole text.
+    """
+    context = context_for_task(context, "section_titles")
+    windows = [full_text] if context is not None else split_into_windows(full_text, settings.long_document_window_tokens)
+    print(f"Identifying document structure in {len(windows)} window(s)...")
+
+    async def titles_for(window: str) -> list[str]:
+        try:
+            return await run_llm_call(get_section_titles_from_gemini, window, context, fallback=[])
+        except Exception as e:
+            print(f"An error occurred during structure identification: {e}")
+            return []
+
+    titles_per_window = await gather_bounded(
+        (titles_for(window) for window in windows),
+        limit=settings.long_document_concurrency
+    )
+
+    section_titles = []
+    for titles in titles_per_window:
+        for title in titles:
+            title = title.strip()
+            # A window without clear sections reports the placeholder; it is not a real heading.
+            if len(windows) > 1 and title.lower() == FALLBACK_TITLE.lower():
+                continue
+            # A section running across a window boundary is reported by both windows.
+            if section_titles and section_titles[-1].lower() == title.lower():
+                continue
+            section_titles.append(title)
+
+    # Placing titles is CPU-bound and linear in the text; run it off the event loop.
+    return await run_cpu(segment_sections, full_text, section_titles)
+
+
+async def summarize_section(
+    section_title: str,
+    section_text: str,
+    context: DocumentContext | None = None,
+    start: int | None = None
+) -> str:
+    """
+    Executive summary of one section, map-reducing over windows when the section is long.
+    With a context and the section's offset in the cached text (`start`), each part is
+    identified in the cached text instead of being sent; the parts are the same either way.
+    """
+    fallback = "Summary could not be generated for this section."
+    context = context_for_task(context, "section_summary")
+    windows = split_into_windows(section_text, settings.section_window_tokens)
+    if len(windows) == 1:
+        return await run_llm_call(
+            get_summary_for_section_from_gemini, section_title, section_text, context, start,
+            fallback=fallback
+        )
+
+    # The windows concatenate back to the section, so each one starts where the previous ended.
+    offsets = [0]
+    for window in windows[:-1]:
+        offsets.append(offsets[-1] + len(window))
+    print(f"Long section '{section_title}': summarizing {len(windows)} parts...")
+    partial_summaries = await gather_bounded(
+        (
+            run_llm_call(
+                get_summary_for_section_from_gemini,
+                f"{section_title} (Part {i} of {len(windows)})", window, context,
+                None if start is None else start + offset,
+                fallback=""
+            )
+            for i, (window, offset) in enumerate(zip(windows, offsets), start=1)
+        ),
+        limit=settings.long_document_concurrency
+    )
+    partial_summaries = [s for s in partial_summaries if s and s != fallback]
+    return await _reduce_summaries(partial_summaries, section_title=section_title) or fallback
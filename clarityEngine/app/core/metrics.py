@@ -0,0 +1,236 @@
+import bisect
+import contextvars
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# --- Instrumentation ---
+# A small in-process metrics registry rendered in the Prometheus text format
+# at /metrics, plus timing spans tagged with the current request's trace ID.
+# The trace ID lives in a context variable: it is set by the HTTP middleware
+# and follows work into the executors (see app.core.concurrency).
+
+trace_id_var: contextvars.ContextVar[str] = contextvars.ContextVar("trace_id", default="-")
+
+# Seconds. Covers sub-millisecond FAISS searches up to multi-minute uploads.
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# Characters / tokens for prompt and response sizes.
+SIZE_BUCKETS = (100, 500, 1000, 5000, 10000, 50000, 100000, 500000, 1000000)
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex
+
+
+def current_trace_id() -> str:
+    return trace_id_var.get()
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(label_names: tuple[str, ...], label_values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape_label_value(str(value))}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, label_names: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self._values: dict[tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            return self._values.get(key, 0.0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    def set(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, label_names: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = tuple(sorted(buckets))
+        # key -> [bucket counts..., +Inf count], sum
+        self._series: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._series.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[position] += 1
+            total[0] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    labels = _format_labels(self.label_names, key, f'le="{bound}"')
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                cumulative += counts[-1]
+                labels = _format_labels(self.label_names, key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {total[0]}")
+                lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {cumulative}")
+        return lines
+
+
+_registry: list = []
+
+
+def _register(metric):
+    _registry.append(metric)
+    return metric
+
+
+def render_prometheus() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- Metric definitions ---
+http_request_duration = _register(Histogram(
+    "clarity_http_request_duration_seconds", "HTTP request latency by route and status.",
+    ("method", "route", "status")
+))
+stage_duration = _register(Histogram(
+    "clarity_stage_duration_seconds", "Duration of pipeline and Q&A stages.", ("stage",)
+))
+stage_errors = _register(Counter(
+    "clarity_stage_errors_total", "Stages that raised an exception.", ("stage",)
+))
+llm_call_duration = _register(Histogram(
+    "clarity_llm_call_duration_seconds", "Duration of individual Gemini calls.", ("task", "model")
+))
+llm_calls = _register(Counter(
+    "clarity_llm_calls_total", "Gemini calls by outcome.", ("task", "model", "outcome")
+))
+llm_time_to_first_token = _register(Histogram(
+    "clarity_llm_time_to_first_token_seconds", "Time until a streamed Gemini call yields its first text.",
+    ("task", "model")
+))
+llm_retries = _register(Counter(
+    "clarity_llm_retries_total", "Gemini calls retried after a retryable error.", ("task", "model")
+))
+llm_hedges = _register(Counter(
+    "clarity_llm_hedges_total", "Hedged Gemini requests, by which request answered first.",
+    ("task", "model", "winner")
+))
+llm_rate_limit_wait = _register(Histogram(
+    "clarity_llm_rate_limit_wait_seconds", "Time spent waiting for the Gemini rate limiter.", ("model",)
+))
+llm_prompt_chars = _register(Histogram(
+    "clarity_llm_prompt_chars", "Prompt size in characters.", ("task",), SIZE_BUCKETS
+))
+llm_response_chars = _register(Histogram(
+    "clarity_llm_response_chars", "Response size in characters.", ("task",), SIZE_BUCKETS
+))
+llm_tokens = _register(Counter(
+    "clarity_llm_tokens_total", "Tokens reported by Gemini usage metadata.", ("task", "model", "kind")
+))
+embedding_batch_texts = _register(Histogram(
+    "clarity_embedding_batch_texts", "Unique texts encoded per embedding batch.", (),
+    (1, 2, 4, 8, 16, 32, 64, 128, 256)
+))
+cache_requests = _register(Counter(
+    "clarity_cache_requests_total", "Cache lookups by cache and outcome.", ("cache", "outcome")
+))
+retrieval_paths = _register(Counter(
+    "clarity_retrieval_path_total", "Questions by how their context was found: exact, hybrid or vector.", ("path",)
+))
+admission_queue_depth = _register(Gauge(
+    "clarity_admission_queue_depth", "Work waiting for a slot, by priority class.", ("work_class",)
+))
+admission_in_flight = _register(Gauge(
+    "clarity_admission_in_flight", "Work holding a slot, by priority class.", ("work_class",)
+))
+admission_wait = _register(Histogram(
+    "clarity_admission_wait_seconds", "Time spent waiting for a slot, by priority class.", ("work_class",)
+))
+admission_rejections = _register(Counter(
+    "clarity_admission_rejections_total", "Requests turned away with 503, by priority class and reason.",
+    ("work_class", "reason")
+))
+
+
+@contextmanager
+def span(stage: str, **attributes):
+    """
+    Times a block as one stage of the current request.
+
+    Records the duration in clarity_stage_duration_seconds, counts failures,
+    and prints one line tagged with the trace ID. Works in sync and async code.
+    """
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        stage_errors.inc(stage=stage)
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        stage_duration.observe(duration, stage=stage)
+        details = " ".join(f"{key}={value}" for key, value in attributes.items())
+        print(f"[trace={current_trace_id()}] span={stage} status={status} duration_ms={duration * 1000:.1f} {details}".rstrip())
+
+
+def record_llm_call(task: str, model: str, prompt: str, response, duration: float, error: Exception | None = None):
+    """Records one Gemini call: latency, outcome, prompt/response sizes and token usage."""
+    llm_call_duration.observe(duration, task=task, model=model)
+    llm_calls.inc(task=task, model=model, outcome="error" if error else "ok")
+    llm_prompt_chars.observe(len(prompt), task=task)
+    if error is not None or response is None:
+        return
+
+    try:
+        text = response.text
+    except Exception:
+        # Blocked or empty candidates; the caller surfaces the error.
+        text = ""
+    llm_response_chars.observe(len(text), task=task)
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None:
+        llm_tokens.inc(getattr(usage, "prompt_token_count", 0) or 0, task=task, model=model, kind="prompt")
+        llm_tokens.inc(getattr(usage, "candidates_token_count", 0) or 0, task=task, model=model, kind="response")
+        llm_tokens.inc(getattr(usage, "cached_content_token_count", 0) or 0, task=task, model=model, kind="cached")
@@ -0,0 +1,392 @@
+import asyncio
+import os
+import uuid
+from collections.abc import Awaitable, Callable
+from dataclasses import asdict
+
+import numpy as np
+
+from app.config import settings
+from app.core.admission import admission, SECTION
+from app.core.concurrency import run_io, run_cpu, gather_bounded, run_llm_call
+from app.core.corpus import corpus_index
+from app.core.document_processor import extract_document_text
+from app.core.clarity_engine import get_semantic_chunks_from_gemini, CHUNKING_ERROR_PREFIX
+from app.core.local_chunker import chunk_text_locally, group_chunks_into_windows
+from app.core.document_context import close_document_context
+from app.core.lexical_index import store_lexical_index
+from app.core.long_document import (
+    open_document_context, summarize_document, identify_document_sections, summarize_section
+)
+from app.core.metrics import span, cache_requests
+from app.core.result_cache import get_cached_result, put_cached_result
+from app.core.segmentation import SectionSpan, segment_sections
+from app.core.uploads import hash_file
+from app.core.vector_store import embed_chunks, store_embeddings, has_document, get_chunk_vectors
+from app.core.versions import (
+    PreviousVersion, ChunkChanges, text_hash, hash_texts, load_previous_version, diff_sections,
+    diff_chunks, assemble_embeddings, save_version_record, version_info, link_to_previous_version
+)
+from app.cache import document_chunk_cache
+
+# Stage names, in the order they start. Reported by the job status endpoint.
+PIPELINE_STAGES = ["extraction", "summary", "structure", "section_summaries", "chunking", "embedding"]
+
+# Called as on_progress(stage, status, data) whenever a stage starts, finishes,
+# or (for section_summaries) produces a partial result.
+ProgressCallback = Callable[[str, str, dict], Awaitable[None]]
+
+
+async def _no_progress(stage: str, status: str, data: dict):
+    return None
+
+
+async def chunk_document(
+    text: str,
+    previous: PreviousVersion | None = None
+) -> tuple[list[str], list[tuple[str | None, int]]]:
+    """
+    Splits the extracted text into chunks for Q&A according to settings.chunking_mode:
+      "local"      deterministic clause-aware chunking, no LLM call (default)
+      "llm"        the whole text is chunked by Gemini in one call
+      "local+llm"  local chunks, grouped into windows that Gemini re-chunks in parallel;
+                   a window whose refinement fails keeps its local chunks, and a window
+                   unchanged since the previous version keeps that version's refinement
+
+    Returns the chunks and, for "local+llm", the (window hash, chunk count) of each
+    window for the version record.
+    """
+    mode = settings.chunking_mode
+    if mode == "llm":
+        return await run_llm_call(get_semantic_chunks_from_gemini, text, fallback=[]), []
+
+    local_chunks = await run_cpu(
+        chunk_text_locally, text,
+        min_tokens=settings.chunk_min_tokens,
+        max_tokens=settings.chunk_max_tokens,
+        overlap_tokens=settings.chunk_overlap_tokens
+    )
+    if mode != "local+llm" or not local_chunks:
+        return local_chunks, []
+
+    windows = group_chunks_into_windows(local_chunks, settings.long_document_window_tokens)
+    window_hashes = [text_hash("\n".join(window)) for window in windows]
+    known = previous.refined_windows if previous else {}
+    reused = sum(1 for window_hash in window_hashes if window_hash in known)
+    print(f"Refining {len(local_chunks)} local chunks with Gemini in {len(windows) - reused} window(s)"
+          f" ({reused} unchanged window(s) reused)...")
+
+    async def refine(window: list[str], window_hash: str) -> tuple[list[str], str | None]:
+        if window_hash in known:
+            return known[window_hash], window_hash
+        refined = await run_llm_call(get_semantic_chunks_from_gemini, "\n".join(window), fallback=[])
+        if not refined or refined[0].startswith(CHUNKING_ERROR_PREFIX):
+            return window, None
+        return refined, window_hash
+
+    refined_windows = await gather_bounded(
+        (refine(window, window_hash) for window, window_hash in zip(windows, window_hashes)),
+        limit=settings.long_document_concurrency
+    )
+    chunks = [chunk for window, _ in refined_windows for chunk in window]
+    return chunks, [(window_hash, len(window)) for window, window_hash in refined_windows]
+
+
+async def _restore_cached_document(document_id: str, filename: str, cached_result: dict, embeddings):
+    """Re-creates a cached document's chunks and indexes if the document store or corpus no longer has them."""
+    if not (await run_io(has_document, document_id) and await run_io(document_chunk_cache.get, document_id)):
+        print(f"Restoring document ID {document_id} from the result cache...")
+        await run_io(document_chunk_cache.__setitem__, document_id, cached_result["chunks"])
+        await run_cpu(store_embeddings, document_id, embeddings)
+        await run_cpu(store_lexical_index, document_id, cached_result["chunks"])
+    await run_cpu(corpus_index.add_document, document_id, filename, cached_result["summary"], embeddings)
+
+
+async def _link_cached_version(document_id: str, previous: PreviousVersion):
+    """Links a result-cache hit for an amendment to the version it amends, if that keeps the history a chain."""
+    if document_id == previous.document_id:
+        return
+    if await run_io(link_to_previous_version, document_id, previous):
+        await run_cpu(corpus_index.supersede, previous.document_id, document_id)
+        print(f"Linked cached document ID {document_id} as version {previous.number + 1} of {previous.document_id}.")
+    else:
+        # Re-pointing a document that already has a predecessor (or precedes
+        # `previous`) would rewrite its history or form a cycle; it keeps its own.
+        print(f"Cached document ID {document_id} already has its own version history; "
+              f"not linking it to {previous.document_id}.")
+
+
+async def _embed_reusing_previous(
+    chunks: list[str],
+    previous: PreviousVersion | None,
+    changes: ChunkChanges | None
+) -> tuple[np.ndarray, int]:
+    """
+    Embeds the chunks, taking the vectors of chunks unchanged since the previous
+    version from its index. Returns (embeddings in chunk order, number reused).
+    """
+    if previous is not None and changes.reused:
+        reused_positions = sorted(changes.reused)
+        previous_vectors = await run_cpu(
+            get_chunk_vectors, previous.document_id, [changes.reused[p] for p in reused_positions]
+        )
+        if previous_vectors is not None:
+            fresh_chunks = [chunk for position, chunk in enumerate(chunks) if position not in changes.reused]
+            print(f"Reusing {len(reused_positions)} embeddings from version {previous.number}; "
+                  f"embedding {len(fresh_chunks)} new chunk(s).")
+            new_vectors = await run_io(embed_chunks, fresh_chunks) if fresh_chunks else previous_vectors[:0]
+            return assemble_embeddings(len(chunks), changes.reused, previous_vectors, new_vectors), len(reused_positions)
+        print("The previous version's index cannot return its stored vectors; embedding every chunk.")
+    # Encoding happens on the embedding service's batching thread; this call only waits for it.
+    return await run_io(embed_chunks, chunks), 0
+
+
+async def run_processing_pipeline(
+    upload_path: str,
+    mime_type: str,
+    filename: str,
+    on_progress: ProgressCallback = _no_progress,
+    previous_document_id: str | None = None,
+    content_hash: str | None = None
+) -> dict:
+    """
+    Extracts text, generates a high-level summary, identifies and summarizes
+    sections, and prepares the document for Q&A.
+
+    The upload is read from upload_path (see app.core.uploads); content_hash is its
+    SHA-256 when already computed while spooling.
+
+    Identical uploads are served from the content-addressed result cache
+    without calling Document AI, Gemini or the embedding model again.
+
+    previous_document_id names the processed document this upload amends. The
+    upload becomes a new version with its own document ID; sections, chunks and
+    embeddings the amendment did not change are reused (see app.core.versions).
+    If the amendment's exact bytes were processed before, the cached document is
+    returned and linked as the new version when its own history allows it.
+
+    Returns the same payload the /process-document endpoint sends back.
+    """
+    previous = None
+    if previous_document_id:
+        previous = await run_io(load_previous_version, previous_document_id)
+        if previous is None:
+            raise ValueError(f"Previous document ID {previous_document_id} not found.")
+
+    upload_bytes = os.path.getsize(upload_path)
+    with span("result_cache_lookup", upload_bytes=upload_bytes):
+        if content_hash is None:
+            content_hash = await run_io(hash_file, upload_path)
+        cached = await run_io(get_cached_result, content_hash)
+    cache_requests.inc(cache="result", outcome="miss" if cached is None else "hit")
+    if cached is not None:
+        cached_result, cached_embeddings = cached
+        document_id = cached_result["document_id"]
+        print(f"Result cache hit for upload {content_hash[:12]}; skipping the processing pipeline.")
+        if document_id is not None:
+            await _restore_cached_document(document_id, filename, cached_result, cached_embeddings)
+            if previous is not None:
+                await _link_cached_version(document_id, previous)
+        for stage in PIPELINE_STAGES:
+            await on_progress(stage, "completed", {"cached": True})
+        return {
+            "message": "Document processed successfully.",
+            "document_id": document_id,
+            "filename": filename,
+            "summary": cached_result["summary"],
+            "sections": cached_result["sections"],
+            "chunk_count": len(cached_result["chunks"]),
+            "page_count": len(cached_result.get("page_offsets", [])) or None,
+            "version": await run_io(version_info, document_id) if document_id else None,
+            "cached": True
+        }
+
+    # --- STAGE 1: Text Extraction (PDF text layer, Document AI for pages that need OCR) ---
+    print("Stage 1: Extracting text...")
+    await on_progress("extraction", "running", {})
+    with span("extraction", upload_bytes=upload_bytes):
+        extracted = await extract_document_text(upload_path, mime_type)
+    extracted_text = extracted.text
+    await on_progress("extraction", "completed", {
+        "characters": len(extracted_text),
+        "pages": extracted.page_count,
+        "text_layer_pages": extracted.text_layer_pages,
+        "ocr_pages": extracted.ocr_pages
+    })
+    print("Text extraction complete.")
+
+    document_text_hash = await run_cpu(text_hash, extracted_text)
+    unchanged_text = previous is not None and previous.text_hash == document_text_hash
+    if previous is not None:
+        print(f"Comparing with version {previous.number} (document ID {previous.document_id}): "
+              f"text {'unchanged' if unchanged_text else 'amended'}.")
+
+    # --- STAGES 2-4 run concurrently ---
+    # The overall summary and the semantic chunking only need the extracted
+    # text, so they run alongside structure detection and the section fan-out.
+    async def summary_stage():
+        print("Stage 2: Generating high-level summary...")
+        await on_progress("summary", "running", {})
+        with span("summary", text_chars=len(extracted_text)):
+            if unchanged_text and previous.summary:
+                summary = previous.summary
+            else:
+                summary = await summarize_document(extracted_text, context)
+        await on_progress("summary", "completed", {"summary": summary})
+        return summary
+
+    async def chunking_stage():
+        print("Stage 4: Generating semantic chunks for Q&A...")
+        await on_progress("chunking", "running", {})
+        with span("chunking", mode=settings.chunking_mode):
+            if unchanged_text and settings.chunking_mode == "llm":
+                chunks, windows = previous.chunks, []
+            else:
+                chunks, windows = await chunk_document(extracted_text, previous)
+        await on_progress("chunking", "completed", {"chunk_count": len(chunks)})
+        print("Semantic chunking complete.")
+        return chunks, windows
+
+    chunks_task = asyncio.create_task(chunking_stage())
+    summary_task = None
+    context = None
+
+    try:
+        # The summary, structure and section prompts share one cached copy of
+        # the text; nothing is generated from it when the text is unchanged.
+        if not unchanged_text:
+            context = await open_document_context(extracted_text)
+        summary_task = asyncio.create_task(summary_stage())
+
+        # --- STAGE 3: Section Identification & Summarization ---
+        print("Stage 3: Identifying and summarizing document sections...")
+        await on_progress("structure", "running", {})
+        with span("structure", text_chars=len(extracted_text)):
+            if unchanged_text and previous.sections:
+                document_sections = await run_cpu(
+                    segment_sections, extracted_text, [s["title"] for s in previous.sections]
+                )
+            else:
+                document_sections = await identify_document_sections(extracted_text, context)
+        await on_progress("structure", "completed", {"titles": [section.title for section in document_sections]})
+
+        section_hashes = await run_cpu(
+            hash_texts, [extracted_text[section.start:section.end] for section in document_sections]
+        )
+        known_summaries = {s["text_hash"]: s["summary"] for s in previous.sections} if previous else {}
+        reused_summaries = sum(1 for hash_value in section_hashes if hash_value in known_summaries)
+
+        async def summarize_and_report(position: int, section: SectionSpan) -> str:
+            title, text = section.title, extracted_text[section.start:section.end]
+            with span("section_summary", section_chars=len(text)):
+                section_summary = known_summaries.get(section_hashes[position])
+                if section_summary is None:
+                    async with admission.admit(SECTION, reject=False):
+                        section_summary = await summarize_section(title, text, context, section.start)
+            await on_progress("section_summaries", "partial", {
+                "index": position, "title": title, "summary": section_summary
+            })
+            return section_summary
+
+        await on_progress("section_summaries", "running", {"total": len(document_sections)})
+        with span("section_summaries", sections=len(document_sections)):
+            section_summaries = await gather_bounded(
+                (
+                    summarize_and_report(i, section) for i, section in enumerate(document_sections)
+                ),
+                limit=settings.section_summary_concurrency
+            )
+        structured_summaries = [
+            {"title": section.title, "summary": section_summary}
+            for section, section_summary in zip(document_sections, section_summaries)
+        ]
+        await on_progress("section_summaries", "completed", {})
+        print("Section summarization complete.")
+
+        summary, (semantic_chunks, chunk_windows) = await asyncio.gather(summary_task, chunks_task)
+    except BaseException:
+        if summary_task is not None:
+            summary_task.cancel()
+        chunks_task.cancel()
+        raise
+    finally:
+        if context is not None:
+            await run_io(close_document_context, context)
+
+    # --- STAGE 5: Embed and Store in Vector Search ---
+    await on_progress("embedding", "running", {})
+    embeddings = None
+    chunk_hashes = await run_cpu(hash_texts, semantic_chunks)
+    chunk_changes = diff_chunks(previous.chunk_hashes, chunk_hashes) if previous else None
+    reused_embeddings = 0
+    if semantic_chunks:
+        document_id = str(uuid.uuid4())
+        print(f"Stage 5: Embedding and storing chunks for document ID: {document_id}")
+
+        # Cache the text chunks for later retrieval during Q&A
+        await run_io(document_chunk_cache.__setitem__, document_id, semantic_chunks)
+        with span("lexical_index", chunks=len(semantic_chunks)):
+            await run_cpu(store_lexical_index, document_id, semantic_chunks)
+        with span("embedding", chunks=len(semantic_chunks)):
+            embeddings, reused_embeddings = await _embed_reusing_previous(semantic_chunks, previous, chunk_changes)
+            await run_cpu(store_embeddings, document_id, embeddings)
+            await run_cpu(
+                corpus_index.add_document, document_id, filename, summary, embeddings,
+                supersedes=previous.document_id if previous else None
+            )
+        await run_io(
+            save_version_record, document_id, previous, filename, document_text_hash, summary,
+            [
+                {"title": s["title"], "text_hash": hash_value, "summary": s["summary"]}
+                for s, hash_value in zip(structured_summaries, section_hashes)
+            ],
+            chunk_hashes, chunk_windows
+        )
+        print("Knowledge storing complete.")
+    else:
+        document_id = None
+        print("No chunks were generated for Q&A, skipping embedding stage.")
+    await on_progress("embedding", "completed", {"document_id": document_id})
+
+    try:
+        await run_io(put_cached_result, content_hash, {
+            "document_id": document_id,
+            "extracted_text": extracted_text,
+            "page_offsets": extracted.page_offsets,
+            "summary": summary,
+            "sections": structured_summaries,
+            "chunks": semantic_chunks
+        }, embeddings)
+    except OSError as e:
+        print(f"Could not write the result cache entry: {e}")
+
+    return {
+        "message": "Document processed successfully.",
+        "document_id": document_id,
+        "filename": filename,
+        "summary": summary,
+        "sections": structured_summaries,
+        "chunk_count": len(semantic_chunks),
+        "page_count": extracted.page_count,
+        "version": {
+            "number": previous.number + 1 if previous else 1,
+            "previous_document_id": previous.document_id if previous else None,
+            "changes": None if previous is None else {
+                "text_unchanged": unchanged_text,
+                "sections": asdict(diff_sections(previous, [
+                    (section.title, hash_value) for section, hash_value in zip(document_sections, section_hashes)
+                ])),
+                "chunks": {
+                    "unchanged": chunk_changes.unchanged,
+                    "added": chunk_changes.added,
+                    "removed": chunk_changes.removed
+                }
+            },
+            "reused": None if previous is None else {
+                "summary": unchanged_text and bool(previous.summary),
+                "section_summaries": reused_summaries,
+                "embeddings": reused_embeddings
+            }
+        },
+        "cached": False
+    }
@@ -0,0 +1,129 @@
+import asyncio
+import itertools
+import json
+import threading
+import time
+
+import google.generativeai as genai
+from google.cloud import documentai
+
+from app.config import settings
+from app.core.concurrency import run_cpu, run_io
+
+# --- Shared Resources ---
+# Clients and model handles are built once and reused by every request:
+#   - Gemini model handles, one per (model name, generation config).
+#   - A small round-robin pool of Document AI clients, each with its own gRPC channel.
+#   - The local embedding model, loaded and exercised once at startup, and
+#     the corpus index (see app.core.corpus).
+# start_resources() runs from the FastAPI lifespan. Heavy imports (torch via
+# sentence-transformers, faiss) happen during warm-up rather than at import
+# time, so the server starts listening quickly and /ready reports when the
+# first request will no longer pay for loading them.
+
+_generative_models: dict[tuple[str, str], genai.GenerativeModel] = {}
+_generative_models_lock = threading.Lock()
+
+_docai_clients: list[documentai.DocumentProcessorServiceClient] = []
+_docai_cycle = None
+_docai_lock = threading.Lock()
+
+_ready = threading.Event()
+_warm_up_error: str | None = None
+_warm_up_task: asyncio.Task | None = None
+
+
+def get_generative_model(model_name: str, generation_config: dict | None = None) -> genai.GenerativeModel:
+    """Returns the shared Gemini model handle for this model name and generation config."""
+    key = (model_name, json.dumps(generation_config or {}, sort_keys=True))
+    with _generative_models_lock:
+        model = _generative_models.get(key)
+        if model is None:
+            model = genai.GenerativeModel(model_name, generation_config=generation_config)
+            _generative_models[key] = model
+        return model
+
+
+def clear_generative_models():
+    """Drops the cached model handles, e.g. after swapping genai.GenerativeModel in a benchmark."""
+    with _generative_models_lock:
+        _generative_models.clear()
+
+
+def get_docai_client() -> documentai.DocumentProcessorServiceClient:
+    """Returns the next Document AI client from the pool, creating the pool on first use."""
+    global _docai_cycle
+    with _docai_lock:
+        if not _docai_clients:
+            opts = {"api_endpoint": f"{settings.google_cloud_location}-documentai.googleapis.com"}
+            for _ in range(max(1, settings.docai_client_pool_size)):
+                _docai_clients.append(documentai.DocumentProcessorServiceClient(client_options=opts))
+            _docai_cycle = itertools.cycle(_docai_clients)
+        return next(_docai_cycle)
+
+
+def _close_docai_clients():
+    global _docai_cycle
+    with _docai_lock:
+        for client in _docai_clients:
+            try:
+                client.transport.close()
+            except Exception as e:
+                print(f"Error closing Document AI client: {e}")
+        _docai_clients.clear()
+        _docai_cycle = None
+
+
+def is_ready() -> bool:
+    return _ready.is_set()
+
+
+def readiness() -> dict:
+    """Readiness details for the /ready endpoint."""
+    if _ready.is_set():
+        return {"status": "ready"}
+    if _warm_up_error is not None:
+        return {"status": "error", "detail": _warm_up_error}
+    return {"status": "warming_up"}
+
+
+async def warm_up():
+    """Loads the embedding model, FAISS and the corpus index, and creates the shared clients."""
+    global _warm_up_error
+    from app.core.corpus import corpus_index
+    from app.core.vector_store import warm_up_embedding_model
+
+    start = time.perf_counter()
+    try:
+        await run_cpu(warm_up_embedding_model)
+        await run_cpu(corpus_index.load)
+        await run_io(get_docai_client)
+        for model_name in {settings.llm_default_model, *settings.llm_task_models.values()}:
+            get_generative_model(model_name)
+    except Exception as e:
+        _warm_up_error = str(e)
+        print(f"Warm-up failed; models will load on first use instead: {e}")
+        return
+    _ready.set()
+    print(f"Warm-up finished in {time.perf_counter() - start:.1f}s.")
+
+
+async def start_resources():
+    """Called from the lifespan. Warms up in the background unless configured to block startup."""
+    global _warm_up_task
+    if not settings.preload_models:
+        _ready.set()
+        return
+    if settings.warm_up_in_background:
+        _warm_up_task = asyncio.create_task(warm_up())
+    else:
+        await warm_up()
+
+
+async def stop_resources():
+    global _warm_up_task
+    if _warm_up_task is not None and not _warm_up_task.done():
+        _warm_up_task.cancel()
+    _warm_up_task = None
+    _close_docai_clients()
+    _ready.clear()
@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+
+from app.config import settings
+from app.core.clarity_engine import LATEST_MODEL, PROMPT_VERSION
+from app.core.document_context import context_model
+from app.core.document_store import atomic_write
+from app.core.embeddings import EMBEDDING_MODEL_NAME
+
+# --- Content-addressed Processing Result Cache ---
+# Keyed by the SHA-256 of the uploaded bytes, under a version directory
+# derived from the Gemini models, the prompt version, the embedding model and backend, and
+# the chunking settings:
+#   <result_cache_dir>/<version>/<sha256>/result.json
+#   <result_cache_dir>/<version>/<sha256>/embeddings.npy
+# Changing any of those inputs moves the cache to a new version directory;
+# the old one is dropped on the next eviction sweep.
+
+RESULT_FILENAME = "result.json"
+EMBEDDINGS_FILENAME = "embeddings.npy"
+
+_CACHE_VERSION_INPUTS = "|".join([
+    LATEST_MODEL,
+    json.dumps(settings.llm_task_models, sort_keys=True),
+    f"prompts-v{PROMPT_VERSION}",
+    # Which pages are read from the text layer and how OCR'd pages are batched change the text.
+    f"extraction-{settings.pdf_text_layer_enabled}-{settings.pdf_text_layer_min_chars}",
+    f"docai-{settings.docai_processor_id}-{settings.docai_pages_per_request}",
+    # Cached-context prompts are worded differently, and only tasks on the cache's model use them.
+    f"context-{context_model()}" if settings.document_context_enabled else "context-off",
+    EMBEDDING_MODEL_NAME,
+    # Quantized backends produce slightly different vectors.
+    f"embeddings-{settings.embedding_backend}",
+    f"chunks-{settings.chunking_mode}-{settings.chunk_min_tokens}-{settings.chunk_max_tokens}-{settings.chunk_overlap_tokens}"
+])
+CACHE_VERSION = hashlib.sha256(_CACHE_VERSION_INPUTS.encode("utf-8")).hexdigest()[:16]
+
+_sweep_lock = threading.Lock()
+
+
+def hash_content(file_content: bytes) -> str:
+    return hashlib.sha256(file_content).hexdigest()
+
+
+def _entry_dir(content_hash: str) -> str:
+    return os.path.join(settings.result_cache_dir, CACHE_VERSION, content_hash)
+
+
+def get_cached_result(content_hash: str) -> tuple[dict, np.ndarray | None] | None:
+    """
+    Looks up a previous processing result for the same bytes.
+
+    Returns:
+        (result, embeddings) on a hit, where result holds the extracted text,
+        summary, sections, chunks and document ID. None on a miss.
+    """
+    directory = _entry_dir(content_hash)
+    result_path = os.path.join(directory, RESULT_FILENAME)
+    embeddings_path = os.path.join(directory, EMBEDDINGS_FILENAME)
+    try:
+        with open(result_path, "r", encoding="utf-8") as f:
+            result = json.load(f)
+        embeddings = np.load(embeddings_path) if os.path.exists(embeddings_path) else None
+    except (OSError, ValueError) as e:
+        if os.path.exists(directory):
+            print(f"Discarding unreadable result cache entry {content_hash}: {e}")
+            shutil.rmtree(directory, ignore_errors=True)
+        return None
+
+    # Mark as recently used for LRU eviction.
+    os.utime(result_path)
+    return result, embeddings
+
+
+def put_cached_result(content_hash: str, result: dict, embeddings: np.ndarray | None):
+    """Stores a processing result and its chunk embeddings, then evicts down to the size budget."""
+    directory = _entry_dir(content_hash)
+    if embeddings is not None:
+        atomic_write(os.path.join(directory, EMBEDDINGS_FILENAME), lambda f: np.save(f, embeddings))
+    payload = json.dumps(result, ensure_ascii=False).encode("utf-8")
+    # result.json is written last: its presence marks the entry as complete.
+    atomic_write(os.path.join(directory, RESULT_FILENAME), lambda f: f.write(payload))
+    evict_stale_entries()
+
+
+def evict_stale_entries():
+    """
+    Removes entries from other cache versions, then least-recently-used
+    entries of the current version until the cache fits result_cache_max_bytes.
+    """
+    root = settings.result_cache_dir
+    if not os.path.isdir(root):
+        return
+
+    with _sweep_lock:
+        for version in os.listdir(root):
+            if version != CACHE_VERSION:
+                shutil.rmtree(os.path.join(root, version), ignore_errors=True)
+
+        version_dir = os.path.join(root, CACHE_VERSION)
+        if not os.path.isdir(version_dir):
+            return
+
+        entries = []
+        total_bytes = 0
+        for content_hash in os.listdir(version_dir):
+            directory = os.path.join(version_dir, content_hash)
+            try:
+                size = sum(entry.stat().st_size for entry in os.scandir(directory))
+                last_used = os.stat(os.path.join(directory, RESULT_FILENAME)).st_mtime
+            except OSError:
+                # Incomplete entry (no result.json yet) or removed concurrently.
+                continue
+            entries.append((last_used, size, directory))
+            total_bytes += size
+
+        entries.sort()
+        for _, size, directory in entries:
+            if total_bytes <= settings.result_cache_max_bytes:
+                break
+            shutil.rmtree(directory, ignore_errors=True)
+            total_bytes -= size
@@ -0,0 +1,216 @@
+import threading
+from collections import Counter
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from app.config import settings
+from app.core.lexical_index import LexicalIndex, build_lexical_index
+from app.core.tokens import estimate_tokens
+
+# --- Adaptive Retrieval ---
+# Turns the nearest-neighbour candidates for a question into the context sent
+# to Gemini, instead of pasting every candidate into the prompt:
+#   0. Fusion (hybrid mode): merge the vector and BM25 rankings by reciprocal
+#      rank; the fused rank replaces the similarity as the base score.
+#   1. Cutoff: drop candidates below retrieval_min_similarity or more than
+#      retrieval_relative_margin below the best match, so a focused question
+#      keeps a few chunks and a broad one keeps more (dynamic k). The best
+#      lexical matches are kept regardless.
+#   2. Re-rank (optional): blend the base score with a local lexical score
+#      ("lexical") or a small cross-encoder ("cross-encoder").
+#   3. MMR: pick chunks by relevance minus redundancy with chunks already
+#      picked, so near-duplicate clauses do not crowd out other evidence.
+#      Chunks at least retrieval_duplicate_similarity to a picked one are dropped.
+#   4. Pack: stop once retrieval_context_token_budget is reached.
+# The selected chunks are returned in document order.
+
+_cross_encoder = None
+_cross_encoder_lock = threading.Lock()
+
+
+@dataclass
+class Candidate:
+    chunk_index: int
+    text: str
+    similarity: float
+    score: float = 0.0
+    # Set for corpus-wide candidates, which come from several documents.
+    document_id: str = ""
+    # Set by fuse_candidates: position in the BM25 ranking, and the fused score scaled to [0, 1].
+    lexical_rank: int | None = None
+    fused_score: float | None = None
+
+
+@dataclass
+class RetrievedContext:
+    chunks: list[str]
+    chunk_indices: list[int]
+    document_ids: list[str]
+    context_tokens: int
+    stats: dict = field(default_factory=dict)
+
+
+def lexical_scores(question: str, texts: list[str]) -> np.ndarray:
+    """BM25 scores of the question against each text, with IDF over the texts themselves, scaled to [0, 1]."""
+    if not texts:
+        return np.zeros(0)
+    scores = LexicalIndex(*build_lexical_index(texts)).scores(question).astype(np.float64)
+    top = scores.max()
+    return scores / top if top > 0 else scores
+
+
+def _cross_encoder_scores(question: str, texts: list[str]) -> np.ndarray:
+    global _cross_encoder
+    with _cross_encoder_lock:
+        if _cross_encoder is None:
+            from sentence_transformers import CrossEncoder
+            print(f"Loading re-ranking model ({settings.retrieval_cross_encoder_model})...")
+            _cross_encoder = CrossEncoder(settings.retrieval_cross_encoder_model)
+    logits = np.asarray(_cross_encoder.predict([(question, text) for text in texts]), dtype=np.float64)
+    return 1 / (1 + np.exp(-logits))
+
+
+def fuse_candidates(
+    vector_candidates: list[Candidate],
+    lexical_matches: list[tuple[int, float]],
+    chunks,
+    limit: int | None = None
+) -> list[Candidate]:
+    """
+    Reciprocal-rank fusion of the vector candidates (best first) with BM25
+    matches (chunk index, score). Chunks found only lexically get similarity 0
+    until the caller fills it in. Returns up to `limit` candidates, best fused first.
+    """
+    limit = limit or settings.vector_search_neighbours
+    k = settings.retrieval_rrf_k
+    by_index = {c.chunk_index: c for c in vector_candidates}
+    fused = Counter()
+    for rank, candidate in enumerate(vector_candidates):
+        fused[candidate.chunk_index] += 1 / (k + rank + 1)
+    for rank, (index, _) in enumerate(lexical_matches):
+        if index >= len(chunks):
+            continue
+        fused[index] += 1 / (k + rank + 1)
+        candidate = by_index.setdefault(index, Candidate(index, chunks[index], 0.0))
+        candidate.lexical_rank = rank
+    if not fused:
+        return []
+
+    ranked = fused.most_common(limit)
+    best = ranked[0][1]
+    for index, score in ranked:
+        by_index[index].fused_score = score / best
+    return [by_index[index] for index, _ in ranked]
+
+
+def rescore_with_vectors(candidates: list[Candidate], vectors: np.ndarray, query_embedding: np.ndarray):
+    """Sets each candidate's similarity from its normalized stored vector, so BM25-only finds get one too."""
+    query = query_embedding[0] / (np.linalg.norm(query_embedding[0]) or 1.0)
+    for candidate, similarity in zip(candidates, (vectors @ query).tolist()):
+        candidate.similarity = similarity
+
+
+def _apply_cutoff(candidates: list[Candidate]) -> list[Candidate]:
+    if not candidates:
+        return []
+    best = max(c.similarity for c in candidates)
+    floor = max(settings.retrieval_min_similarity, best - settings.retrieval_relative_margin)
+    kept = [
+        c for c in candidates
+        if c.similarity >= floor or (c.lexical_rank is not None and c.lexical_rank < settings.retrieval_lexical_keep)
+    ]
+    if len(kept) < settings.retrieval_min_chunks:
+        ranked = sorted(candidates, key=lambda c: c.similarity, reverse=True)
+        kept = ranked[:settings.retrieval_min_chunks]
+    return kept
+
+
+def _rerank(question: str, candidates: list[Candidate]):
+    mode = settings.retrieval_reranker
+    for candidate in candidates:
+        candidate.score = candidate.fused_score if candidate.fused_score is not None else candidate.similarity
+    if mode == "none" or not candidates:
+        return
+    texts = [c.text for c in candidates]
+    if mode == "lexical":
+        extra = lexical_scores(question, texts)
+    elif mode == "cross-encoder":
+        extra = _cross_encoder_scores(question, texts)
+    else:
+        raise ValueError(f"Unknown retrieval re-ranker: {mode!r}")
+    weight = settings.retrieval_rerank_weight
+    for candidate, value in zip(candidates, extra.tolist()):
+        candidate.score = (1 - weight) * candidate.score + weight * value
+
+
+def _mmr_order(candidates: list[Candidate], vectors: np.ndarray | None) -> list[int]:
+    """
+    Positions of the candidates in maximal-marginal-relevance order, without
+    near-duplicates of earlier picks. Plain score order when there are no vectors.
+    """
+    by_score = sorted(range(len(candidates)), key=lambda i: candidates[i].score, reverse=True)
+    if vectors is None or len(candidates) < 2:
+        return by_score
+
+    trade_off = settings.retrieval_mmr_lambda
+    similarity = vectors @ vectors.T
+    scores = np.array([c.score for c in candidates])
+    order = [by_score[0]]
+    remaining = set(by_score[1:])
+    max_redundancy = similarity[by_score[0]].copy()
+    while remaining:
+        best = max(remaining, key=lambda i: trade_off * scores[i] - (1 - trade_off) * max_redundancy[i])
+        remaining.remove(best)
+        if max_redundancy[best] >= settings.retrieval_duplicate_similarity:
+            continue
+        order.append(best)
+        np.maximum(max_redundancy, similarity[best], out=max_redundancy)
+    return order
+
+
+def select_context(
+    question: str,
+    candidates: list[Candidate],
+    vectors: np.ndarray | None = None,
+    token_budget: int | None = None
+) -> RetrievedContext:
+    """
+    Chooses the chunks to send to Gemini from nearest-neighbour candidates.
+
+    Args:
+        question: The user's question (used by the re-ranker).
+        candidates: Chunks with their cosine similarity to the question.
+        vectors: Normalized embeddings of the candidates, row-aligned; enables MMR.
+        token_budget: Maximum estimated context tokens; defaults to settings.retrieval_context_token_budget.
+    """
+    token_budget = token_budget or settings.retrieval_context_token_budget
+    positions = {id(c): i for i, c in enumerate(candidates)}
+    kept = _apply_cutoff(candidates)
+    kept_vectors = vectors[[positions[id(c)] for c in kept]] if vectors is not None and kept else None
+    _rerank(question, kept)
+
+    selected, used_tokens = [], 0
+    for position in _mmr_order(kept, kept_vectors):
+        candidate = kept[position]
+        tokens = estimate_tokens(candidate.text)
+        if selected and used_tokens + tokens > token_budget:
+            # A smaller chunk further down may still fit.
+            continue
+        selected.append(candidate)
+        used_tokens += tokens
+
+    selected.sort(key=lambda c: (c.document_id, c.chunk_index))
+    return RetrievedContext(
+        chunks=[c.text for c in selected],
+        chunk_indices=[c.chunk_index for c in selected],
+        document_ids=[c.document_id for c in selected],
+        context_tokens=used_tokens,
+        stats={
+            "candidates": len(candidates),
+            "after_cutoff": len(kept),
+            "selected": len(selected),
+            "context_tokens": used_tokens,
+            "candidate_tokens": sum(estimate_tokens(c.text) for c in candidates)
+        }
+    )
@@ -0,0 +1,266 @@
+import bisect
+import re
+from typing import NamedTuple
+
+# --- Section Segmentation ---
+# Places the section titles Gemini reported onto the extracted text in one
+# pass over its lines, and returns character offsets instead of copies:
+#   1. Titles and line starts are normalized the same way: case, punctuation,
+#      Markdown and leading numbering ("ARTICLE 4", "12.3", "(iv)") are ignored.
+#   2. Every line is looked up in a hash of the normalized titles (a line may
+#      start with its title, e.g. "4. Rent. The Tenant shall..."). Titles not
+#      found exactly are retried allowing one character of difference.
+#   3. Of all occurrences (tables of contents, repeated headings), one per
+#      title is chosen so positions follow the title order and as many titles
+#      as possible are placed, preferring later occurrences (the body over a
+#      table of contents).
+#   4. "Title (Part 2)" titles share their base title's heading; its span is
+#      divided between the parts at paragraph breaks.
+# Sections tile the text: the first starts at 0 (any preamble belongs to it)
+# and each ends where the next begins. Lines are examined up to
+# _MAX_HEADING_CHARS, so the cost is linear in the text length.
+
+FALLBACK_TITLE = "Overall Summary"
+
+_MAX_HEADING_CHARS = 200
+# Title keys shorter than this must match exactly; "Rent" must not match "Rest".
+_MIN_FUZZY_CHARS = 6
+
+_TOKEN = re.compile(r"[^\W_]+")
+_ROMAN = re.compile(r"(?=[ivxlc])c{0,3}(?:xc|xl|l?x{0,3})(?:ix|iv|v?i{0,3})")
+_NUMBERED_WORDS = frozenset(
+    "article section clause part chapter schedule exhibit appendix annex".split()
+)
+_PART_SUFFIX = re.compile(r"\s*\(\s*part\s+(\d+)\s*(?:of\s+\d+\s*)?\)\s*$", re.IGNORECASE)
+# Punctuation that may separate a heading from body text on the same line.
+_HEADING_END = re.compile(r"\s*[.:;\-–—)]")
+
+
+class SectionSpan(NamedTuple):
+    title: str
+    start: int
+    end: int
+
+
+def _is_number(token: str) -> bool:
+    return token.isdigit() or (len(token) <= 4 and bool(_ROMAN.fullmatch(token))) or len(token) == 1
+
+
+def _skip_numbering(tokens: list[str]) -> int:
+    """Index of the first token after a leading "Article 4" / "12 3" / "IV" style number."""
+    position = 0
+    if len(tokens) > 1 and tokens[0] in _NUMBERED_WORDS and _is_number(tokens[1]):
+        position = 2
+    while position < len(tokens) - 1 and _is_number(tokens[position]):
+        position += 1
+    return position
+
+
+def _is_numbering(tokens: list[str]) -> bool:
+    """True for lines such as "ARTICLE 3" or "4." that only number the heading on the next line."""
+    return bool(tokens) and all(_is_number(t) or t in _NUMBERED_WORDS for t in tokens)
+
+
+def title_key(title: str) -> str:
+    tokens = _TOKEN.findall(title.casefold())
+    core = tokens[_skip_numbering(tokens):]
+    return " ".join(core or tokens)
+
+
+def _split_part(title: str) -> tuple[str, int | None]:
+    match = _PART_SUFFIX.search(title)
+    if match is None:
+        return title, None
+    return title[:match.start()], int(match.group(1))
+
+
+def _deletions(key: str) -> set[str]:
+    return {key[:i] + key[i + 1:] for i in range(len(key))}
+
+
+class _TitleIndex:
+    """Normalized base titles, for exact lookups and one-edit fuzzy lookups (symmetric deletion)."""
+
+    def __init__(self, keys: list[str]):
+        self.exact: dict[str, list[int]] = {}
+        for position, key in enumerate(keys):
+            if key:
+                self.exact.setdefault(key, []).append(position)
+        self.word_counts = sorted({key.count(" ") + 1 for key in self.exact})
+        # Most lines are body text; a line is only examined if it could start with a title's first word.
+        self.first_words = {key.split(" ", 1)[0] for key in self.exact}
+        self.fuzzy: dict[str, set[int]] = {}
+        self.fuzzy_lengths: set[int] = set()
+
+    def enable_fuzzy(self, keys: list[str], positions: set[int]):
+        for position in positions:
+            key = keys[position]
+            if len(key) < _MIN_FUZZY_CHARS:
+                continue
+            for variant in _deletions(key) | {key}:
+                self.fuzzy.setdefault(variant, set()).add(position)
+            self.fuzzy_lengths.update((len(key) - 1, len(key), len(key) + 1))
+            first_word = key.split(" ", 1)[0]
+            self.first_words |= _deletions(first_word) | {first_word}
+
+    def could_start_title(self, word: str) -> bool:
+        if word in self.first_words:
+            return True
+        return bool(self.fuzzy) and not _deletions(word).isdisjoint(self.first_words)
+
+    def fuzzy_lookup(self, candidate: str) -> set[int]:
+        found = set()
+        for variant in _deletions(candidate) | {candidate}:
+            found |= self.fuzzy.get(variant, set())
+        return found
+
+
+def _iter_lines(text: str, prefix_chars: int):
+    """(start offset, first prefix_chars characters) of every non-blank line, without splitting the whole text."""
+    start, length = 0, len(text)
+    while start < length:
+        end = text.find("\n", start)
+        if end == -1:
+            end = length
+        prefix = text[start:min(end, start + prefix_chars)]
+        if prefix and not prefix.isspace():
+            yield start, prefix
+        start = end + 1
+
+
+def _line_candidates(prefix: str, matches: list, tokens: list[str], core_start: int, max_words: int):
+    """Normalized prefixes of a line that could be a heading: the whole line or a run of words ending in punctuation."""
+    starts = (0, core_start) if 0 < core_start < len(tokens) else (0,)
+
+    candidates = []
+    for first in starts:
+        for last in range(first + 1, min(len(tokens), first + max_words + 1) + 1):
+            if last < len(tokens) and not _HEADING_END.match(prefix, matches[last - 1].end()):
+                continue
+            key = " ".join(tokens[first:last])
+            candidates.append(key)
+    return candidates
+
+
+def _find_occurrences(text: str, keys: list[str], fuzzy_positions: set[int] | None):
+    """(line start, title position) of every line that starts with one of the titles."""
+    index = _TitleIndex(keys)
+    if fuzzy_positions:
+        index.enable_fuzzy(keys, fuzzy_positions)
+    # Only the start of a line can hold a heading; "ARTICLE 12.3 (b)" adds a few characters to the title.
+    prefix_chars = min(_MAX_HEADING_CHARS, max(map(len, keys), default=0) + 32)
+    max_words = max(index.word_counts, default=0) + 1
+
+    occurrences = []
+    previous_start, previous_is_number = None, False
+    for start, prefix in _iter_lines(text, prefix_chars):
+        matches = list(_TOKEN.finditer(prefix.casefold()))
+        tokens = [m.group() for m in matches]
+        if not tokens:
+            continue
+        core_start = _skip_numbering(tokens)
+        if index.could_start_title(tokens[0]) or index.could_start_title(tokens[min(core_start, len(tokens) - 1)]):
+            found = set()
+            for candidate in _line_candidates(prefix, matches, tokens, core_start, max_words):
+                found.update(index.exact.get(candidate, ()))
+                if fuzzy_positions and len(candidate) in index.fuzzy_lengths:
+                    found |= index.fuzzy_lookup(candidate)
+            # A heading split over two lines ("ARTICLE 3" / "RENT") starts at the number line.
+            heading_start = previous_start if previous_is_number else start
+            occurrences.extend((heading_start, position) for position in found)
+        previous_start, previous_is_number = start, len(tokens) <= 3 and _is_numbering(tokens)
+    return occurrences
+
+
+def _ordered_placement(occurrences: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    """
+    The longest chain of occurrences increasing in both offset and title position,
+    preferring later offsets among equally long chains.
+    """
+    ordered = sorted(set(occurrences), key=lambda o: (-o[0], o[1]))
+    # -negated_titles[L] is the largest title position starting a chain of length L + 1 (decreasing in L).
+    negated_titles: list[int] = []
+    chain_heads: list[int] = []
+    following: list[int | None] = []
+    for number, (_, title) in enumerate(ordered):
+        length = bisect.bisect_left(negated_titles, -title)
+        following.append(chain_heads[length - 1] if length else None)
+        if length == len(negated_titles):
+            negated_titles.append(-title)
+            chain_heads.append(number)
+        elif -title < negated_titles[length]:
+            negated_titles[length] = -title
+            chain_heads[length] = number
+
+    chain = []
+    current = chain_heads[-1] if chain_heads else None
+    while current is not None:
+        chain.append(ordered[current])
+        current = following[current]
+    return chain
+
+
+def _divide(text: str, start: int, end: int, parts: int) -> list[int]:
+    """
+    Start offsets of `parts` roughly equal pieces of text[start:end], cut at the break nearest each target.
+
+    Every piece is non-empty while there are characters left; when there are more parts than
+    characters, the trailing pieces are empty spans at `end`.
+    """
+    starts = [start]
+    for part in range(1, parts):
+        target = start + (end - start) * part // parts
+        # A paragraph break is preferred unless it is much further off than a line break.
+        slack = (end - start) // (2 * parts)
+        cut = target
+        for separator in ("\n\n", "\n"):
+            before = text.rfind(separator, starts[-1] + 1, target)
+            after = text.find(separator, target, end - 1)
+            breaks = [b + len(separator) for b in (before, after) if b != -1]
+            nearest = min(breaks, key=lambda b: abs(b - target), default=None)
+            if nearest is not None and (separator == "\n" or abs(nearest - target) <= slack):
+                cut = nearest
+                break
+        starts.append(min(max(cut, starts[-1] + 1), end))
+    return starts
+
+
+def segment_sections(text: str, titles: list[str]) -> list[SectionSpan]:
+    """
+    Locates the titles (in document order) in the text.
+
+    Returns (title, start, end) spans that cover the text, in order. Titles that
+    cannot be placed are left out; if none can, the whole text is one section.
+    """
+    groups: list[tuple[str, list[str]]] = []
+    for title in (t.strip() for t in titles):
+        if not title:
+            continue
+        base, part = _split_part(title)
+        if part is not None and part > 1 and groups and title_key(groups[-1][0]) == title_key(base):
+            groups[-1][1].append(title)
+        else:
+            groups.append((base, [title]))
+
+    keys = [title_key(base) for base, _ in groups]
+    occurrences = _find_occurrences(text, keys, None)
+    missing = set(range(len(keys))) - {title for _, title in occurrences}
+    if missing:
+        occurrences += _find_occurrences(text, keys, missing)
+    placed = _ordered_placement(occurrences)
+
+    if not placed:
+        return [SectionSpan(FALLBACK_TITLE, 0, len(text))]
+    if len(placed) < len(groups):
+        print(f"Placed {len(placed)} of {len(groups)} section titles; the rest were not found in the text.")
+
+    placed[0] = (0, placed[0][1])
+    spans = []
+    for number, (start, position) in enumerate(placed):
+        end = placed[number + 1][0] if number + 1 < len(placed) else len(text)
+        part_titles = groups[position][1]
+        part_starts = _divide(text, start, end, len(part_titles)) + [end]
+        spans.extend(
+            SectionSpan(title, part_starts[i], part_starts[i + 1]) for i, title in enumerate(part_titles)
+        )
+    return spans
@@ -0,0 +1,11 @@
+# --- Token Estimates ---
+# Budgets for prompts, windows and chunks are counted in estimated tokens.
+# Kept free of other app imports so the local chunker and retrieval code can
+# use it without pulling in the Gemini client.
+
+# Rough characters-per-token ratio for English prose; good enough for budgeting.
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
@@ -0,0 +1,217 @@
+import hashlib
+import os
+import uuid
+from dataclasses import dataclass
+
+from pypdf import PdfReader
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+from app.config import settings
+
+# --- Upload Ingestion ---
+# An upload is never held in memory whole. It reaches the pipeline as a file:
+#   - an HTTP upload's multipart body is parsed as it arrives and its file
+#     part written straight to a spool file under job_spool_dir, hashed as it
+#     is written, and refused (413) as soon as it passes max_upload_bytes,
+#     whether or not the request declared its length;
+#   - with local handoff, the Node backend, which has already written the
+#     upload to a directory this service can read (local_handoff_dir), sends
+#     only its path. The file is checked and hashed in place and never copied.
+# Either way the page count is read from the PDF's page tree, without parsing
+# the pages, and checked against max_upload_pages before any work is admitted.
+# PDFs pypdf cannot read are let through; Document AI reports its own limits.
+
+
+class UploadRejected(Exception):
+    """An upload the service will not process. The API answers with status_code."""
+
+    def __init__(self, message: str, status_code: int = 413):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+@dataclass
+class Upload:
+    path: str
+    size: int
+    content_hash: str
+    page_count: int | None
+    # True for spool files, which are removed when processing is done; handed-off
+    # files belong to the Node backend, which still serves them to the viewer.
+    owned: bool
+
+
+def _too_large() -> UploadRejected:
+    return UploadRejected(f"The upload exceeds the {settings.max_upload_bytes // (1024 * 1024)} MB limit.")
+
+
+def count_pdf_pages(path: str) -> int | None:
+    """Page count from the PDF's page tree, or None if pypdf cannot read it."""
+    try:
+        with open(path, "rb") as f:
+            reader = PdfReader(f)
+            if reader.is_encrypted:
+                reader.decrypt("")
+            return len(reader.pages)
+    except Exception:
+        return None
+
+
+def _check_pages(path: str, mime_type: str) -> int | None:
+    if mime_type != "application/pdf":
+        return None
+    page_count = count_pdf_pages(path)
+    if page_count is not None and page_count > settings.max_upload_pages:
+        raise UploadRejected(f"The document has {page_count} pages; at most {settings.max_upload_pages} are supported.")
+    return page_count
+
+
+# Text fields (previous_document_id) are small; anything longer is not a field we read.
+_MAX_FIELD_BYTES = 64 * 1024
+
+
+class MultipartUpload:
+    """
+    Receives a multipart/form-data body piece by piece (feed), writing the part named
+    `file_field` to a spool file and keeping the text fields. finish() checks the
+    limits and returns the Upload; abort() removes the spool file. Blocking; call through run_io.
+    """
+
+    def __init__(self, content_type: str | None, file_field: str = "file"):
+        kind, options = parse_options_header(content_type)
+        if kind != b"multipart/form-data" or not options.get(b"boundary"):
+            raise UploadRejected("Expected a multipart/form-data upload.", status_code=400)
+        self.file_field = file_field
+        self.filename: str | None = None
+        self.mime_type: str | None = None
+        self.fields: dict[str, str] = {}
+        self._path: str | None = None
+        self._spool = None
+        self._digest = hashlib.sha256()
+        self._size = 0
+        # The part being received: the file, a text field's name, or None for parts we ignore.
+        self._part: str | None = None
+        self._value = bytearray()
+        self._headers: dict[bytes, bytes] = {}
+        self._header_field = bytearray()
+        self._header_value = bytearray()
+        self._parser = MultipartParser(options[b"boundary"], callbacks={
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": lambda data, start, end: self._header_field.extend(data[start:end]),
+            "on_header_value": lambda data, start, end: self._header_value.extend(data[start:end]),
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        })
+
+    def _on_part_begin(self):
+        self._headers = {}
+        self._part = None
+        self._value.clear()
+
+    def _on_header_end(self):
+        self._headers[bytes(self._header_field).lower()] = bytes(self._header_value)
+        self._header_field.clear()
+        self._header_value.clear()
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition"))
+        name = options.get(b"name", b"").decode("utf-8", "replace")
+        if b"filename" not in options:
+            self._part = name or None
+        elif name == self.file_field and self._path is None:
+            self.filename = options[b"filename"].decode("utf-8", "replace")
+            self.mime_type = self._headers.get(b"content-type", b"").decode("latin-1").strip() or None
+            os.makedirs(settings.job_spool_dir, exist_ok=True)
+            self._path = os.path.join(settings.job_spool_dir, f"{uuid.uuid4()}.part")
+            self._spool = open(self._path, "wb")
+            self._part = self.file_field
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        if self._part is None:
+            return
+        if self._part == self.file_field and self._spool is not None:
+            self._size += end - start
+            if self._size > settings.max_upload_bytes:
+                raise _too_large()
+            chunk = data[start:end]
+            self._digest.update(chunk)
+            self._spool.write(chunk)
+        else:
+            self._value.extend(data[start:end])
+            if len(self._value) > _MAX_FIELD_BYTES:
+                raise UploadRejected(f"The form field '{self._part}' is too large.")
+
+    def _on_part_end(self):
+        if self._part == self.file_field and self._spool is not None:
+            self._spool.close()
+            self._spool = None
+        elif self._part is not None:
+            self.fields[self._part] = self._value.decode("utf-8", "replace")
+        self._part = None
+
+    def feed(self, data: bytes):
+        self._parser.write(data)
+
+    def finish(self) -> Upload:
+        """The spooled file part, once the body has ended. Enforces the page limit."""
+        self._parser.finalize()
+        if self._path is None or self._spool is not None:
+            raise UploadRejected(f"The request has no complete '{self.file_field}' file.", status_code=422)
+        page_count = _check_pages(self._path, self.mime_type)
+        return Upload(self._path, self._size, self._digest.hexdigest(), page_count, owned=True)
+
+    def abort(self):
+        """Removes whatever was spooled; for a body that was refused or cut short."""
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+        if self._path is not None and os.path.exists(self._path):
+            os.remove(self._path)
+
+
+def _resolve_handoff_path(path: str) -> str:
+    if not settings.local_handoff_dir:
+        raise UploadRejected("Local upload handoff is not enabled.", status_code=403)
+    root = os.path.realpath(settings.local_handoff_dir)
+    resolved = os.path.realpath(path)
+    if os.path.commonpath([root, resolved]) != root:
+        raise UploadRejected("The path is outside the shared upload directory.", status_code=403)
+    if not os.path.isfile(resolved):
+        raise UploadRejected("The handed-off upload does not exist.", status_code=404)
+    return resolved
+
+
+def open_local_upload(path: str, mime_type: str) -> Upload:
+    """
+    Accepts a file the Node backend wrote under local_handoff_dir, in place.
+    Enforces the same limits as MultipartUpload. Blocking; call through run_io.
+    """
+    resolved = _resolve_handoff_path(path)
+    size = os.path.getsize(resolved)
+    if size > settings.max_upload_bytes:
+        raise _too_large()
+    page_count = _check_pages(resolved, mime_type)
+    return Upload(resolved, size, hash_file(resolved), page_count, owned=False)
+
+
+def hash_file(path: str) -> str:
+    """SHA-256 of a file, read in upload_chunk_bytes pieces. Matches result_cache.hash_content of its bytes."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(settings.upload_chunk_bytes):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_upload(path: str) -> bytes:
+    """The whole file, for the one request that needs it in memory (a document Document AI reads whole)."""
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def discard_upload(upload: Upload):
+    """Removes a spool file once processing is done; handed-off files are left alone."""
+    if upload.owned and os.path.exists(upload.path):
+        os.remove(upload.path)
@@ -1,50 +1,225 @@
-import faiss
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
 import numpy as np
-from sentence_transformers import SentenceTransformer
+
+from app.config import settings
+from app.core import ann_index, document_store
+from app.core.embeddings import QUERY_PRIORITY, embedding_service
+from app.core.lexical_index import store_lexical_index
 
 # --- In-memory Database ---
-faiss_index = None
-embedding_model = None
+# One FAISS index per document, kept in least-recently-used order so the
+# oldest documents are evicted first once the count or byte budget is hit.
+# Every index is also persisted to the document store; an evicted or
+# not-yet-seen document is memory-mapped back from disk on first query.
+# Indexes are built by app.core.ann_index and score by cosine similarity.
+#
+# A registered index is never modified in place: writers build or copy an
+# index, persist it and swap it in, so searches need no lock. The
+# per-document lock only serializes writers (and the first load from disk).
+faiss_indexes: "OrderedDict[str, faiss.Index]" = OrderedDict()
+
+_registry_lock = threading.Lock()
+
+
+class _DocumentLock:
+    """A per-document lock plus the number of threads holding or waiting for it."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.users = 0
+
+
+_document_locks: dict[str, _DocumentLock] = {}
+
 
 def initialize_embedding_model():
-    global embedding_model
-    if embedding_model is None:
-        print("Loading local embedding model (all-MiniLM-L6-v2)...")
-        embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-        print("Embedding model loaded.")
+    embedding_service.load_model()
+
+
+def warm_up_embedding_model():
+    """Loads FAISS and the embedding model and runs one encode, so the first request pays for neither."""
+    import faiss  # noqa: F401
+
+    embedding_service.warm_up()
+
+
+@contextmanager
+def _document_lock(document_id: str):
+    """
+    Holds the lock serializing writes to one document's index. The entry is
+    dropped once no thread holds or waits for it, so every thread working on
+    a document at the same time shares the same lock.
+    """
+    with _registry_lock:
+        entry = _document_locks.get(document_id)
+        if entry is None:
+            entry = _document_locks[document_id] = _DocumentLock()
+        entry.users += 1
+    try:
+        with entry.lock:
+            yield
+    finally:
+        with _registry_lock:
+            entry.users -= 1
+            if entry.users == 0:
+                del _document_locks[document_id]
+
+
+def _evict_if_needed():
+    """Drops least-recently-used indexes until the registry fits its budget. Caller holds the registry lock."""
+    total_bytes = sum(ann_index.index_size_bytes(index) for index in faiss_indexes.values())
+    # The most recently stored index is always kept, even if it alone exceeds the budget.
+    while len(faiss_indexes) > 1 and (
+        len(faiss_indexes) > settings.vector_store_max_documents
+        or total_bytes > settings.vector_store_max_bytes
+    ):
+        evicted_id, evicted_index = faiss_indexes.popitem(last=False)
+        total_bytes -= ann_index.index_size_bytes(evicted_index)
+        print(f"Evicted FAISS index for document ID {evicted_id} from memory.")
+
+
+def _get_index(document_id: str) -> "faiss.Index | None":
+    with _registry_lock:
+        index = faiss_indexes.get(document_id)
+        if index is not None:
+            faiss_indexes.move_to_end(document_id)
+            return index
+
+    with _document_lock(document_id):
+        # Another thread may have mapped it while we waited for the lock.
+        with _registry_lock:
+            index = faiss_indexes.get(document_id)
+        if index is None:
+            try:
+                index = document_store.load_index(document_id)
+            except ValueError:
+                return None
+            if index is None:
+                return None
+            print(f"Loaded FAISS index for document ID {document_id} from disk.")
 
-def embed_and_store_chunks(chunks: list[str]):
-    global faiss_index, embedding_model
+        _register_index(document_id, index)
+        return index
 
-    initialize_embedding_model()
+
+def embed_chunks(chunks: list[str]) -> np.ndarray:
+    """Encodes chunks with the embedding service. Returns a float32 array of shape (len(chunks), dim)."""
     print(f"Embedding {len(chunks)} chunks for FAISS index...")
-    embeddings = embedding_model.encode(chunks, show_progress_bar=True, convert_to_numpy=True)
-    
-    embeddings = np.array(embeddings).astype('float32')
+    return embedding_service.embed(chunks)
 
-    print("Building FAISS index...")
-    index = faiss.IndexFlatL2(embeddings.shape[1])
-    index.add(embeddings)
 
-    faiss_index = index
-    print("FAISS index built successfully and is now in memory.")
+def store_embeddings(document_id: str, embeddings: np.ndarray):
+    """Builds a document's FAISS index from precomputed embeddings, persists it, and registers it."""
+    print(f"Building FAISS index for document ID {document_id}...")
+    with _document_lock(document_id):
+        index = ann_index.build_index(embeddings)
+        document_store.save_index(document_id, index)
+        _register_index(document_id, index)
+    print("FAISS index built successfully and persisted to the document store.")
 
-def query_vector_store(query_text: str, num_neighbours: int = 25) -> list[int]:
-    global faiss_index, embedding_model
 
-    if faiss_index is None:
-        print("Error: FAISS index is not available. Please process a document first.")
-        return []
-    
-    initialize_embedding_model()
+def add_embeddings(document_id: str, embeddings: np.ndarray) -> int:
+    """
+    Appends embeddings to a document's existing index without rebuilding it.
+    New vectors continue the id sequence. Returns the index size afterwards.
+    """
+    with _document_lock(document_id):
+        # The registered index may be a read-only mapping; add to a private copy and swap it in.
+        index = document_store.load_index(document_id, writable=True)
+        if index is None:
+            raise KeyError(f"No index for document ID {document_id}")
+        ann_index.add_to_index(index, embeddings)
+        document_store.save_index(document_id, index)
+        _register_index(document_id, index)
+    return index.ntotal
+
+
+def _register_index(document_id: str, index: "faiss.Index"):
+    with _registry_lock:
+        faiss_indexes[document_id] = index
+        faiss_indexes.move_to_end(document_id)
+        _evict_if_needed()
+
+
+def embed_and_store_chunks(document_id: str, chunks: list[str]) -> np.ndarray:
+    """Embeds a document's chunks and stores them in its FAISS index and BM25 index. Returns the embeddings."""
+    embeddings = embed_chunks(chunks)
+    store_embeddings(document_id, embeddings)
+    store_lexical_index(document_id, chunks)
+    return embeddings
+
+
+def has_document(document_id: str) -> bool:
+    with _registry_lock:
+        if document_id in faiss_indexes:
+            return True
+    try:
+        return document_store.has_index(document_id)
+    except ValueError:
+        return False
+
+
+def remove_document(document_id: str):
+    """Removes a document's index from the in-memory registry, if present. The on-disk copy is kept."""
+    with _registry_lock:
+        faiss_indexes.pop(document_id, None)
+
+
+def embed_query(query_text: str) -> np.ndarray:
+    """Encodes a single query. Returns a float32 array of shape (1, dim)."""
     print(f"Embedding query for FAISS search: '{query_text}'")
-    query_embedding = embedding_model.encode([query_text], convert_to_numpy=True).astype('float32')
+    return embedding_service.embed([query_text], priority=QUERY_PRIORITY)
 
+
+def search_document(
+    document_id: str,
+    query_embedding: np.ndarray,
+    num_neighbours: int | None = None
+) -> list[tuple[int, float]]:
+    """
+    Returns (chunk index, cosine similarity) for the document's chunks nearest to the query, best first.
+    `num_neighbours` defaults to settings.vector_search_neighbours.
+    """
+    index = _get_index(document_id)
+    if index is None:
+        print(f"Error: FAISS index is not available for document ID {document_id}. Please process the document first.")
+        return []
+
+    num_neighbours = min(num_neighbours or settings.vector_search_neighbours, index.ntotal)
     print(f"Searching FAISS index for {num_neighbours} nearest neighbours...")
-    distances, indices = faiss_index.search(query_embedding, num_neighbours)
+    scores, indices = ann_index.search(index, query_embedding, num_neighbours)
+    similarities = ann_index.to_similarity(index, scores)
+    return [(i, s) for i, s in zip(indices[0].tolist(), similarities[0].tolist()) if i != -1]
 
 
-    if indices.size > 0:
-        return indices[0].tolist()
-    else:
-        return []
+def get_chunk_vectors(document_id: str, chunk_indices: list[int]) -> np.ndarray | None:
+    """
+    Returns the normalized stored embeddings of the given chunks, or None if the
+    index cannot reconstruct them (compressed IVF-PQ indexes).
+    """
+    index = _get_index(document_id)
+    if index is None or not chunk_indices:
+        return None
+    try:
+        vectors = index.reconstruct_batch(np.asarray(chunk_indices, dtype=np.int64))
+    except RuntimeError:
+        return None
+    return ann_index.normalize(vectors)
+
+
+def query_vector_store(
+    document_id: str,
+    query_text: str,
+    num_neighbours: int | None = None,
+    query_embedding: np.ndarray | None = None
+) -> list[int]:
+    """
+    Returns the indices of the document's chunks nearest to the query, best first.
+    Pass `query_embedding` (from embed_query) to skip re-encoding the query text.
+    """
+    if query_embedding is None:
+        query_embedding = embed_query(query_text)
+    return [i for i, _ in search_document(document_id, query_embedding, num_neighbours)]
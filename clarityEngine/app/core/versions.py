@@ -0,0 +1,211 @@
+import hashlib
+import time
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from app.core import document_store
+from app.core.segmentation import title_key
+from app.cache import document_chunk_cache
+
+# --- Document Versions ---
+# An amended contract is uploaded with the ID of the version it replaces
+# (previous_document_id). It is processed as a new document with its own ID,
+# so the earlier version, and answers cached for it, stay valid. The pipeline
+# compares the new version with the old one and reuses what did not change:
+#   - everything, if the extracted text is the same (e.g. a re-scan),
+#   - the summary of each section whose text is unchanged,
+#   - the embedding of each chunk whose text is unchanged, read back from the
+#     previous version's index,
+#   - in "local+llm" chunking, Gemini's refinement of each unchanged window.
+# The comparison runs on hashes kept in each document's version record
+# (document_store.save_version), so the old text does not need to be re-read.
+
+
+def text_hash(text: str) -> str:
+    """Hash of the text with whitespace normalized, so re-flowed lines compare equal."""
+    return hashlib.sha256(" ".join(text.split()).encode("utf-8")).hexdigest()[:32]
+
+
+def hash_texts(texts: list[str]) -> list[str]:
+    return [text_hash(text) for text in texts]
+
+
+@dataclass
+class PreviousVersion:
+    document_id: str
+    number: int
+    text_hash: str | None
+    summary: str | None
+    # [{"title", "text_hash", "summary"}] in document order.
+    sections: list[dict]
+    chunks: list[str]
+    chunk_hashes: list[str]
+    # Hash of a local chunk window ("local+llm" chunking) -> the chunks Gemini refined it into.
+    refined_windows: dict[str, list[str]] = field(default_factory=dict)
+
+
+@dataclass
+class SectionChanges:
+    unchanged: int = 0
+    changed: int = 0
+    added: int = 0
+    removed: int = 0
+
+
+@dataclass
+class ChunkChanges:
+    # Position of each new chunk -> position of the identical chunk in the previous version.
+    reused: dict[int, int]
+    unchanged: int
+    added: int
+    removed: int
+
+
+def load_previous_version(document_id: str) -> PreviousVersion | None:
+    """The stored state of a processed document, or None if it is unknown. Blocking; call through run_io."""
+    chunks = document_chunk_cache.get(document_id)
+    if chunks is None:
+        return None
+    record = document_store.load_version(document_id) or {}
+    refined_windows, position = {}, 0
+    for window_hash, count in record.get("refined_windows", []):
+        if window_hash is not None:
+            refined_windows[window_hash] = chunks[position:position + count]
+        position += count
+    return PreviousVersion(
+        document_id=document_id,
+        number=record.get("version", 1),
+        text_hash=record.get("text_hash"),
+        summary=record.get("summary"),
+        sections=record.get("sections", []),
+        chunks=chunks,
+        chunk_hashes=record.get("chunk_hashes") or [text_hash(chunk) for chunk in chunks],
+        refined_windows=refined_windows
+    )
+
+
+def diff_sections(previous: PreviousVersion | None, sections: list[tuple[str, str]]) -> SectionChanges:
+    """Compares (title, text hash) pairs with the previous version's sections."""
+    changes = SectionChanges()
+    if previous is None:
+        changes.added = len(sections)
+        return changes
+    old_hashes = {s["text_hash"] for s in previous.sections}
+    old_titles = {title_key(s["title"]) for s in previous.sections}
+    for title, hash_value in sections:
+        if hash_value in old_hashes:
+            changes.unchanged += 1
+        elif title_key(title) in old_titles:
+            changes.changed += 1
+        else:
+            changes.added += 1
+    new_hashes = {hash_value for _, hash_value in sections}
+    new_titles = {title_key(title) for title, _ in sections}
+    changes.removed = sum(
+        1 for s in previous.sections
+        if s["text_hash"] not in new_hashes and title_key(s["title"]) not in new_titles
+    )
+    return changes
+
+
+def diff_chunks(previous_hashes: list[str], chunk_hashes: list[str]) -> ChunkChanges:
+    """
+    Matches chunks by content. A chunk counts as unchanged wherever it moved to;
+    its embedding does not depend on its position.
+    """
+    old_positions: dict[str, int] = {}
+    for position, hash_value in enumerate(previous_hashes):
+        old_positions.setdefault(hash_value, position)
+    reused = {
+        position: old_positions[hash_value]
+        for position, hash_value in enumerate(chunk_hashes)
+        if hash_value in old_positions
+    }
+    new_hashes = set(chunk_hashes)
+    return ChunkChanges(
+        reused=reused,
+        unchanged=len(reused),
+        added=len(chunk_hashes) - len(reused),
+        removed=sum(1 for hash_value in previous_hashes if hash_value not in new_hashes)
+    )
+
+
+def assemble_embeddings(
+    chunk_count: int,
+    reused: dict[int, int],
+    previous_vectors: np.ndarray,
+    new_vectors: np.ndarray
+) -> np.ndarray:
+    """
+    Embeddings in chunk order. previous_vectors holds the reused chunks' vectors
+    and new_vectors the others', each ordered by the chunk's new position.
+    """
+    dimension = previous_vectors.shape[1] if len(previous_vectors) else new_vectors.shape[1]
+    embeddings = np.empty((chunk_count, dimension), dtype=np.float32)
+    reused_positions = sorted(reused)
+    if reused_positions:
+        embeddings[reused_positions] = previous_vectors
+    fresh_positions = [position for position in range(chunk_count) if position not in reused]
+    if fresh_positions:
+        embeddings[fresh_positions] = new_vectors
+    return embeddings
+
+
+def save_version_record(
+    document_id: str,
+    previous: PreviousVersion | None,
+    filename: str | None,
+    document_text_hash: str,
+    summary: str,
+    sections: list[dict],
+    chunk_hashes: list[str],
+    refined_windows: list[tuple[str | None, int]]
+):
+    """
+    Writes the version record for a processed document. Blocking; call through run_io.
+
+    refined_windows lists, in chunk order, (local window hash, number of chunks)
+    for each "local+llm" window; the hash is None where Gemini's refinement failed.
+    """
+    document_store.save_version(document_id, {
+        "document_id": document_id,
+        "version": previous.number + 1 if previous else 1,
+        "previous_document_id": previous.document_id if previous else None,
+        "filename": filename,
+        "created_at": time.time(),
+        "text_hash": document_text_hash,
+        "summary": summary,
+        "sections": sections,
+        "chunk_hashes": chunk_hashes,
+        "refined_windows": refined_windows
+    })
+
+
+def link_to_previous_version(document_id: str, previous: PreviousVersion) -> bool:
+    """
+    Records an already processed document as the next version of `previous`, for an
+    amendment whose exact bytes were processed before (a result-cache hit). Only a
+    document without a predecessor of its own is linked, and never one `previous`
+    descends from, which would make a cycle. Returns whether it was linked.
+    Blocking; call through run_io.
+    """
+    record = document_store.load_version(document_id)
+    if record is None or record.get("previous_document_id") or document_id == previous.document_id:
+        return False
+    ancestor = previous.document_id
+    while ancestor is not None:
+        if ancestor == document_id:
+            return False
+        ancestor = (document_store.load_version(ancestor) or {}).get("previous_document_id")
+    record.update(version=previous.number + 1, previous_document_id=previous.document_id)
+    document_store.save_version(document_id, record)
+    return True
+
+
+def version_info(document_id: str) -> dict | None:
+    """Version number and predecessor of a processed document, if recorded. Blocking; call through run_io."""
+    record = document_store.load_version(document_id)
+    if record is None:
+        return None
+    return {"number": record["version"], "previous_document_id": record["previous_document_id"]}
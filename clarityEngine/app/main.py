@@ -1,14 +1,38 @@
-from fastapi import FastAPI
+import re
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 from .api.endpoints  import router as api_router
+from .config import settings
+from .core.admission import admission, Overloaded
+from .core.concurrency import shutdown_executors
+from .core.corpus import corpus_index
+from .core.jobs import job_queue
+from .core.resources import start_resources, stop_resources, is_ready, readiness
+from .core.metrics import trace_id_var, new_trace_id, http_request_duration, render_prometheus
 
 load_dotenv()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await start_resources()
+    admission.start()
+    await corpus_index.start(settings.corpus_save_interval_seconds)
+    await job_queue.start()
+    yield
+    await job_queue.stop()
+    await corpus_index.stop()
+    await stop_resources()
+    shutdown_executors()
+
 app = FastAPI(
     title="Clarity Engine API",
     description="An AI solution to demistify complex legal documents.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 origins = [
@@ -27,8 +51,77 @@ app.add_middleware(
     allow_headers=["*"], # Allows all headers
 )
 
+# Room for the multipart boundaries and form fields around the file itself.
+_MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    """Refuses an upload whose declared length is over max_upload_bytes before its body is read."""
+    length = request.headers.get("content-length", "")
+    if length.isdigit() and int(length) > settings.max_upload_bytes + _MULTIPART_OVERHEAD_BYTES:
+        return JSONResponse(
+            {"detail": f"The upload exceeds the {settings.max_upload_bytes // (1024 * 1024)} MB limit."},
+            status_code=413
+        )
+    return await call_next(request)
+
+_TRACEPARENT = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-[0-9a-f]{16}-[0-9a-f]{2}$")
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """
+    Tags each request with a trace ID (from the Node proxy's X-Request-ID or a W3C
+    traceparent header, else a new one), echoes it back, and records request latency.
+    """
+    traceparent = _TRACEPARENT.match(request.headers.get("traceparent", ""))
+    trace_id = request.headers.get("x-request-id") or (traceparent.group(1) if traceparent else new_trace_id())
+    token = trace_id_var.set(trace_id)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        response.headers["X-Request-ID"] = trace_id
+        return response
+    finally:
+        route = request.scope.get("route")
+        http_request_duration.observe(
+            time.perf_counter() - start,
+            method=request.method,
+            route=route.path if route is not None else "unmatched",
+            status=status
+        )
+        trace_id_var.reset(token)
+
 app.include_router(api_router, prefix="/api")
 
+@app.exception_handler(Overloaded)
+async def overloaded(request: Request, exc: Overloaded):
+    """Admission control turned the request away: 503, with when to try again."""
+    return JSONResponse(
+        {"detail": str(exc)},
+        status_code=503,
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+@app.get("/metrics", tags=["Health Check"], response_class=PlainTextResponse)
+def metrics():
+    """Prometheus metrics: request latency, per-stage spans, Gemini calls and cache hit rates."""
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/ready", tags=["Health Check"])
+def ready():
+    """Readiness probe: 200 once the embedding model and clients are warm, 503 until then."""
+    return JSONResponse(readiness(), status_code=200 if is_ready() else 503)
+
+
+@app.get("/admission", tags=["Health Check"])
+def admission_stats():
+    """Running and waiting work per admission class."""
+    return admission.stats()
+
+
 @app.get("/", tags=["Health Check"])
 def read_root():
     return {"status": "ok", "message":"Welcome to the Clarity Engine!"}
\ No newline at end of file
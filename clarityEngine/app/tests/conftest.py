@@ -0,0 +1,82 @@
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+import pytest
+
+from benchmarks.fake_gemini import FakeGeminiServer
+
+# Settings are read when app.config is first imported: point every on-disk
+# store at a scratch directory, Gemini at a local fake server and fill in the
+# required cloud settings first.
+_FAKE_GEMINI = FakeGeminiServer().start()
+_DATA_DIR = tempfile.mkdtemp(prefix="clarity-tests-")
+for _name, _value in (
+    ("GOOGLE_CLOUD_PROJECT", "tests"),
+    ("GOOGLE_CLOUD_LOCATION", "us"),
+    ("DOCAI_PROCESSOR_ID", "tests"),
+    ("GEMINI_API_KEY", "tests"),
+    ("GEMINI_API_ENDPOINT", _FAKE_GEMINI.endpoint),
+    ("DOCUMENT_STORE_DIR", os.path.join(_DATA_DIR, "documents")),
+    ("RESULT_CACHE_DIR", os.path.join(_DATA_DIR, "results")),
+    ("CORPUS_DIR", os.path.join(_DATA_DIR, "corpus")),
+    ("JOB_STORE_PATH", os.path.join(_DATA_DIR, "jobs.sqlite3")),
+    ("JOB_SPOOL_DIR", os.path.join(_DATA_DIR, "uploads")),
+    ("PRELOAD_MODELS", "false"),
+):
+    os.environ[_name] = _value
+
+
+class HashingEmbeddingModel:
+    """Stands in for the SentenceTransformer: a bag of hashed words, normalized. Counts encoded texts."""
+
+    dimension = 64
+
+    def __init__(self):
+        self.encoded: list[str] = []
+
+    def encode(self, texts, batch_size=32, convert_to_numpy=True, show_progress_bar=False):
+        self.encoded.extend(texts)
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                vectors[row, int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16) % self.dimension] += 1
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms > 0, norms, 1)
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+
+
+@pytest.fixture
+def embedding_model():
+    """Installs a HashingEmbeddingModel in the shared embedding service for one test."""
+    from app.core.embeddings import embedding_service
+
+    model = HashingEmbeddingModel()
+    previous = embedding_service.model
+    embedding_service.model = model
+    yield model
+    embedding_service.model = previous
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """Moves the document store, result cache and spool into a directory of their own for one test."""
+    from app.config import settings
+
+    monkeypatch.setattr(settings, "document_store_dir", str(tmp_path / "documents"))
+    monkeypatch.setattr(settings, "result_cache_dir", str(tmp_path / "results"))
+    monkeypatch.setattr(settings, "job_spool_dir", str(tmp_path / "uploads"))
+    return tmp_path
+
+
+@pytest.fixture
+def fake_gemini(monkeypatch):
+    """The local fake Gemini server, with its counts reset and no client-side rate limit."""
+    from app.config import settings
+
+    monkeypatch.setattr(settings, "llm_requests_per_minute", {})
+    _FAKE_GEMINI.stats.reset()
+    return _FAKE_GEMINI
@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+
+from app.config import settings
+from app.core.admission import BULK, INTERACTIVE, PRIORITIES, AdmissionController, Overloaded, current_priority
+
+
+def test_work_is_admitted_before_start():
+    # The benchmark and tests drive the app without its lifespan, so start() may never run.
+    controller = AdmissionController()
+
+    async def scenario():
+        async with controller.admit(INTERACTIVE):
+            assert current_priority() == PRIORITIES[INTERACTIVE]
+            assert controller.stats()[INTERACTIVE]["running"] == 1
+        return controller.stats()[INTERACTIVE]["running"]
+
+    assert asyncio.run(scenario()) == 0
+
+
+def test_a_full_queue_is_turned_away_and_tickets_release_once(monkeypatch):
+    monkeypatch.setattr(settings, "admission_max_concurrent", {BULK: 1})
+    monkeypatch.setattr(settings, "admission_max_queued", {BULK: 1})
+    controller = AdmissionController()
+
+    async def scenario():
+        running = await controller.acquire(BULK)
+        waiting = asyncio.create_task(controller.acquire(BULK))
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded) as rejected:
+            await controller.acquire(BULK)
+        assert rejected.value.retry_after >= 1
+
+        controller.release(running)
+        controller.release(running)
+        second = await waiting
+        assert controller.stats()[BULK]["running"] == 1
+        controller.release(second)
+        return controller.stats()[BULK]
+
+    stats = asyncio.run(scenario())
+    assert (stats["running"], stats["waiting"]) == (0, 0)
+
+
+def test_start_rebuilds_the_classes_from_the_settings(monkeypatch):
+    controller = AdmissionController()
+    monkeypatch.setattr(settings, "admission_max_concurrent", {INTERACTIVE: 7})
+    controller.start()
+    assert controller.stats()[INTERACTIVE]["max_concurrent"] == 7
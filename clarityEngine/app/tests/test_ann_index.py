@@ -0,0 +1,84 @@
+import faiss
+import numpy as np
+import pytest
+
+from app.config import settings
+from app.core import ann_index
+from app.core.ann_index import INDEX_FLAT, INDEX_HNSW, INDEX_IVFPQ
+
+
+def _vectors(count: int, dim: int = 16, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal((count, dim)).astype(np.float32)
+
+
+def test_index_type_follows_the_number_of_vectors(monkeypatch):
+    monkeypatch.setattr(settings, "vector_index_type", "auto")
+    monkeypatch.setattr(settings, "vector_index_flat_max", 100)
+    monkeypatch.setattr(settings, "vector_index_hnsw_max", 1000)
+
+    assert ann_index.choose_index_type(100) == INDEX_FLAT
+    assert ann_index.choose_index_type(101) == INDEX_HNSW
+    assert ann_index.choose_index_type(1000) == INDEX_HNSW
+    assert ann_index.choose_index_type(1001) == INDEX_IVFPQ
+
+    monkeypatch.setattr(settings, "vector_index_type", INDEX_HNSW)
+    assert ann_index.choose_index_type(10) == INDEX_HNSW
+
+
+def test_each_index_type_finds_a_vector_by_cosine_similarity(monkeypatch):
+    monkeypatch.setattr(settings, "ivfpq_bits", 4)
+    monkeypatch.setattr(settings, "ivfpq_subquantizers", 4)
+    monkeypatch.setattr(settings, "ivf_nprobe", 64)
+    vectors = _vectors(16 * 39)
+
+    for index_type in (INDEX_FLAT, INDEX_HNSW, INDEX_IVFPQ):
+        index = ann_index.build_index(vectors, index_type)
+        assert ann_index.index_type_of(index) == index_type and index.ntotal == len(vectors)
+        # Scaling the query does not change cosine similarity.
+        scores, ids = ann_index.search(index, vectors[7:8] * 3, k=1)
+        assert ids[0, 0] == 7
+        if index_type != INDEX_IVFPQ:
+            assert scores[0, 0] == pytest.approx(1.0, abs=1e-5)
+
+
+def test_ivfpq_falls_back_to_hnsw_without_enough_training_vectors(monkeypatch):
+    monkeypatch.setattr(settings, "ivfpq_bits", 4)
+    monkeypatch.setattr(settings, "ivfpq_subquantizers", 4)
+
+    index = ann_index.build_index(_vectors(16 * 39 - 1), INDEX_IVFPQ)
+    assert ann_index.index_type_of(index) == INDEX_HNSW
+    # Dimensions the subquantizers do not divide cannot be product-quantized either.
+    assert ann_index.index_type_of(ann_index.build_index(_vectors(16 * 39, dim=18), INDEX_IVFPQ)) == INDEX_HNSW
+
+    with pytest.raises(ValueError):
+        ann_index.build_index(_vectors(4), "annoy")
+
+
+def test_added_vectors_get_the_next_ids():
+    index = ann_index.build_index(_vectors(10), INDEX_HNSW)
+    ann_index.add_to_index(index, _vectors(5, seed=1))
+
+    _, ids = ann_index.search(index, _vectors(5, seed=1)[3:4], k=1)
+    assert index.ntotal == 15 and ids[0, 0] == 13
+
+
+def test_to_similarity_maps_every_metric_to_cosine():
+    vectors = ann_index.normalize(_vectors(3))
+    query = vectors[:1]
+    cosine = vectors @ query[0]
+
+    inner_product = ann_index.build_index(vectors, INDEX_FLAT)
+    scores, ids = ann_index.search(inner_product, query, k=3)
+    np.testing.assert_allclose(ann_index.to_similarity(inner_product, scores)[0], cosine[ids[0]], atol=1e-5)
+
+    # Indexes saved before the switch to cosine hold unit vectors under L2 distance.
+    legacy = faiss.IndexFlatL2(vectors.shape[1])
+    legacy.add(vectors)
+    distances, ids = ann_index.search(legacy, query, k=3)
+    np.testing.assert_allclose(ann_index.to_similarity(legacy, distances)[0], cosine[ids[0]], atol=1e-5)
+
+
+def test_searching_an_empty_index_returns_no_results():
+    index = faiss.IndexFlatIP(16)
+    scores, ids = ann_index.search(index, _vectors(2), k=5)
+    assert scores.shape == ids.shape == (2, 0)
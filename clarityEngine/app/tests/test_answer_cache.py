@@ -0,0 +1,49 @@
+import numpy as np
+
+from app.core.answer_cache import SemanticAnswerCache
+
+
+def _answer_cache(**overrides) -> SemanticAnswerCache:
+    options = dict(similarity_threshold=0.9, ttl_seconds=60, max_entries_per_document=2, max_documents=2)
+    options.update(overrides)
+    return SemanticAnswerCache(**options)
+
+
+def test_answer_cache_matches_similar_questions_per_document():
+    cache = _answer_cache()
+    cache.store("doc", "When does the lease end?", np.array([[1.0, 0.0]]), "January 31", ["2.1 ..."])
+
+    hit = cache.lookup("doc", np.array([[0.99, 0.05]]))
+    assert hit is not None and hit.answer == "January 31" and hit.context == ["2.1 ..."]
+    assert cache.lookup("doc", np.array([[0.0, 1.0]])) is None
+    assert cache.lookup("other", np.array([[1.0, 0.0]])) is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 2
+
+
+def test_answer_cache_expires_and_evicts_least_recently_used(monkeypatch):
+    cache = _answer_cache()
+    for i in range(3):
+        cache.store("doc", f"question {i}", np.eye(3)[i:i + 1], f"answer {i}", [])
+    # Two entries per document: the oldest is gone.
+    assert cache.lookup("doc", np.eye(3)[0:1]) is None
+    assert cache.lookup("doc", np.eye(3)[2:3]).answer == "answer 2"
+
+    for document_id in ("b", "c"):
+        cache.store(document_id, "q", np.eye(3)[0:1], "a", [])
+    assert cache.stats()["documents"] == 2
+
+    monkeypatch.setattr(cache, "ttl_seconds", -1)
+    assert cache.lookup("c", np.eye(3)[0:1]) is None
+
+
+def test_exact_answers_are_keyed_by_the_question_and_its_chunks():
+    cache = _answer_cache()
+    cache.store("doc", "What does Section 3.1 say?", None, "Rent is $1,850.", ["3.1 ..."], chunk_indices=[0])
+
+    hit = cache.lookup_exact("doc", "  what does section 3.1   say? ", [0])
+    assert hit is not None and hit.answer == "Rent is $1,850."
+    # The same question now resolving to other chunks (an amended document) is a miss.
+    assert cache.lookup_exact("doc", "What does Section 3.1 say?", [0, 4]) is None
+    # Answers without an embedding never match by similarity.
+    assert cache.lookup("doc", np.array([[1.0, 0.0]])) is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 2
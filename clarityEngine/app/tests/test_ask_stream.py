@@ -0,0 +1,129 @@
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+
+from app.config import settings
+from app.core import clarity_engine, lexical_index, llm_client
+from app.core.answer_cache import answer_cache
+from app.core.lexical_index import store_lexical_index
+
+CHUNKS = [
+    "3.1 Monthly Rent. The Tenant shall pay monthly rent of $1,850.00, due on the first day of each month.",
+    "3.2 Late Charge. Rent received after the fifth day of the month incurs a late charge of $75.00.",
+]
+# Exact references settle the context without an embedding model.
+QUESTION = "What does Section 3.1 say?"
+
+
+@pytest.fixture
+def document(data_dir, fake_gemini, monkeypatch):
+    from app.api import endpoints
+
+    lexical_index._indexes.clear()
+    store_lexical_index("lease", CHUNKS)
+    answer_cache.invalidate("lease")
+    monkeypatch.setattr(endpoints, "has_document", lambda document_id: True)
+    monkeypatch.setattr(endpoints.document_chunk_cache, "get", lambda document_id, default=None: CHUNKS)
+    yield "lease"
+    answer_cache.invalidate("lease")
+    lexical_index._indexes.clear()
+
+
+def _events(body: str) -> list[tuple[str, dict]]:
+    events = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+async def _post(path: str, document_id: str) -> httpx.Response:
+    from app.main import app
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://tests") as http:
+        return await http.post(path, json={"question": QUESTION, "document_id": document_id})
+
+
+def test_events_are_context_then_tokens_then_done(document, fake_gemini):
+    events = _events(asyncio.run(_post("/api/ask/stream", document)).text)
+
+    kinds = [kind for kind, _ in events]
+    assert kinds[0] == "context" and kinds[-1] == "done" and set(kinds[1:-1]) == {"token"}
+    assert events[0][1] == {"retrieved_context": [CHUNKS[0]], "cached": False}
+    answer = "".join(data["text"] for kind, data in events if kind == "token").strip()
+    assert events[-1][1] == {"answer": answer, "cached": False} and answer
+    assert fake_gemini.stats.snapshot()["answer"]["requests"] == 1
+
+
+def test_a_stream_that_fails_midway_ends_with_an_error_and_is_not_cached(document, monkeypatch):
+    from app.api import endpoints
+
+    def failing_stream(context, question):
+        yield "The rent is"
+        raise RuntimeError("connection reset")
+
+    monkeypatch.setattr(endpoints, "stream_answer_from_gemini", failing_stream)
+    events = _events(asyncio.run(_post("/api/ask/stream", document)).text)
+
+    assert [kind for kind, _ in events] == ["context", "token", "error"]
+    assert events[-1][1] == {"message": clarity_engine.ANSWER_ERROR_MESSAGE}
+    assert answer_cache.lookup_exact(document, QUESTION, [0]) is None
+
+
+def test_an_empty_stream_is_not_cached(document, monkeypatch):
+    from app.api import endpoints
+
+    monkeypatch.setattr(endpoints, "stream_answer_from_gemini", lambda context, question: iter(()))
+    events = _events(asyncio.run(_post("/api/ask/stream", document)).text)
+
+    assert events[-1] == ("done", {"answer": "", "cached": False})
+    assert answer_cache.lookup_exact(document, QUESTION, [0]) is None
+
+
+def test_a_cached_answer_is_streamed_as_one_token(document, fake_gemini):
+    answered = asyncio.run(_post("/api/ask", document)).json()
+    events = _events(asyncio.run(_post("/api/ask/stream", document)).text)
+
+    assert events == [
+        ("context", {"retrieved_context": [CHUNKS[0]], "cached": True}),
+        ("token", {"text": answered["answer"]}),
+        ("done", {"answer": answered["answer"], "cached": True}),
+    ]
+    assert fake_gemini.stats.snapshot()["answer"]["requests"] == 1
+
+
+class _Chunk:
+    def __init__(self, text: str, delay: float = 0.0):
+        self.delay = delay
+        self._text = text
+
+    @property
+    def text(self) -> str:
+        time.sleep(self.delay)
+        return self._text
+
+
+def test_streams_run_on_the_answer_model_and_time_the_first_text(monkeypatch):
+    monkeypatch.setattr(settings, "llm_task_models", {"answer": "gemini-answer-model"})
+    opened, observed = [], []
+
+    class Model:
+        def generate_content(self, prompt, stream=False):
+            # A first chunk without text (e.g. safety metadata) does not count as the first token.
+            return [_Chunk("", delay=0.05), _Chunk("The rent"), _Chunk(" is $1,850.")]
+
+    monkeypatch.setattr(llm_client, "get_generative_model", lambda name, *args: opened.append(name) or Model())
+    monkeypatch.setattr(
+        clarity_engine.llm_time_to_first_token, "observe",
+        lambda seconds, **labels: observed.append((seconds, labels))
+    )
+
+    fragments = list(clarity_engine.stream_answer_from_gemini(CHUNKS, QUESTION))
+
+    assert fragments == ["The rent", " is $1,850."]
+    assert opened == ["gemini-answer-model"]
+    assert len(observed) == 1 and observed[0][0] >= 0.05
+    assert observed[0][1] == {"task": "answer_stream", "model": "gemini-answer-model"}
@@ -0,0 +1,131 @@
+import asyncio
+import itertools
+import threading
+import time
+
+import pytest
+
+from app.config import settings
+from app.core.concurrency import gather_bounded, run_cpu, run_io, run_llm_call, stream_io
+from app.core.metrics import current_trace_id, trace_id_var
+
+
+def test_gather_bounded_runs_at_most_limit_at_once_and_keeps_input_order():
+    running, peak = 0, 0
+
+    async def work(number: int) -> int:
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        # Later inputs finish first; results still come back in input order.
+        await asyncio.sleep(0.001 * (10 - number))
+        running -= 1
+        return number * number
+
+    results = asyncio.run(gather_bounded((work(n) for n in range(10)), limit=3))
+
+    assert results == [n * n for n in range(10)]
+    assert peak == 3
+    assert asyncio.run(gather_bounded([], limit=3)) == []
+    # A limit below one still makes progress, one at a time.
+    peak = 0
+    asyncio.run(gather_bounded((work(n) for n in range(3)), limit=0))
+    assert peak == 1
+
+
+def test_one_failure_cancels_the_others():
+    started, cancelled, finished = [], [], []
+
+    async def work(number: int):
+        started.append(number)
+        try:
+            if number == 1:
+                await asyncio.sleep(0.01)
+                raise ValueError("section 1 failed")
+            await asyncio.sleep(10)
+            finished.append(number)
+        except asyncio.CancelledError:
+            cancelled.append(number)
+            raise
+
+    async def scenario():
+        with pytest.raises(ValueError, match="section 1 failed"):
+            await gather_bounded((work(n) for n in range(6)), limit=3)
+        # Nothing is left running once the error has propagated.
+        return [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+
+    assert asyncio.run(scenario()) == []
+    # Every sibling that had started was cancelled; the rest never started.
+    assert started[:3] == [0, 1, 2] and len(started) < 6
+    assert sorted(cancelled) == [n for n in started if n != 1] and finished == []
+
+
+def test_blocking_calls_run_on_their_pools():
+    async def scenario():
+        return await run_io(threading.current_thread), await run_cpu(threading.current_thread)
+
+    io_thread, cpu_thread = asyncio.run(scenario())
+    assert io_thread.name.startswith("clarity-io") and cpu_thread.name.startswith("clarity-cpu")
+
+
+def test_llm_calls_that_time_out_yield_the_fallback(monkeypatch):
+    monkeypatch.setattr(settings, "llm_call_timeout_seconds", 0.01)
+
+    def slow_call(prompt: str) -> str:
+        time.sleep(0.2)
+        return "answer"
+
+    assert asyncio.run(run_llm_call(slow_call, "prompt", fallback="placeholder")) == "placeholder"
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(run_io(slow_call, "prompt", timeout=0.01))
+
+
+def test_stream_io_yields_the_workers_items_in_order_with_its_context():
+    def fragments(count: int):
+        for number in range(count):
+            yield f"{current_trace_id()}:{number}"
+
+    async def scenario():
+        trace_id_var.set("request-7")
+        return [fragment async for fragment in stream_io(fragments, 3)]
+
+    assert asyncio.run(scenario()) == ["request-7:0", "request-7:1", "request-7:2"]
+
+
+def test_stream_io_raises_the_worker_threads_error_after_its_items():
+    def failing():
+        yield "first fragment"
+        raise RuntimeError("stream broke")
+
+    async def scenario():
+        received = []
+        with pytest.raises(RuntimeError, match="stream broke"):
+            async for fragment in stream_io(failing):
+                received.append(fragment)
+        return received
+
+    assert asyncio.run(scenario()) == ["first fragment"]
+
+
+def test_stream_io_stops_the_worker_when_the_consumer_leaves_early():
+    produced, closed = [], threading.Event()
+
+    def endless():
+        try:
+            for number in itertools.count():
+                produced.append(number)
+                yield number
+                time.sleep(0.001)
+        finally:
+            closed.set()
+
+    async def scenario():
+        stream = stream_io(endless)
+        async for number in stream:
+            if number == 2:
+                break
+        await stream.aclose()
+
+    asyncio.run(scenario())
+    assert closed.wait(1)
+    assert len(produced) < 10
@@ -0,0 +1,148 @@
+import os
+import threading
+
+import faiss
+import numpy as np
+import pytest
+
+from app.config import settings
+from app.core import ann_index, document_store
+from app.core.corpus import INDEX_FILENAME, CorpusIndex, extract_document_type
+
+
+def _vectors(count: int, seed: int, dim: int = 16) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal((count, dim)).astype(np.float32)
+
+
+def _add(corpus: CorpusIndex, document_id: str, vectors: np.ndarray, **kwargs):
+    # The pipeline saves a document's own index before adding it to the corpus;
+    # other processes read its vectors from there.
+    document_store.save_index(document_id, ann_index.build_index(vectors))
+    corpus.add_document(document_id, f"{document_id}.pdf", "**Document Type:** Lease", vectors, **kwargs)
+
+
+@pytest.fixture
+def corpus_dir(data_dir, tmp_path):
+    return str(tmp_path / "corpus")
+
+
+def test_document_type_is_read_from_the_summary():
+    assert extract_document_type("**Document Type:** Residential Lease Agreement\n...") == "Residential Lease Agreement"
+    assert extract_document_type("# Employment Contract\nThe parties...") == "Employment Contract"
+    assert extract_document_type("") is None
+
+
+def test_processes_sharing_a_corpus_get_disjoint_ranges_and_see_each_others_documents(corpus_dir):
+    first, second = CorpusIndex(corpus_dir), CorpusIndex(corpus_dir)
+    a, b, c = _vectors(5, 1), _vectors(3, 2), _vectors(4, 3)
+    _add(first, "a", a)
+    _add(second, "b", b)
+    _add(first, "c", c)
+
+    ranges = {d.document_id: (d.first_vector, d.vector_count) for d in second.documents()}
+    assert ranges == {"a": (0, 5), "b": (5, 3), "c": (8, 4)}
+    for corpus in (first, second):
+        assert corpus.vector_count == 12
+        hit = corpus.search(b[1:2], k=1)[0]
+        assert (hit.document_id, hit.chunk_index) == ("b", 1)
+        hit = corpus.search(c[3:4], k=1)[0]
+        assert (hit.document_id, hit.chunk_index) == ("c", 3)
+
+
+def test_a_document_is_added_once_and_superseded_versions_are_filtered(corpus_dir):
+    first, second = CorpusIndex(corpus_dir), CorpusIndex(corpus_dir)
+    old, new = _vectors(3, 1), _vectors(3, 2)
+    _add(first, "v1", old)
+    _add(second, "v1", old)
+    _add(second, "v2", new, supersedes="v1")
+
+    assert {hit.document_id for hit in first.search(old[0:1], k=6)} == {"v2"}
+    assert first.vector_count == 6
+    assert first.search(old[0:1], k=1, document_ids=["v1"])[0].document_id == "v1"
+
+
+def test_saved_index_is_reloaded_and_never_replaced_by_a_shorter_one(corpus_dir):
+    first, second = CorpusIndex(corpus_dir), CorpusIndex(corpus_dir)
+    _add(first, "a", _vectors(5, 1))
+    second.load()
+    _add(first, "b", _vectors(3, 2))
+    first.save()
+
+    # The second process has not synced yet; saving must not drop "b" from the file.
+    second._dirty = True
+    second.save()
+    reloaded = CorpusIndex(corpus_dir)
+    reloaded.load()
+    assert reloaded.vector_count == 8 and len(reloaded.documents()) == 2
+
+    # Vectors cataloged after the last save come back from the per-document indexes.
+    _add(first, "c", _vectors(2, 3))
+    restarted = CorpusIndex(corpus_dir)
+    restarted.load()
+    assert restarted.vector_count == 10
+
+
+def test_a_failed_save_is_retried_on_the_next_one(corpus_dir, monkeypatch):
+    corpus = CorpusIndex(corpus_dir)
+    _add(corpus, "a", _vectors(5, 1))
+
+    def fail(path, write):
+        raise OSError("disk full")
+
+    original_write = document_store.atomic_write
+    monkeypatch.setattr(document_store, "atomic_write", fail)
+    with pytest.raises(OSError):
+        corpus.save()
+    monkeypatch.setattr(document_store, "atomic_write", original_write)
+    corpus.save()
+
+    assert faiss.read_index(os.path.join(corpus_dir, INDEX_FILENAME)).ntotal == 5
+    assert not corpus._dirty
+
+
+def test_documents_with_a_compressed_index_are_restored_approximately(corpus_dir, monkeypatch):
+    monkeypatch.setattr(settings, "ivfpq_bits", 4)
+    monkeypatch.setattr(settings, "ivfpq_subquantizers", 4)
+    vectors = _vectors(16 * 39, 1)
+    document_store.save_index("big", ann_index.build_index(vectors, ann_index.INDEX_IVFPQ))
+    first, second = CorpusIndex(corpus_dir), CorpusIndex(corpus_dir)
+    first.add_document("big", "big.pdf", "**Document Type:** Lease", vectors)
+
+    # The second process reads the vectors back from the IVF-PQ index on disk.
+    assert second.vector_count == 0 and len(second.documents()) == 1
+    assert second.vector_count == len(vectors)
+    hit = second.search(vectors[7:8], k=1)[0]
+    assert (hit.document_id, hit.chunk_index) == ("big", 7)
+
+
+def test_searches_continue_while_the_index_is_rebuilt(corpus_dir, monkeypatch):
+    monkeypatch.setattr(settings, "vector_index_type", "auto")
+    monkeypatch.setattr(settings, "vector_index_flat_max", 10)
+    corpus = CorpusIndex(corpus_dir)
+    vectors = _vectors(8, 1)
+    _add(corpus, "a", vectors)
+
+    building, release = threading.Event(), threading.Event()
+    original_build = ann_index.build_index
+
+    def slow_build(embeddings, index_type=None):
+        if index_type == ann_index.INDEX_HNSW:
+            building.set()
+            release.wait(5)
+        return original_build(embeddings, index_type)
+
+    monkeypatch.setattr(ann_index, "build_index", slow_build)
+    more = _vectors(6, 2)
+    _add(corpus, "b", more)
+    assert building.wait(5)
+    # The rebuild holds no lock: searches and adds still go through.
+    assert corpus.search(vectors[2:3], k=1)[0].chunk_index == 2
+    late = _vectors(2, 3)
+    _add(corpus, "c", late)
+    release.set()
+    corpus._upgrade.result(5)
+
+    assert ann_index.index_type_of(corpus._index) == ann_index.INDEX_HNSW
+    assert corpus.vector_count == 16
+    hit = corpus.search(late[1:2], k=1)[0]
+    assert (hit.document_id, hit.chunk_index) == ("c", 1)
@@ -0,0 +1,99 @@
+import asyncio
+
+from app.config import settings
+from app.core.concurrency import run_io
+from app.core.document_context import DocumentContext, close_document_context, context_for_task, describe_excerpt
+from app.core.long_document import (
+    identify_document_sections, open_document_context, summarize_document, summarize_section
+)
+
+# The fake server answers every structure prompt with these titles.
+_TITLES = ["Premises", "Term", "Rent and Deposit", "Use and Maintenance", "Termination and Default", "General Provisions"]
+
+
+def _lease_text() -> str:
+    sections = []
+    for number, title in enumerate(_TITLES, start=1):
+        # "Rent and Deposit" is longer than one section window.
+        clauses = 150 if title == "Rent and Deposit" else 20
+        body = "\n".join(
+            f"{number}.{n} The {title.lower()} obligation {n} requires a payment of {n * 37 + number} dollars "
+            f"within {n + number} days of written notice."
+            for n in range(1, clauses + 1)
+        )
+        sections.append(f"ARTICLE {number}\n{title.upper()}\n{body}")
+    return "\n\n".join(sections)
+
+
+async def _analyse(text: str):
+    context = await open_document_context(text)
+    try:
+        summary = asyncio.create_task(summarize_document(text, context))
+        spans = await identify_document_sections(text, context)
+        await asyncio.gather(*(
+            summarize_section(span.title, text[span.start:span.end], context, span.start) for span in spans
+        ))
+        await summary
+    finally:
+        if context is not None:
+            await run_io(close_document_context, context)
+    return spans
+
+
+def test_cached_and_inline_runs_summarize_the_same_sections(fake_gemini, monkeypatch):
+    text = _lease_text()
+    monkeypatch.setattr(settings, "document_context_enabled", False)
+    inline_spans = asyncio.run(_analyse(text))
+    inline = fake_gemini.stats.snapshot()
+
+    fake_gemini.stats.reset()
+    monkeypatch.setattr(settings, "document_context_enabled", True)
+    cached_spans = asyncio.run(_analyse(text))
+    cached = fake_gemini.stats.snapshot()
+
+    assert cached_spans == inline_spans and len(inline_spans) == len(_TITLES)
+    # The long section is summarized in parts, and the reduce step runs, either way.
+    assert inline["section_summary"]["requests"] == cached["section_summary"]["requests"] > len(_TITLES)
+    assert inline["combined_summary"] == cached["combined_summary"]
+    assert cached["context_cache"]["requests"] == 1
+    assert cached["section_summary"]["tokens"] < inline["section_summary"]["tokens"] / 3
+    assert cached["section_titles"]["cached_tokens"] > 0
+    # The summary runs on another model than the cache and keeps it, sending the text inline.
+    assert cached["summary"] == inline["summary"]
+    assert not fake_gemini.caches
+
+
+def test_only_tasks_on_the_cache_model_use_it(monkeypatch):
+    context = DocumentContext("text", "gemini-2.5-flash", cache=None)
+    assert context_for_task(context, "section_summary") is context
+    assert context_for_task(context, "section_titles") is context
+    assert context_for_task(context, "summary") is None
+    assert context_for_task(None, "section_summary") is None
+
+
+def _clauses(prefix: str, count: int) -> str:
+    return " ".join(f"{prefix} clause {n} binds the parties." for n in range(count))
+
+
+def test_excerpts_are_described_by_words_that_occur_once():
+    boilerplate = "Subject to the terms and conditions of this Agreement and to applicable law, " * 3
+    first = boilerplate + _clauses("first", 12)
+    second = boilerplate + _clauses("second", 12)
+    text = f"{first}\n\n{second}"
+    context = DocumentContext(text, "gemini-2.5-flash", cache=None)
+
+    # Both sections open with the same forty words; neither can be told apart by its opening.
+    assert describe_excerpt(context, 0, len(first)) is None
+    assert describe_excerpt(context, len(first) + 2, len(text)) is None
+
+    distinct = _clauses("third", 20)
+    text = f"{text}\n\n{distinct}"
+    context = DocumentContext(text, "gemini-2.5-flash", cache=None)
+    start = len(text) - len(distinct)
+    description = describe_excerpt(context, start, len(text))
+    assert description == (
+        'the passage of the document that begins with "third clause 0 binds the parties. third clause" '
+        'and ends with "the parties. third clause 19 binds the parties."'
+    )
+    # Short passages are sent inline.
+    assert describe_excerpt(context, start, start + 60) is None
@@ -0,0 +1,107 @@
+import asyncio
+import io
+
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+from app.config import settings
+from app.core import document_processor
+from app.core.document_processor import _page_ranges, _split_pdf, extract_document_text
+
+
+def _blank_pdf(path, pages: int):
+    _pdf(path, [None] * pages)
+
+
+def _pdf(path, pages: list[str | None]):
+    """A PDF whose pages have the given text layers; None makes a page with no text, like a scan."""
+    writer = PdfWriter()
+    font = writer._add_object(DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject("/Helvetica"),
+    }))
+    for text in pages:
+        page = writer.add_blank_page(width=600, height=200)
+        if text is None:
+            continue
+        content = DecodedStreamObject()
+        content.set_data(f"BT /F1 10 Tf 10 100 Td ({text}) Tj ET".encode("latin-1"))
+        page[NameObject("/Contents")] = writer._add_object(content)
+        page[NameObject("/Resources")] = DictionaryObject({
+            NameObject("/Font"): DictionaryObject({NameObject("/F1"): font})
+        })
+    with open(path, "wb") as f:
+        writer.write(f)
+
+
+def test_page_ranges_split_runs_of_consecutive_pages():
+    assert _page_ranges([], 3) == []
+    assert _page_ranges([4], 3) == [[4]]
+    # The last range holds what is left over.
+    assert _page_ranges([0, 1, 2, 3, 4, 5, 6], 3) == [[0, 1, 2], [3, 4, 5], [6]]
+    # A gap starts a new range even when the current one has room.
+    assert _page_ranges([0, 1, 3, 4, 5, 9], 4) == [[0, 1], [3, 4, 5], [9]]
+    assert _page_ranges([2, 3, 4], 1) == [[2], [3], [4]]
+
+
+def test_only_pages_without_a_text_layer_go_to_document_ai(tmp_path, monkeypatch):
+    path = str(tmp_path / "mixed.pdf")
+    clause = "The tenant shall pay rent of 1850 dollars on the first day of each month."
+    _pdf(path, [clause, None, "- 2 -", clause.replace("rent", "the deposit"), None])
+    monkeypatch.setattr(settings, "docai_pages_per_request", 15)
+    monkeypatch.setattr(settings, "docai_max_concurrent_requests", 1)
+
+    sent = []
+
+    def ocr(content, mime_type):
+        pages = len(PdfReader(io.BytesIO(content)).pages)
+        sent.append(pages)
+        return [f"scanned page {len(sent)}.{i}" for i in range(pages)]
+
+    monkeypatch.setattr(document_processor, "process_pages_with_docai", ocr)
+    document = asyncio.run(extract_document_text(path, "application/pdf"))
+
+    # Page 3 carries only a page number: too little text to count as a text layer.
+    assert sent == [2, 1]
+    assert (document.text_layer_pages, document.ocr_pages, document.page_count) == (2, 3, 5)
+    ends = document.page_offsets[1:] + [None]
+    pages = [document.text[start:end].strip() for start, end in zip(document.page_offsets, ends)]
+    assert pages[0] == clause and pages[3] == clause.replace("rent", "the deposit")
+    assert pages[1:3] == ["scanned page 1.0", "scanned page 1.1"] and pages[4] == "scanned page 2.0"
+
+    # With the text layer disabled every page is OCR'd.
+    monkeypatch.setattr(settings, "pdf_text_layer_enabled", False)
+    texts, ranges = _split_pdf(path)
+    assert texts == [None] * 5 and ranges == [[0, 1, 2, 3, 4]]
+
+
+def test_ocr_ranges_are_written_only_when_their_request_runs(tmp_path, monkeypatch):
+    path = str(tmp_path / "scan.pdf")
+    _blank_pdf(path, 5)
+    monkeypatch.setattr(settings, "docai_pages_per_request", 2)
+    monkeypatch.setattr(settings, "docai_max_concurrent_requests", 1)
+
+    texts, ranges = _split_pdf(path)
+    assert texts == [None] * 5 and ranges == [[0, 1], [2, 3], [4]]
+
+    written, in_flight = [], []
+
+    def write_slice(upload_path, page_numbers):
+        # With one request at a time, no other range has been written but not yet sent.
+        assert len(written) == len(in_flight)
+        written.append(page_numbers)
+        return original_write(upload_path, page_numbers)
+
+    def ocr(content, mime_type):
+        pages = len(PdfReader(io.BytesIO(content)).pages)
+        in_flight.append(pages)
+        return [f"page text {len(in_flight)}.{i}" for i in range(pages)]
+
+    original_write = document_processor._write_pdf_slice
+    monkeypatch.setattr(document_processor, "_write_pdf_slice", write_slice)
+    monkeypatch.setattr(document_processor, "process_pages_with_docai", ocr)
+    document = asyncio.run(extract_document_text(path, "application/pdf"))
+
+    assert written == [[0, 1], [2, 3], [4]] and in_flight == [2, 2, 1]
+    assert document.ocr_pages == 5 and document.text.startswith("page text 1.0\n\npage text 1.1")
@@ -0,0 +1,102 @@
+import os
+
+import numpy as np
+import pytest
+
+from app.core import document_store
+from app.core.document_store import MappedChunks
+
+
+def _files(document_id: str) -> set[str]:
+    return set(os.listdir(document_store._document_dir(document_id)))
+
+
+def test_mapped_chunks_behave_like_a_list_of_strings():
+    texts = ["Rent is €1,850.", "", "Deposit: 1.850 €", "Notice — 60 days"]
+    encoded = [text.encode("utf-8") for text in texts]
+    offsets = np.concatenate([[0], np.cumsum([len(b) for b in encoded])]).astype(np.uint64)
+    chunks = MappedChunks(offsets, b"".join(encoded))
+
+    assert len(chunks) == 4 and list(chunks) == texts
+    assert chunks[-1] == texts[-1] and chunks[1:3] == texts[1:3] and chunks[::-2] == texts[::-2]
+    assert "Deposit: 1.850 €" in chunks and chunks.index("") == 1
+    with pytest.raises(IndexError):
+        chunks[4]
+    with pytest.raises(IndexError):
+        chunks[-5]
+
+
+def test_chunks_round_trip_through_the_store(data_dir):
+    chunks = ["3.1 Monthly Rent. $1,850.00.", "", "3.2 Late Charge — $75.00."]
+    document_store.save_chunks("lease", chunks)
+
+    assert list(document_store.load_chunks("lease")) == chunks
+    assert document_store.load_chunks("missing") is None
+    document_store.save_chunks("empty", [])
+    assert list(document_store.load_chunks("empty")) == []
+    with pytest.raises(ValueError):
+        document_store.load_chunks("../lease")
+
+
+def test_rewriting_chunks_publishes_a_new_generation(data_dir):
+    document_store.save_chunks("lease", ["old rent", "old term"])
+    before = document_store.load_chunks("lease")
+    old_files = _files("lease")
+
+    document_store.save_chunks("lease", ["new rent"])
+
+    assert list(document_store.load_chunks("lease")) == ["new rent"]
+    # The previous generation is gone from the directory, but a reader that
+    # mapped it keeps a consistent view of the old offsets and blob.
+    assert not (old_files - {document_store.CHUNKS_MANIFEST_FILENAME}) & _files("lease")
+    assert list(before) == ["old rent", "old term"]
+    assert len(_files("lease")) == 3
+
+
+def test_a_reader_never_pairs_files_from_different_generations(data_dir, monkeypatch):
+    document_store.save_chunks("lease", ["old rent", "old term"])
+    opened = []
+    original_open = document_store._open_strings
+
+    def open_after_a_rewrite(offsets_path, blob_path):
+        # A writer publishes a new generation and deletes this one while the reader is opening it.
+        if not opened:
+            opened.append(offsets_path)
+            document_store.save_chunks("lease", ["new rent"])
+        return original_open(offsets_path, blob_path)
+
+    monkeypatch.setattr(document_store, "_open_strings", open_after_a_rewrite)
+    assert list(document_store.load_chunks("lease")) == ["new rent"]
+
+    # A manifest naming files that are not there (and is not replaced meanwhile) means nothing is stored.
+    monkeypatch.setattr(document_store, "_open_strings", original_open)
+    for name in _files("lease") - {document_store.CHUNKS_MANIFEST_FILENAME}:
+        os.remove(os.path.join(document_store._document_dir("lease"), name))
+    assert document_store.load_chunks("lease") is None
+
+
+def test_documents_stored_before_manifests_are_read_and_upgraded(data_dir):
+    directory = document_store._document_dir("legacy")
+    writers = document_store._string_writers(
+        document_store.CHUNK_OFFSETS_FILENAME, document_store.CHUNK_BLOB_FILENAME, ["legacy rent", "legacy term"]
+    )
+    for filename, write in writers.items():
+        document_store.atomic_write(os.path.join(directory, filename), write)
+
+    assert list(document_store.load_chunks("legacy")) == ["legacy rent", "legacy term"]
+
+    document_store.save_chunks("legacy", ["rewritten"])
+    assert list(document_store.load_chunks("legacy")) == ["rewritten"]
+    assert not {document_store.CHUNK_OFFSETS_FILENAME, document_store.CHUNK_BLOB_FILENAME} & _files("legacy")
+
+
+def test_lexical_index_round_trips_as_one_generation(data_dir):
+    postings = np.arange(12, dtype=np.uint32)
+    document_store.save_lexical_index("lease", ["deposit", "rent"], postings)
+    document_store.save_lexical_index("lease", ["deposit", "late", "rent"], postings[:6])
+
+    terms, loaded = document_store.load_lexical_index("lease")
+    assert list(terms) == ["deposit", "late", "rent"]
+    np.testing.assert_array_equal(loaded, postings[:6])
+    assert len(_files("lease")) == 4
+    assert document_store.load_lexical_index("missing") is None
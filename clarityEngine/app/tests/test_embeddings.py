@@ -0,0 +1,88 @@
+import threading
+import time
+
+import numpy as np
+
+from app.core.embeddings import QUERY_PRIORITY, EmbeddingService
+from app.tests.conftest import HashingEmbeddingModel
+
+
+def _service(model, batch_size: int = 8) -> EmbeddingService:
+    service = EmbeddingService("test-model", batch_size=batch_size, max_wait_ms=1, cache_max_entries=100)
+    service.model = model
+    return service
+
+
+class BlockingModel(HashingEmbeddingModel):
+    """Holds every encode until `release` is set."""
+
+    def __init__(self):
+        super().__init__()
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def encode(self, texts, **kwargs):
+        self.started.set()
+        self.release.wait(5)
+        return super().encode(texts, **kwargs)
+
+
+def test_vectors_come_back_in_order_and_each_text_is_encoded_once():
+    model = HashingEmbeddingModel()
+    service = _service(model)
+    vectors = service.embed(["rent", "deposit", "rent"])
+
+    assert vectors.shape == (3, model.dimension) and vectors.dtype == np.float32
+    np.testing.assert_array_equal(vectors[0], vectors[2])
+    assert sorted(model.encoded) == ["deposit", "rent"]
+    np.testing.assert_array_equal(service.embed(["deposit"], priority=QUERY_PRIORITY)[0], vectors[1])
+    assert sorted(model.encoded) == ["deposit", "rent"]
+
+
+def test_only_texts_served_from_the_cache_count_as_hits():
+    service = _service(HashingEmbeddingModel())
+    # A repeat within one call is encoded once but is not a cache hit.
+    service.embed(["rent", "rent", "deposit"])
+    assert service.stats()["cache_hits"] == 0
+
+    service.embed(["rent", "term", "rent"])
+    stats = service.stats()
+    assert stats["cache_hits"] == 2 and stats["texts_requested"] == 6
+
+
+def test_waiting_on_another_callers_encode_is_not_a_hit():
+    model = BlockingModel()
+    service = _service(model)
+    first = threading.Thread(target=service.embed, args=(["rent"],))
+    first.start()
+    assert model.started.wait(5)
+
+    second_result = []
+    second = threading.Thread(target=lambda: second_result.append(service.embed(["rent"])))
+    second.start()
+    # Let the second caller find the text in flight before the encode finishes.
+    while service.stats()["texts_requested"] < 2:
+        time.sleep(0.001)
+    model.release.set()
+    first.join(5)
+    second.join(5)
+
+    assert second_result and model.encoded == ["rent"]
+    assert service.stats()["cache_hits"] == 0
+
+
+def test_a_failed_encode_is_reported_and_not_cached():
+    class FailingModel(HashingEmbeddingModel):
+        def encode(self, texts, **kwargs):
+            raise RuntimeError("out of memory")
+
+    service = _service(FailingModel())
+    try:
+        service.embed(["rent"])
+    except RuntimeError as e:
+        assert str(e) == "out of memory"
+    else:
+        raise AssertionError("expected the encode error")
+
+    service.model = HashingEmbeddingModel()
+    assert service.embed(["rent"]).shape == (1, HashingEmbeddingModel.dimension)
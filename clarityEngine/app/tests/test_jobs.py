@@ -0,0 +1,218 @@
+import asyncio
+import os
+import time
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+from app.config import settings
+from app.core import jobs
+from app.core.admission import admission
+from app.core.jobs import COMPLETED, FAILED, QUEUED, RUNNING, JobQueue, JobStore
+from app.core.uploads import Upload
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / "jobs.sqlite3"))
+
+
+@pytest.fixture
+def spool_dir(tmp_path):
+    path = tmp_path / "spool"
+    path.mkdir()
+    return str(path)
+
+
+def _spooled_upload(spool_dir: str, name: str = "incoming") -> Upload:
+    path = os.path.join(spool_dir, name)
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.7")
+    return Upload(path=path, size=8, content_hash="hash", page_count=1, owned=True)
+
+
+def test_only_one_process_claims_a_job(store):
+    store.create("job", "lease.pdf", "application/pdf", "/tmp/lease.pdf")
+
+    claimed = store.claim("job", "host:1", lease_seconds=60)
+    assert claimed["status"] == RUNNING and claimed["owner"] == "host:1" and claimed["attempts"] == 1
+    assert claimed["lease_expires"] > time.time() + 50
+    assert store.claim("job", "host:2", lease_seconds=60) is None
+    assert store.queued_job_ids() == []
+
+
+def test_a_job_backing_off_is_not_claimed_before_its_retry_time(store):
+    store.create("job", "lease.pdf", "application/pdf", "/tmp/lease.pdf")
+    store.update("job", not_before=time.time() + 60)
+
+    assert store.queued_job_ids() == []
+    assert store.claim("job", "host:1", lease_seconds=60) is None
+
+    store.update("job", not_before=time.time() - 1)
+    assert store.queued_job_ids() == ["job"]
+    assert store.claim("job", "host:1", lease_seconds=60)["not_before"] is None
+
+
+def test_renewing_a_lease_only_works_for_its_owner(store):
+    store.create("job", "lease.pdf", "application/pdf", "/tmp/lease.pdf")
+    store.claim("job", "host:1", lease_seconds=1)
+
+    assert store.renew_lease("job", "host:1", lease_seconds=60)
+    assert store.get("job")["lease_expires"] > time.time() + 50
+    assert not store.renew_lease("job", "host:2", lease_seconds=60)
+
+
+def test_abandoned_jobs_are_requeued_until_out_of_attempts(store):
+    for job_id in ("alive", "dead", "exhausted"):
+        store.create(job_id, "lease.pdf", "application/pdf", f"/tmp/{job_id}.pdf")
+    store.claim("alive", "host:1", lease_seconds=60)
+    store.claim("dead", "host:2", lease_seconds=60)
+    store.claim("exhausted", "host:2", lease_seconds=60)
+    store.update("exhausted", attempts=3)
+
+    failed = store.recover_abandoned(lambda owner: owner == "host:1", max_attempts=3, lease_seconds=60)
+
+    assert [job["id"] for job in failed] == ["exhausted"]
+    assert store.get("alive")["status"] == RUNNING
+    assert store.get("dead")["status"] == QUEUED and store.get("dead")["owner"] is None
+    assert store.get("exhausted")["status"] == FAILED
+
+
+def test_jobs_whose_lease_expired_are_requeued_even_on_another_host(store):
+    for job_id in ("leased", "expired"):
+        store.create(job_id, "lease.pdf", "application/pdf", f"/tmp/{job_id}.pdf")
+    store.claim("leased", "other-host:1", lease_seconds=60)
+    store.claim("expired", "other-host:2", lease_seconds=60)
+    store.update("expired", lease_expires=time.time() - 1)
+
+    # Processes on another host are always presumed alive; only the lease tells.
+    assert store.recover_abandoned(jobs._owner_alive, max_attempts=3, lease_seconds=60) == []
+
+    assert store.get("leased")["status"] == RUNNING
+    expired = store.get("expired")
+    assert expired["status"] == QUEUED and expired["owner"] is None and expired["lease_expires"] is None
+
+
+def test_only_processes_known_to_be_gone_are_dead():
+    host = jobs.socket.gethostname()
+    assert jobs._owner_alive(f"{host}:{os.getppid()}")
+    assert not jobs._owner_alive(f"{host}:{2 ** 22 + 1}")
+    assert jobs._owner_alive("some-other-host:1")
+
+
+def test_jobs_left_running_under_our_own_pid_are_recovered_at_start(store, spool_dir, monkeypatch):
+    async def pipeline(**kwargs):
+        return {"document_id": "doc"}
+
+    queue = JobQueue(store, spool_dir, num_workers=1)
+    store.create("job", "lease.pdf", "application/pdf", "/elsewhere/lease.pdf")
+    store.claim("job", queue.owner, lease_seconds=60)
+
+    async def scenario():
+        admission.start()
+        await queue.start()
+        try:
+            await asyncio.wait_for(queue._queue.join(), 5)
+        finally:
+            await queue.stop()
+
+    monkeypatch.setattr(jobs, "run_processing_pipeline", pipeline)
+    asyncio.run(scenario())
+    assert store.get("job")["status"] == COMPLETED and store.get("job")["attempts"] == 2
+
+
+async def _run_queue(queue: JobQueue, upload: Upload) -> dict:
+    admission.start()
+    await queue.start()
+    try:
+        job_id = await queue.submit(upload, "lease.pdf", "application/pdf")
+        for _ in range(200):
+            job = await queue.get(job_id)
+            if job["status"] in (COMPLETED, FAILED):
+                # The spool file is removed after the final status is recorded.
+                await asyncio.wait_for(queue._queue.join(), 5)
+                return job
+            await asyncio.sleep(0.01)
+        raise AssertionError("job did not finish")
+    finally:
+        await queue.stop()
+
+
+def test_transient_failures_are_retried(store, spool_dir, monkeypatch):
+    calls = []
+
+    async def flaky_pipeline(**kwargs):
+        calls.append(kwargs["upload_path"])
+        if len(calls) < 3:
+            raise google_exceptions.ServiceUnavailable("Document AI is unavailable")
+        return {"document_id": "doc"}
+
+    monkeypatch.setattr(jobs, "run_processing_pipeline", flaky_pipeline)
+    monkeypatch.setattr(settings, "job_max_attempts", 3)
+    monkeypatch.setattr(settings, "job_retry_base_seconds", 0.01)
+    job = asyncio.run(_run_queue(JobQueue(store, spool_dir, num_workers=1), _spooled_upload(spool_dir)))
+
+    assert job["status"] == COMPLETED and job["attempts"] == 3 and job["result"] == {"document_id": "doc"}
+    assert len(calls) == 3 and not os.path.exists(calls[0])
+
+
+def test_other_errors_fail_the_job_without_retrying(store, spool_dir, monkeypatch):
+    async def failing_pipeline(**kwargs):
+        raise RuntimeError("unreadable PDF")
+
+    monkeypatch.setattr(jobs, "run_processing_pipeline", failing_pipeline)
+    monkeypatch.setattr(settings, "job_max_attempts", 2)
+    job = asyncio.run(_run_queue(JobQueue(store, spool_dir, num_workers=1), _spooled_upload(spool_dir)))
+
+    assert job["status"] == FAILED and job["attempts"] == 1 and job["error"] == "unreadable PDF"
+    assert os.listdir(spool_dir) == []
+
+
+def test_spool_file_is_removed_when_a_job_runs_out_of_attempts(store, spool_dir, monkeypatch):
+    async def failing_pipeline(**kwargs):
+        raise google_exceptions.TooManyRequests("quota exhausted")
+
+    monkeypatch.setattr(jobs, "run_processing_pipeline", failing_pipeline)
+    monkeypatch.setattr(settings, "job_max_attempts", 2)
+    monkeypatch.setattr(settings, "job_retry_base_seconds", 0.01)
+    job = asyncio.run(_run_queue(JobQueue(store, spool_dir, num_workers=1), _spooled_upload(spool_dir)))
+
+    assert job["status"] == FAILED and job["attempts"] == 2 and "quota exhausted" in job["error"]
+    assert os.listdir(spool_dir) == []
+
+
+def test_retry_delay_grows_exponentially_up_to_the_cap(monkeypatch):
+    monkeypatch.setattr(settings, "job_retry_base_seconds", 10.0)
+    monkeypatch.setattr(settings, "job_retry_max_seconds", 25.0)
+    monkeypatch.setattr(jobs.random, "uniform", lambda low, high: high)
+
+    assert [jobs._retry_delay(attempts) for attempts in (1, 2, 3, 4)] == [10.0, 20.0, 25.0, 25.0]
+
+
+def test_a_second_process_does_not_run_a_claimed_job(store, spool_dir, monkeypatch):
+    runs = []
+
+    async def pipeline(**kwargs):
+        runs.append(kwargs["upload_path"])
+        await asyncio.sleep(0.05)
+        return {"document_id": "doc"}
+
+    async def scenario():
+        admission.start()
+        first, second = JobQueue(store, spool_dir, 1), JobQueue(store, spool_dir, 1)
+        second.owner = "elsewhere:1"
+        await first.start()
+        job_id = await first.submit(_spooled_upload(spool_dir), "lease.pdf", "application/pdf")
+        # The second process finds the same job in the store and queues it too.
+        await second.start()
+        try:
+            while (await first.get(job_id))["status"] != COMPLETED:
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0.05)
+        finally:
+            await first.stop()
+            await second.stop()
+
+    monkeypatch.setattr(jobs, "run_processing_pipeline", pipeline)
+    asyncio.run(scenario())
+    assert len(runs) == 1
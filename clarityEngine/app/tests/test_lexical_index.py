@@ -0,0 +1,103 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.config import settings
+from app.core import lexical_index
+from app.core.lexical_index import (
+    LexicalIndex, build_lexical_index, find_references, get_lexical_index, index_terms,
+    lookup_exact_references, normalize_amount, store_lexical_index
+)
+
+CHUNKS = [
+    "3.1 Monthly Rent. The Tenant shall pay monthly rent of $1,850.00, due on the first day of each month.",
+    "3.2 Late Charge. Rent received after the fifth day of the month incurs a late charge of $75.00.",
+    '3.3 Security Deposit. The "Security Deposit" of $1,850.00 is returned within thirty days, as Section 3.1 provides.',
+    "5.1 Default. If the Tenant fails to pay rent, the Landlord may terminate this Agreement.",
+]
+
+
+@pytest.fixture
+def document(data_dir):
+    lexical_index._indexes.clear()
+    store_lexical_index("lease", CHUNKS)
+    yield "lease"
+    lexical_index._indexes.clear()
+
+
+def test_terms_keep_section_numbers_and_normalize_amounts():
+    assert index_terms('Section 12.3: the "Rent" is $1,850.00 in 2024.') == ["section", "12.3", "rent", "$1850", "2024"]
+    assert normalize_amount("$ 12.50") == "$12.5"
+    assert normalize_amount("$1,850") == "$1850"
+
+
+def test_bm25_ranks_rarer_and_repeated_terms_higher():
+    index = LexicalIndex(*build_lexical_index(CHUNKS))
+    results = index.search("late charge", k=3)
+
+    assert results[0][0] == 1
+    rent = index.search("rent", k=10)
+    # The clause that says "rent" twice ranks first; chunks without it are not returned.
+    assert rent[0][0] == 0 and {chunk for chunk, _ in rent} == {0, 1, 3}
+    assert index.search("rent", k=1) == rent[:1]
+    assert index.search("parking", k=3) == []
+    assert list(index.chunks_with("$1850")) == [0, 2]
+
+
+def test_index_is_persisted_and_mapped_back(document):
+    lexical_index._indexes.clear()
+    index = get_lexical_index(document)
+    assert index is not None and index.chunk_count == len(CHUNKS)
+    assert index.search("security deposit", k=1)[0][0] == 2
+
+
+def test_missing_index_is_built_from_the_chunks(data_dir):
+    lexical_index._indexes.clear()
+    assert get_lexical_index("never-indexed") is None
+    assert get_lexical_index("never-indexed", CHUNKS).chunk_count == len(CHUNKS)
+
+
+def test_references_in_a_question():
+    references = find_references('What does Section 3.3 say about the "Security Deposit" and $75?')
+    assert [r.terms for r in references] == [["3.3"], ["$75"], ["security", "deposit"]]
+
+
+def test_section_signs_are_references():
+    assert [r.terms for r in find_references("What does § 4 say, and §3.1?")] == [["4"], ["3.1"]]
+    assert find_references("Is the total 12.5 or more?") == []
+
+
+def test_exact_lookup_finds_the_section_not_the_clauses_citing_it(document):
+    assert lookup_exact_references(document, "What does Section 3.1 say?", CHUNKS) == [0]
+    assert lookup_exact_references(document, "Where is $75.00 mentioned?", CHUNKS) == [1]
+    assert lookup_exact_references(document, 'What is the "Security Deposit"?', CHUNKS) == [2]
+    assert lookup_exact_references(document, "What does § 3.1 say?", CHUNKS) == [0]
+
+
+def test_exact_lookup_gives_up_when_references_are_missing_or_too_broad(document, monkeypatch):
+    assert lookup_exact_references(document, "Can I keep a cat?", CHUNKS) is None
+    assert lookup_exact_references(document, "What does Section 9.9 say?", CHUNKS) is None
+    monkeypatch.setattr(settings, "exact_reference_max_chunks", 1)
+    assert lookup_exact_references(document, "Where is $1,850.00 mentioned?", CHUNKS) is None
+
+
+def test_a_repeated_exact_question_is_answered_from_the_cache(document, fake_gemini, monkeypatch):
+    from app.api import endpoints
+    from app.core.answer_cache import answer_cache
+    from app.main import app
+
+    answer_cache.invalidate(document)
+    monkeypatch.setattr(endpoints, "has_document", lambda document_id: True)
+    monkeypatch.setattr(endpoints.document_chunk_cache, "get", lambda document_id, default=None: CHUNKS)
+
+    async def ask_twice():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://tests") as http:
+            first = await http.post("/api/ask", json={"question": "What does § 3.1 say?", "document_id": document})
+            second = await http.post("/api/ask", json={"question": "what does  § 3.1 say?", "document_id": document})
+            return first.json(), second.json()
+
+    first, second = asyncio.run(ask_twice())
+    assert (first["cached"], second["cached"]) == (False, True)
+    assert second["answer"] == first["answer"] and second["retrieved_context"] == [CHUNKS[0]]
+    assert fake_gemini.stats.snapshot()["answer"]["requests"] == 1
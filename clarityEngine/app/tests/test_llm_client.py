@@ -0,0 +1,158 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+from app.config import settings
+from app.core import llm_client
+from app.core.llm_client import TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _wait_until(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.001)
+
+
+@pytest.fixture
+def retry_settings(monkeypatch):
+    monkeypatch.setattr(settings, "llm_max_attempts", 4)
+    monkeypatch.setattr(settings, "llm_backoff_base_seconds", 1.0)
+    monkeypatch.setattr(settings, "llm_backoff_max_seconds", 3.0)
+
+
+def test_bucket_allows_bursts_then_paces_by_the_clock():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=1000, capacity=2, clock=clock)
+    assert bucket.acquire() == 0.0 and bucket.acquire() == 0.0
+
+    taken = threading.Event()
+    thread = threading.Thread(target=lambda: (bucket.acquire(), taken.set()))
+    thread.start()
+    assert not taken.wait(0.05)
+    clock.now += 0.001
+    assert taken.wait(5)
+    thread.join()
+
+
+def test_bucket_serves_waiting_callers_in_priority_order():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=1000, capacity=1, clock=clock)
+    bucket.acquire()
+    served = []
+
+    def take(priority):
+        bucket.acquire(priority)
+        served.append(priority)
+
+    threads = []
+    for priority in (2, 1, 0):
+        threads.append(threading.Thread(target=take, args=(priority,)))
+        threads[-1].start()
+        _wait_until(lambda: sum(bucket._waiting.values()) == len(threads))
+    for count in range(1, 4):
+        clock.now += 0.001
+        _wait_until(lambda: len(served) == count)
+    for thread in threads:
+        thread.join()
+    assert served == [0, 1, 2]
+
+
+def test_backoff_is_full_jitter_capped_at_the_maximum(retry_settings):
+    for attempt, cap in ((0, 1.0), (1, 2.0), (2, 3.0), (5, 3.0)):
+        delays = [llm_client._backoff(attempt) for _ in range(200)]
+        assert all(0.0 <= delay <= cap for delay in delays)
+        assert max(delays) > cap / 2
+
+
+def test_retryable_errors_are_retried_with_backoff(retry_settings):
+    sleeps, calls = [], []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise google_exceptions.ServiceUnavailable("overloaded")
+        return "ok"
+
+    assert llm_client._with_retries(flaky, "answer", "model", sleep=sleeps.append) == "ok"
+    assert len(calls) == 3
+    assert len(sleeps) == 2 and 0 <= sleeps[0] <= 1.0 and 0 <= sleeps[1] <= 2.0
+
+
+def test_other_errors_and_the_last_attempt_are_raised(retry_settings):
+    sleeps, calls = [], []
+
+    def invalid():
+        calls.append(1)
+        raise google_exceptions.InvalidArgument("bad prompt")
+
+    with pytest.raises(google_exceptions.InvalidArgument):
+        llm_client._with_retries(invalid, "answer", "model", sleep=sleeps.append)
+    assert (len(calls), sleeps) == (1, [])
+
+    def always_throttled():
+        calls.append(1)
+        raise google_exceptions.TooManyRequests("quota")
+
+    calls.clear()
+    with pytest.raises(google_exceptions.TooManyRequests):
+        llm_client._with_retries(always_throttled, "answer", "model", sleep=sleeps.append)
+    assert len(calls) == 4 and len(sleeps) == 3
+
+
+def test_hedge_wins_and_the_slow_request_stops_retrying(retry_settings, monkeypatch):
+    monkeypatch.setattr(settings, "llm_hedge_after_seconds", 0.02)
+    monkeypatch.setattr(llm_client, "_backoff", lambda attempt: 30.0)
+    calls = []
+
+    def attempt():
+        calls.append(threading.current_thread().name)
+        if len(calls) == 1:
+            # The first request fails and backs off for 30s; the hedge answers meanwhile.
+            raise google_exceptions.ServiceUnavailable("overloaded")
+        return "hedge answer"
+
+    stopped = []
+
+    def call(cancelled=None):
+        try:
+            return llm_client._with_retries(attempt, "answer", "model", cancelled)
+        except llm_client._HedgeLost:
+            stopped.append(1)
+            raise
+
+    assert llm_client._hedged(call, "answer", "model") == "hedge answer"
+    # The loser's backoff is cut short instead of running out and trying again.
+    _wait_until(lambda: stopped == [1], timeout=2)
+    assert len(calls) == 2
+
+
+def test_a_hedge_that_has_not_started_never_calls_gemini(monkeypatch):
+    monkeypatch.setattr(settings, "llm_hedge_after_seconds", 0.02)
+    # One worker: the hedge queues behind the primary, which then answers.
+    monkeypatch.setattr(llm_client, "_hedge_executor", ThreadPoolExecutor(max_workers=1))
+    calls = []
+
+    def attempt():
+        calls.append(1)
+        time.sleep(0.05)
+        return "primary answer"
+
+    def call(cancelled=None):
+        return llm_client._with_retries(attempt, "answer", "model", cancelled)
+
+    assert llm_client._hedged(call, "answer", "model") == "primary answer"
+    llm_client._hedge_executor.shutdown(wait=True)
+    assert calls == [1]
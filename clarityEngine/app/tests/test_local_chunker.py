@@ -0,0 +1,68 @@
+from app.core.local_chunker import chunk_text_locally, group_chunks_into_windows
+
+CLAUSES = """ARTICLE 1
+1.1 Description. The Landlord leases to the Tenant the apartment located at 42 Elm Street, Unit 3B.
+1.2 Condition. The Tenant has inspected the Premises and accepts them in their present condition.
+ARTICLE 2
+2.1 Initial Term. The term of this Agreement begins on February 1, 2024 and ends on January 31, 2025.
+"""
+
+
+def _sentences(count: int) -> str:
+    return " ".join(f"Sentence number {i} states one obligation of the Tenant in plain words." for i in range(count))
+
+
+def test_headings_start_chunks():
+    chunks = chunk_text_locally(CLAUSES, min_tokens=1, max_tokens=400, overlap_tokens=0)
+    assert [chunk.splitlines()[0] for chunk in chunks] == [
+        "ARTICLE 1", "1.1 Description. The Landlord leases to the Tenant the apartment located at 42 Elm Street, Unit 3B.",
+        "1.2 Condition. The Tenant has inspected the Premises and accepts them in their present condition.",
+        "ARTICLE 2",
+        "2.1 Initial Term. The term of this Agreement begins on February 1, 2024 and ends on January 31, 2025."
+    ]
+
+
+def test_short_units_are_merged_into_the_next():
+    chunks = chunk_text_locally(CLAUSES, min_tokens=20, max_tokens=400, overlap_tokens=0)
+    assert chunks[0].startswith("ARTICLE 1\n1.1 Description.")
+    assert all("ARTICLE 2" not in chunk or chunk.startswith("ARTICLE 2\n2.1") for chunk in chunks)
+    # Nothing is lost or reordered.
+    assert "".join(chunks).replace("\n", "") == CLAUSES.replace("\n", "")
+
+
+def test_long_units_split_at_sentences_with_overlap():
+    text = "ARTICLE 7\n" + _sentences(40)
+    chunks = chunk_text_locally(text, min_tokens=10, max_tokens=100, overlap_tokens=20)
+
+    assert len(chunks) > 1
+    assert all(len(chunk) // 4 + 1 <= 100 for chunk in chunks)
+    for previous, chunk in zip(chunks, chunks[1:]):
+        # Each piece starts with a whole sentence carried over from the end of the previous one.
+        first_sentence = chunk.split(". ")[0] + "."
+        assert first_sentence in previous
+        assert chunk.startswith("Sentence number")
+
+
+def test_windows_fit_the_budget_and_keep_their_boundaries_after_an_edit():
+    chunks = [f"Clause {i}. " + _sentences(3) for i in range(60)]
+    windows = group_chunks_into_windows(chunks, max_tokens=400)
+
+    assert [chunk for window in windows for chunk in window] == chunks
+    assert all(sum(len(c) // 4 + 1 for c in window) <= 400 for window in windows)
+
+    edited = list(chunks)
+    edited[45] = edited[45].replace("Tenant", "Landlord")
+    edited_windows = group_chunks_into_windows(edited, max_tokens=400)
+    # Boundaries are chosen by content: windows before the edit are unchanged.
+    unchanged = [w for w in edited_windows if w in windows]
+    assert len(unchanged) >= len(windows) - 3
+    assert edited_windows[0] == windows[0]
+
+
+def test_importing_the_chunker_does_not_load_the_gemini_client():
+    import subprocess
+    import sys
+
+    code = "import sys, app.core.local_chunker, app.core.retrieval; print('app.core.llm_client' in sys.modules)"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "False"
@@ -0,0 +1,79 @@
+import asyncio
+
+from app.config import settings
+from app.core.long_document import _reduce_summaries, split_into_windows, summarize_document
+from app.core.tokens import CHARS_PER_TOKEN
+
+
+def _requests(fake_gemini, kind: str) -> int:
+    return fake_gemini.stats.snapshot().get(kind, {}).get("requests", 0)
+
+
+def test_windows_tile_the_text_within_the_budget():
+    paragraphs = [f"Paragraph {n}. " + "The tenant shall keep the premises clean. " * 6 for n in range(12)]
+    text = "\n\n".join(paragraphs)
+    windows = split_into_windows(text, max_tokens=200)
+
+    assert len(windows) > 1
+    # Consecutive windows neither overlap nor leave a gap.
+    assert "".join(windows) == text
+    assert all(len(window) <= 200 * CHARS_PER_TOKEN for window in windows)
+    # Every cut falls on a paragraph break, so each later window starts a paragraph.
+    assert all(window.startswith("\n\nParagraph") for window in windows[1:])
+
+
+def test_windows_fall_back_to_sentence_then_word_then_hard_cuts():
+    sentences = "The rent is due monthly. Late fees apply after five days. " * 4
+    windows = split_into_windows(sentences, max_tokens=20)
+    assert "".join(windows) == sentences
+    assert all(window.endswith(". ") for window in windows[:-1])
+
+    words = "rent " * 50
+    windows = split_into_windows(words, max_tokens=10)
+    assert "".join(windows) == words
+    # Cut before a space: the next window starts with it.
+    assert all(window.startswith(" ") for window in windows[1:])
+
+    unbroken = "x" * 100
+    assert split_into_windows(unbroken, max_tokens=10) == ["x" * 40, "x" * 40, "x" * 20]
+    assert split_into_windows("short", max_tokens=10) == ["short"]
+
+
+def test_partial_summaries_are_merged_in_groups_of_the_fan_in(fake_gemini, monkeypatch):
+    monkeypatch.setattr(settings, "long_document_window_tokens", 25000)
+    summaries = [f"Part {n}: " + "rent terms " * 9 for n in range(10)] + ["", ""]
+
+    merged = asyncio.run(_reduce_summaries(summaries))
+
+    # Ten non-empty summaries: groups of eight and two, then one call merging those two.
+    assert merged.startswith("## Residential Lease Agreement")
+    assert _requests(fake_gemini, "combined_summary") == 3
+    assert asyncio.run(_reduce_summaries(["", ""])) == ""
+    assert asyncio.run(_reduce_summaries(["only one"])) == "only one"
+
+
+def test_reduce_recurses_while_merged_summaries_exceed_the_window(fake_gemini, monkeypatch):
+    # A 250-character window holds two of the 100-character summaries but only
+    # one of the ~190-character merged summaries the fake server returns.
+    monkeypatch.setattr(settings, "long_document_window_tokens", 250 // CHARS_PER_TOKEN)
+    summaries = [f"Part {n}: " + "x" * 92 for n in range(6)]
+
+    merged = asyncio.run(_reduce_summaries(summaries))
+
+    # Six summaries -> three pairs (3 calls); three merged summaries each fill a
+    # window, so they are merged pairwise (1 call and a passthrough); then the last two (1 call).
+    assert merged.startswith("## Residential Lease Agreement")
+    assert _requests(fake_gemini, "combined_summary") == 5
+
+
+def test_long_documents_are_summarized_per_window_then_reduced(fake_gemini, monkeypatch):
+    monkeypatch.setattr(settings, "long_document_window_tokens", 100)
+    text = "\n\n".join(f"Clause {n}. " + "The landlord maintains the roof. " * 8 for n in range(6))
+    windows = split_into_windows(text, settings.long_document_window_tokens)
+
+    summary = asyncio.run(summarize_document(text))
+
+    assert summary.startswith("## Residential Lease Agreement")
+    assert _requests(fake_gemini, "partial_summary") == len(windows) > 1
+    assert _requests(fake_gemini, "combined_summary") >= 1
+    assert _requests(fake_gemini, "summary") == 0
@@ -0,0 +1,113 @@
+import asyncio
+
+import httpx
+
+from app.core.concurrency import run_cpu, run_io
+from app.core.metrics import (
+    Counter, Gauge, Histogram, current_trace_id, http_request_duration, render_prometheus, span, stage_errors,
+    trace_id_var
+)
+
+
+def test_counters_and_gauges_render_one_line_per_label_set():
+    requests = Counter("test_requests_total", "Requests.", ("cache", "outcome"))
+    requests.inc(cache="result", outcome="hit")
+    requests.inc(2, cache="result", outcome="hit")
+    requests.inc(cache="answer", outcome="miss")
+    depth = Gauge("test_depth", "Depth.", ("work_class",))
+    depth.set(3, work_class="bulk")
+    depth.set(1, work_class="bulk")
+
+    assert requests.render() == [
+        "# HELP test_requests_total Requests.",
+        "# TYPE test_requests_total counter",
+        'test_requests_total{cache="answer",outcome="miss"} 1.0',
+        'test_requests_total{cache="result",outcome="hit"} 3.0',
+    ]
+    assert depth.render()[1:] == ["# TYPE test_depth gauge", 'test_depth{work_class="bulk"} 1']
+    assert requests.value(cache="result", outcome="hit") == 3.0
+
+
+def test_label_values_are_escaped():
+    counter = Counter("test_escaped_total", "Escaping.", ("route",))
+    counter.inc(route='say "hi"\\now\nthen')
+
+    assert counter.render()[-1] == 'test_escaped_total{route="say \\"hi\\"\\\\now\\nthen"} 1.0'
+
+
+def test_histogram_buckets_are_cumulative_and_bounds_inclusive():
+    latency = Histogram("test_latency_seconds", "Latency.", ("stage",), buckets=(1, 0.1, 0.5))
+    for value in (0.05, 0.1, 0.5, 0.7, 3):
+        latency.observe(value, stage="embed")
+
+    assert latency.render()[2:] == [
+        'test_latency_seconds_bucket{stage="embed",le="0.1"} 2',
+        'test_latency_seconds_bucket{stage="embed",le="0.5"} 3',
+        'test_latency_seconds_bucket{stage="embed",le="1"} 4',
+        'test_latency_seconds_bucket{stage="embed",le="+Inf"} 5',
+        'test_latency_seconds_sum{stage="embed"} 4.35',
+        'test_latency_seconds_count{stage="embed"} 5',
+    ]
+    unlabelled = Histogram("test_sizes", "Sizes.", buckets=(10,))
+    unlabelled.observe(4)
+    assert unlabelled.render()[2] == 'test_sizes_bucket{le="10"} 1'
+
+
+def test_spans_record_duration_and_errors(capsys):
+    errors = stage_errors.value(stage="test_span")
+    token = trace_id_var.set("abc123")
+    try:
+        with span("test_span", chunks=3):
+            pass
+        try:
+            with span("test_span"):
+                raise ValueError("boom")
+        except ValueError:
+            pass
+    finally:
+        trace_id_var.reset(token)
+
+    assert stage_errors.value(stage="test_span") == errors + 1
+    assert 'clarity_stage_duration_seconds_count{stage="test_span"} 2' in render_prometheus()
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0].startswith("[trace=abc123] span=test_span status=ok") and lines[0].endswith("chunks=3")
+    assert "status=error" in lines[1]
+
+
+def test_trace_id_follows_work_into_the_executors():
+    async def scenario():
+        trace_id_var.set("request-1")
+        return await run_io(current_trace_id), await run_cpu(current_trace_id)
+
+    assert asyncio.run(scenario()) == ("request-1", "request-1")
+    assert current_trace_id() == "-"
+
+
+def test_middleware_takes_the_trace_id_from_the_request_and_echoes_it(monkeypatch):
+    from app import main
+
+    seen = []
+
+    def stats():
+        seen.append(current_trace_id())
+        return {}
+
+    monkeypatch.setattr(main.admission, "stats", stats)
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+            proxied = await client.get("/admission", headers={"X-Request-ID": "from-node"})
+            traced = await client.get(
+                "/admission", headers={"traceparent": "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"}
+            )
+            fresh = await client.get("/admission")
+            return proxied, traced, fresh
+
+    proxied, traced, fresh = asyncio.run(scenario())
+
+    assert proxied.headers["X-Request-ID"] == "from-node"
+    assert traced.headers["X-Request-ID"] == "4bf92f3577b34da6a3ce929d0e0e4736"
+    assert len(fresh.headers["X-Request-ID"]) == 32
+    assert seen == ["from-node", "4bf92f3577b34da6a3ce929d0e0e4736", fresh.headers["X-Request-ID"]]
+    series = 'clarity_http_request_duration_seconds_count{method="GET",route="/admission",status="200"}'
+    assert any(line.startswith(series) for line in http_request_duration.render())
@@ -0,0 +1,87 @@
+import asyncio
+
+import numpy as np
+
+from app.core import pipeline
+from app.core.admission import admission
+from app.core.document_processor import ExtractedDocument
+from benchmarks.replay import load_fixture
+
+LEASE = load_fixture("docai_lease.txt")
+
+
+def _install_extraction(monkeypatch, texts: dict[str, str]) -> list[str]:
+    """Serves each upload's text from `texts` by path, and records which uploads were extracted."""
+    extracted = []
+
+    async def extract_document_text(upload_path: str, mime_type: str) -> ExtractedDocument:
+        extracted.append(upload_path)
+        return ExtractedDocument(text=texts[upload_path], page_offsets=[0], text_layer_pages=1)
+
+    monkeypatch.setattr(pipeline, "extract_document_text", extract_document_text)
+    return extracted
+
+
+def _write_upload(directory, name: str, content: bytes) -> str:
+    path = directory / name
+    path.write_bytes(content)
+    return str(path)
+
+
+def test_a_second_upload_of_the_same_bytes_skips_extraction_and_gemini(data_dir, fake_gemini, embedding_model, monkeypatch):
+    first = _write_upload(data_dir, "first.pdf", b"%PDF-1.7 lease")
+    second = _write_upload(data_dir, "second.pdf", b"%PDF-1.7 lease")
+    extracted = _install_extraction(monkeypatch, {first: LEASE, second: LEASE})
+
+    async def scenario():
+        admission.start()
+        processed = await pipeline.run_processing_pipeline(first, "application/pdf", "lease.pdf")
+        requests = {kind: totals["requests"] for kind, totals in fake_gemini.stats.snapshot().items()}
+        encoded = len(embedding_model.encoded)
+        repeated = await pipeline.run_processing_pipeline(second, "application/pdf", "lease.pdf")
+        return processed, requests, encoded, repeated
+
+    processed, requests, encoded, repeated = asyncio.run(scenario())
+
+    assert not processed["cached"] and requests.get("section_summary", 0) > 0
+    assert repeated["cached"]
+    assert (repeated["document_id"], repeated["summary"], repeated["sections"]) == (
+        processed["document_id"], processed["summary"], processed["sections"]
+    )
+    assert extracted == [first]
+    assert {kind: totals["requests"] for kind, totals in fake_gemini.stats.snapshot().items()} == requests
+    assert len(embedding_model.encoded) == encoded
+
+
+def test_an_amended_version_embeds_only_its_changed_chunks(data_dir, fake_gemini, embedding_model, monkeypatch):
+    amended_text = LEASE.replace("monthly rent of $1,850.00", "monthly rent of $1,900.00")
+    original = _write_upload(data_dir, "original.pdf", b"%PDF-1.7 lease v1")
+    amended = _write_upload(data_dir, "amended.pdf", b"%PDF-1.7 lease v2")
+    _install_extraction(monkeypatch, {original: LEASE, amended: amended_text})
+
+    async def scenario():
+        admission.start()
+        first = await pipeline.run_processing_pipeline(original, "application/pdf", "lease.pdf")
+        embedding_model.encoded.clear()
+        fake_gemini.stats.reset()
+        second = await pipeline.run_processing_pipeline(
+            amended, "application/pdf", "lease.pdf", previous_document_id=first["document_id"]
+        )
+        return first, second
+
+    first, second = asyncio.run(scenario())
+
+    assert second["document_id"] != first["document_id"]
+    assert second["version"]["number"] == 2 and second["version"]["previous_document_id"] == first["document_id"]
+    changes = second["version"]["changes"]["chunks"]
+    assert changes["added"] == changes["removed"] == 1
+    assert second["version"]["reused"]["embeddings"] == changes["unchanged"] == second["chunk_count"] - 1
+    # Only the amended clause's chunk was sent to the embedding model.
+    assert len(embedding_model.encoded) == 1 and "$1,900.00" in embedding_model.encoded[0]
+    # Only the amended section was summarized again.
+    assert fake_gemini.stats.snapshot()["section_summary"]["requests"] == 1
+
+    # The reused vectors sit at the new positions of their chunks.
+    chunks = pipeline.document_chunk_cache.get(second["document_id"])
+    stored = pipeline.get_chunk_vectors(second["document_id"], list(range(len(chunks))))
+    np.testing.assert_allclose(stored, embedding_model.encode(chunks), atol=1e-6)
@@ -0,0 +1,113 @@
+import asyncio
+
+import pytest
+
+from app.config import settings
+from app.core import resources
+
+
+class FakeDocAIClient:
+    created = []
+
+    def __init__(self, client_options=None):
+        self.client_options = client_options
+        self.closed = False
+        self.transport = self
+        FakeDocAIClient.created.append(self)
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def fresh_resources(monkeypatch):
+    """Empty client pool and readiness state, restored after the test."""
+    FakeDocAIClient.created = []
+    monkeypatch.setattr(resources.documentai, "DocumentProcessorServiceClient", FakeDocAIClient)
+    monkeypatch.setattr(resources, "_warm_up_error", None)
+    was_ready = resources.is_ready()
+    resources._close_docai_clients()
+    resources._ready.clear()
+    yield
+    resources._close_docai_clients()
+    if was_ready:
+        resources._ready.set()
+    else:
+        resources._ready.clear()
+
+
+def test_gemini_model_handles_are_shared_per_model_and_config():
+    resources.clear_generative_models()
+    handle = resources.get_generative_model("gemini-2.5-flash", {"temperature": 0, "top_p": 1})
+
+    assert resources.get_generative_model("gemini-2.5-flash", {"top_p": 1, "temperature": 0}) is handle
+    assert resources.get_generative_model("gemini-2.5-flash") is not handle
+    assert resources.get_generative_model("gemini-2.5-pro", {"temperature": 0, "top_p": 1}) is not handle
+    resources.clear_generative_models()
+    assert resources.get_generative_model("gemini-2.5-flash", {"temperature": 0, "top_p": 1}) is not handle
+
+
+def test_docai_clients_are_created_once_and_used_in_turn(fresh_resources, monkeypatch):
+    monkeypatch.setattr(settings, "docai_client_pool_size", 2)
+
+    clients = [resources.get_docai_client() for _ in range(5)]
+
+    assert len(FakeDocAIClient.created) == 2
+    assert clients == [FakeDocAIClient.created[i % 2] for i in range(5)]
+    assert clients[0].client_options == {"api_endpoint": f"{settings.google_cloud_location}-documentai.googleapis.com"}
+
+    asyncio.run(resources.stop_resources())
+    assert all(client.closed for client in FakeDocAIClient.created)
+    assert resources.get_docai_client() is FakeDocAIClient.created[2]
+
+
+def _install_warm_up(monkeypatch, fail: bool = False) -> list[str]:
+    from app.core import vector_store
+    from app.core.corpus import corpus_index
+
+    loaded = []
+
+    def warm_up_embedding_model():
+        if fail:
+            raise RuntimeError("model download failed")
+        loaded.append("embedding model")
+
+    monkeypatch.setattr(vector_store, "warm_up_embedding_model", warm_up_embedding_model)
+    monkeypatch.setattr(corpus_index, "load", lambda: loaded.append("corpus"))
+    monkeypatch.setattr(settings, "preload_models", True)
+    return loaded
+
+
+def test_warm_up_loads_everything_before_reporting_ready(fresh_resources, monkeypatch):
+    loaded = _install_warm_up(monkeypatch)
+    monkeypatch.setattr(settings, "warm_up_in_background", False)
+
+    asyncio.run(resources.start_resources())
+
+    assert loaded == ["embedding model", "corpus"] and len(FakeDocAIClient.created) > 0
+    assert resources.is_ready() and resources.readiness() == {"status": "ready"}
+
+
+def test_background_warm_up_reports_progress_and_failure(fresh_resources, monkeypatch):
+    _install_warm_up(monkeypatch, fail=True)
+    monkeypatch.setattr(settings, "warm_up_in_background", True)
+
+    async def scenario():
+        await resources.start_resources()
+        # The server is up before warm-up has finished.
+        during = resources.readiness()
+        await resources._warm_up_task
+        return during
+
+    assert asyncio.run(scenario()) == {"status": "warming_up"}
+    assert not resources.is_ready()
+    assert resources.readiness() == {"status": "error", "detail": "model download failed"}
+
+
+def test_without_preloading_the_server_is_ready_at_once(fresh_resources, monkeypatch):
+    loaded = _install_warm_up(monkeypatch)
+    monkeypatch.setattr(settings, "preload_models", False)
+
+    asyncio.run(resources.start_resources())
+
+    assert resources.is_ready() and loaded == []
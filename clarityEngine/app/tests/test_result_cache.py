@@ -0,0 +1,50 @@
+import os
+
+import numpy as np
+import pytest
+
+from app.config import settings
+from app.core import result_cache
+from app.core.result_cache import get_cached_result, put_cached_result
+
+
+def test_result_cache_round_trip(data_dir):
+    embeddings = np.arange(6, dtype=np.float32).reshape(3, 2)
+    put_cached_result("abc123", {"document_id": "doc", "summary": "s", "chunks": ["a", "b", "c"]}, embeddings)
+
+    result, stored = get_cached_result("abc123")
+    assert result["document_id"] == "doc"
+    np.testing.assert_array_equal(stored, embeddings)
+    assert get_cached_result("missing") is None
+
+
+def test_result_cache_drops_unreadable_entries(data_dir):
+    put_cached_result("broken", {"document_id": "doc"}, None)
+    directory = os.path.join(settings.result_cache_dir, result_cache.CACHE_VERSION, "broken")
+    with open(os.path.join(directory, result_cache.RESULT_FILENAME), "w") as f:
+        f.write("{not json")
+
+    assert get_cached_result("broken") is None
+    assert not os.path.exists(directory)
+
+
+def test_result_cache_evicts_old_versions_and_least_recently_used(data_dir, monkeypatch):
+    stale = os.path.join(settings.result_cache_dir, "old-version", "x")
+    os.makedirs(stale)
+    put_cached_result("first", {"payload": "x" * 1000}, None)
+    put_cached_result("second", {"payload": "y" * 1000}, None)
+    assert not os.path.exists(os.path.dirname(stale))
+
+    os.utime(os.path.join(settings.result_cache_dir, result_cache.CACHE_VERSION, "first", result_cache.RESULT_FILENAME), (1, 1))
+    monkeypatch.setattr(settings, "result_cache_max_bytes", 1500)
+    put_cached_result("third", {"payload": "z" * 10}, None)
+
+    assert get_cached_result("first") is None
+    assert get_cached_result("second") is not None
+    assert get_cached_result("third") is not None
+
+
+@pytest.mark.parametrize("content", [b"", b"%PDF-1.7 example"])
+def test_hash_content_is_the_sha256_of_the_bytes(content):
+    import hashlib
+    assert result_cache.hash_content(content) == hashlib.sha256(content).hexdigest()
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+from app.config import settings
+from app.core.lexical_index import LexicalIndex, build_lexical_index
+from app.core.retrieval import Candidate, fuse_candidates, lexical_scores, rescore_with_vectors, select_context
+
+
+@pytest.fixture(autouse=True)
+def retrieval_settings(monkeypatch):
+    monkeypatch.setattr(settings, "retrieval_reranker", "none")
+    monkeypatch.setattr(settings, "retrieval_min_similarity", 0.2)
+    monkeypatch.setattr(settings, "retrieval_relative_margin", 0.2)
+    monkeypatch.setattr(settings, "retrieval_min_chunks", 2)
+    monkeypatch.setattr(settings, "retrieval_rrf_k", 60)
+    monkeypatch.setattr(settings, "retrieval_lexical_keep", 2)
+    monkeypatch.setattr(settings, "retrieval_mmr_lambda", 0.7)
+    monkeypatch.setattr(settings, "retrieval_duplicate_similarity", 0.97)
+
+
+def _unit(*values: float) -> np.ndarray:
+    vector = np.array(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def test_fusion_ranks_chunks_found_by_both_first():
+    chunks = [f"chunk {i}" for i in range(6)]
+    vector_candidates = [Candidate(i, chunks[i], s) for i, s in ((0, 0.9), (1, 0.8), (2, 0.7))]
+    fused = fuse_candidates(vector_candidates, [(2, 5.0), (4, 3.0)], chunks)
+
+    assert [c.chunk_index for c in fused] == [2, 0, 1, 4]
+    assert fused[0].fused_score == 1.0
+    assert fused[0].lexical_rank == 0 and fused[1].lexical_rank is None
+    # Found only by BM25: no similarity until the caller computes one.
+    assert fused[3].similarity == 0.0 and fused[3].lexical_rank == 1
+
+
+def test_rescore_with_vectors_gives_lexical_finds_a_similarity():
+    candidates = [Candidate(0, "a", 0.0), Candidate(1, "b", 0.0)]
+    rescore_with_vectors(candidates, np.stack([_unit(1, 0), _unit(0, 1)]), np.array([[2.0, 0.0]]))
+    assert candidates[0].similarity == pytest.approx(1.0)
+    assert candidates[1].similarity == pytest.approx(0.0)
+
+
+def test_cutoff_keeps_close_matches_and_the_best_lexical_ones():
+    candidates = [Candidate(i, f"text {i}", s) for i, s in enumerate((0.9, 0.85, 0.5, 0.3))]
+    candidates[3].lexical_rank = 0
+    context = select_context("question", candidates)
+
+    # 0.5 is more than the margin below the best match; the BM25 top hit survives anyway.
+    assert context.chunk_indices == [0, 1, 3]
+    assert context.stats["after_cutoff"] == 3
+
+
+def test_mmr_drops_near_duplicates_and_the_budget_limits_the_context():
+    candidates = [Candidate(i, "word " * 40, s) for i, s in enumerate((0.9, 0.89, 0.8))]
+    vectors = np.stack([_unit(1, 0, 0), _unit(1, 0.01, 0), _unit(0.6, 0.8, 0)])
+
+    context = select_context("question", candidates, vectors)
+    assert context.chunk_indices == [0, 2]
+
+    budget = select_context("question", candidates, vectors, token_budget=60)
+    assert budget.chunk_indices == [0]
+
+
+def test_selected_chunks_come_back_in_document_order():
+    candidates = [Candidate(i, f"text {i}", s) for i, s in ((5, 0.9), (1, 0.88), (3, 0.87))]
+    assert select_context("question", candidates).chunk_indices == [1, 3, 5]
+
+
+def test_lexical_scores_are_scaled_to_the_best_match():
+    scores = lexical_scores("security deposit", [
+        "The security deposit is $1,850.00.", "The rent is due monthly.", "A deposit is required."
+    ])
+    assert scores[0] == pytest.approx(1.0)
+    assert scores[1] == 0.0
+    assert 0.0 < scores[2] < 1.0
+    assert lexical_scores("security deposit", []).shape == (0,)
+
+
+def test_lexical_scores_are_the_lexical_index_scores():
+    texts = ["Section 3.1 sets the rent at $1,850.00.", "Rent is due monthly; late rent incurs a charge.", "Pets are allowed."]
+    expected = LexicalIndex(*build_lexical_index(texts)).scores("late rent $1,850.00")
+    np.testing.assert_allclose(lexical_scores("late rent $1,850.00", texts), expected / expected.max(), rtol=1e-6)
@@ -0,0 +1,94 @@
+from app.core.segmentation import FALLBACK_TITLE, SectionSpan, segment_sections, title_key
+
+CONTRACT = """RESIDENTIAL LEASE AGREEMENT
+
+Contents
+1. Premises
+2. Term
+3. Rent and Deposit
+
+ARTICLE 1
+PREMISES
+The Landlord leases the apartment to the Tenant. The Term is described below.
+
+ARTICLE 2
+TERM
+The term begins on February 1, 2024.
+
+ARTICLE 3
+RENT AND DEPOSIT
+The rent is $1,850.00 per month.
+"""
+
+
+def _heading_offset(text: str, heading: str) -> int:
+    return text.index(heading)
+
+
+def test_title_key_ignores_numbering_case_and_punctuation():
+    assert title_key("ARTICLE 4 - Rent.") == "rent"
+    assert title_key("12.3 Security Deposit") == "security deposit"
+    assert title_key("(iv) Notices") == "notices"
+
+
+def test_spans_tile_the_text_and_prefer_body_headings_over_the_contents():
+    spans = segment_sections(CONTRACT, ["Premises", "Term", "Rent and Deposit"])
+
+    assert [s.title for s in spans] == ["Premises", "Term", "Rent and Deposit"]
+    assert spans[0].start == 0
+    assert spans[-1].end == len(CONTRACT)
+    assert all(a.end == b.start for a, b in zip(spans, spans[1:]))
+    # A heading split over two lines starts at its number line, not in the table of contents.
+    assert spans[1].start == _heading_offset(CONTRACT, "ARTICLE 2")
+    assert spans[2].start == _heading_offset(CONTRACT, "ARTICLE 3")
+
+
+def test_title_with_one_character_missing_is_placed():
+    spans = segment_sections(CONTRACT, ["Premises", "Term", "Rent and Deposi"])
+    assert spans[-1] == SectionSpan("Rent and Deposi", _heading_offset(CONTRACT, "ARTICLE 3"), len(CONTRACT))
+
+
+def test_titles_out_of_document_order_keep_the_longest_ordered_chain():
+    body = CONTRACT[CONTRACT.index("ARTICLE 1"):]
+    spans = segment_sections(body, ["Term", "Premises", "Rent and Deposit"])
+
+    # Term and Premises appear in the opposite order; only one of them can be kept.
+    assert len(spans) == 2
+    assert spans[0].title in ("Term", "Premises")
+    assert spans[1] == SectionSpan("Rent and Deposit", body.index("ARTICLE 3"), len(body))
+
+    # With a table of contents, the early "Term" entry lets all three be placed in order.
+    with_contents = segment_sections(CONTRACT, ["Term", "Premises", "Rent and Deposit"])
+    assert [s.title for s in with_contents] == ["Term", "Premises", "Rent and Deposit"]
+    assert with_contents[1].start == _heading_offset(CONTRACT, "ARTICLE 1")
+
+
+def test_parts_share_their_base_heading():
+    text = "RENT\n" + "\n\n".join(f"Paragraph {i} about rent payments and receipts." for i in range(8))
+    spans = segment_sections(text, ["Rent (Part 1)", "Rent (Part 2)"])
+
+    assert [s.title for s in spans] == ["Rent (Part 1)", "Rent (Part 2)"]
+    assert spans[0].start == 0 and spans[1].end == len(text)
+    assert spans[0].end == spans[1].start
+    # The part boundary falls on a paragraph break.
+    assert text[spans[1].start - 2:spans[1].start] == "\n\n"
+
+
+def test_a_tiny_section_split_among_many_parts_stays_inside_its_span():
+    text = "FEES\nDue.\n\nTERM\n" + "The term is one year. " * 20
+    titles = [f"Fees (Part {i})" for i in range(1, 17)] + ["Term"]
+    spans = segment_sections(text, titles)
+
+    assert [s.title for s in spans] == titles
+    term_start = text.index("TERM")
+    assert spans[-1] == SectionSpan("Term", term_start, len(text))
+    for previous, span in zip(spans, spans[1:]):
+        assert previous.end == span.start
+    # More parts than characters: the last parts are empty rather than spilling into "Term".
+    assert all(0 <= s.start <= s.end <= term_start for s in spans[:-1])
+    assert spans[-2].start == spans[-2].end == term_start
+
+
+def test_no_title_found_gives_one_section():
+    assert segment_sections(CONTRACT, ["Governing Law"]) == [SectionSpan(FALLBACK_TITLE, 0, len(CONTRACT))]
+    assert segment_sections(CONTRACT, []) == [SectionSpan(FALLBACK_TITLE, 0, len(CONTRACT))]
@@ -0,0 +1,86 @@
+import asyncio
+import hashlib
+import os
+
+import httpx
+import pytest
+
+from app.config import settings
+from app.core.uploads import MultipartUpload, UploadRejected
+
+_BOUNDARY = "clarity-test-boundary"
+_CONTENT_TYPE = f"multipart/form-data; boundary={_BOUNDARY}"
+
+
+def _form(content: bytes, mime_type: str = "application/pdf", previous_document_id: str | None = None) -> bytes:
+    parts = []
+    if previous_document_id is not None:
+        parts.append(
+            f'--{_BOUNDARY}\r\nContent-Disposition: form-data; name="previous_document_id"\r\n\r\n'
+            f"{previous_document_id}\r\n".encode()
+        )
+    parts.append(
+        f'--{_BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="lease.pdf"\r\n'
+        f"Content-Type: {mime_type}\r\n\r\n".encode() + content + b"\r\n"
+    )
+    return b"".join(parts) + f"--{_BOUNDARY}--\r\n".encode()
+
+
+def test_the_file_part_is_spooled_as_it_arrives(data_dir):
+    content = os.urandom(5000)
+    body = _form(content, previous_document_id="doc-1")
+    form = MultipartUpload(_CONTENT_TYPE)
+    # Boundaries and headers split across pieces are reassembled by the parser.
+    for start in range(0, len(body), 7):
+        form.feed(body[start:start + 7])
+    upload = form.finish()
+
+    with open(upload.path, "rb") as f:
+        assert f.read() == content
+    assert upload.size == len(content) and upload.content_hash == hashlib.sha256(content).hexdigest()
+    assert (form.filename, form.mime_type, form.fields) == ("lease.pdf", "application/pdf", {"previous_document_id": "doc-1"})
+
+
+def test_an_upload_is_refused_once_it_passes_the_limit(data_dir, monkeypatch):
+    monkeypatch.setattr(settings, "max_upload_bytes", 1000)
+    form = MultipartUpload(_CONTENT_TYPE)
+    with pytest.raises(UploadRejected) as rejected:
+        form.feed(_form(b"x" * 1001))
+    assert rejected.value.status_code == 413
+    form.abort()
+    assert os.listdir(settings.job_spool_dir) == []
+
+
+def test_a_body_without_a_file_is_rejected(data_dir):
+    form = MultipartUpload(_CONTENT_TYPE)
+    form.feed(f'--{_BOUNDARY}\r\nContent-Disposition: form-data; name="note"\r\n\r\nhi\r\n--{_BOUNDARY}--\r\n'.encode())
+    with pytest.raises(UploadRejected) as rejected:
+        form.finish()
+    assert rejected.value.status_code == 422
+    with pytest.raises(UploadRejected):
+        MultipartUpload("application/json")
+
+
+async def _post(path: str, body: bytes, chunk_size: int = 256) -> httpx.Response:
+    from app.main import app
+
+    async def chunks():
+        for start in range(0, len(body), chunk_size):
+            yield body[start:start + chunk_size]
+
+    # A generator body is sent chunked, without a content-length for the middleware to check.
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://tests") as http:
+        return await http.post(path, content=chunks(), headers={"content-type": _CONTENT_TYPE})
+
+
+def test_a_chunked_upload_over_the_limit_gets_413_and_leaves_no_spool_file(data_dir, monkeypatch):
+    monkeypatch.setattr(settings, "max_upload_bytes", 4096)
+    response = asyncio.run(_post("/api/process-document", _form(b"%PDF-1.7" + b"x" * 8192)))
+    assert response.status_code == 413
+    assert os.listdir(settings.job_spool_dir) == []
+
+
+def test_an_upload_of_the_wrong_type_is_removed(data_dir):
+    response = asyncio.run(_post("/api/process-document", _form(b"plain text", mime_type="text/plain")))
+    assert response.status_code == 400
+    assert os.listdir(settings.job_spool_dir) == []
@@ -0,0 +1,61 @@
+import threading
+
+import numpy as np
+import pytest
+
+from app.config import settings
+from app.core import vector_store
+
+
+@pytest.fixture
+def registry(data_dir):
+    vector_store.faiss_indexes.clear()
+    yield vector_store.faiss_indexes
+    vector_store.faiss_indexes.clear()
+
+
+def _vectors(count: int, dim: int = 8, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal((count, dim)).astype(np.float32)
+
+
+def test_eviction_does_not_break_a_held_document_lock(registry, monkeypatch):
+    monkeypatch.setattr(settings, "vector_store_max_documents", 1)
+    entered = threading.Event()
+
+    def writer():
+        with vector_store._document_lock("a"):
+            entered.set()
+
+    with vector_store._document_lock("a"):
+        # Storing another document evicts "a" and removing it drops the index, but not the lock.
+        vector_store.store_embeddings("b", _vectors(4))
+        vector_store.remove_document("a")
+        thread = threading.Thread(target=writer)
+        thread.start()
+        assert not entered.wait(0.2)
+    thread.join(1)
+    assert entered.is_set()
+    assert vector_store._document_locks == {}
+
+
+def test_searches_do_not_wait_for_a_writer(registry):
+    vectors = _vectors(10)
+    vector_store.store_embeddings("doc", vectors)
+
+    with vector_store._document_lock("doc"):
+        results = []
+        thread = threading.Thread(target=lambda: results.append(vector_store.search_document("doc", vectors[3:4], 1)))
+        thread.start()
+        thread.join(1)
+        assert results and results[0][0][0] == 3
+        assert vector_store.get_chunk_vectors("doc", [3]).shape == (1, 8)
+
+
+def test_added_vectors_are_searchable_and_reloaded_from_disk(registry):
+    vector_store.store_embeddings("doc", _vectors(5))
+    extra = _vectors(2, seed=1)
+    assert vector_store.add_embeddings("doc", extra) == 7
+
+    vector_store.remove_document("doc")
+    assert vector_store.search_document("doc", extra[1:2], 1)[0][0] == 6
+    assert vector_store.search_document("unknown", extra[1:2], 1) == []
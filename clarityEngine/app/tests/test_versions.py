@@ -0,0 +1,74 @@
+import numpy as np
+
+from app.core import document_store
+from app.core.versions import (
+    PreviousVersion, assemble_embeddings, diff_chunks, diff_sections, hash_texts, link_to_previous_version,
+    text_hash, version_info
+)
+
+
+def _previous(sections: list[tuple[str, str]]) -> PreviousVersion:
+    return PreviousVersion(
+        document_id="v1", number=1, text_hash=None, summary=None,
+        sections=[{"title": title, "text_hash": text_hash(text), "summary": f"about {title}"} for title, text in sections],
+        chunks=[], chunk_hashes=[]
+    )
+
+
+def test_text_hash_ignores_reflowed_whitespace():
+    assert text_hash("The rent is\n  $1,850.00.") == text_hash("The rent is $1,850.00.")
+    assert text_hash("The rent is $1,850.00.") != text_hash("The rent is $1,900.00.")
+
+
+def test_diff_chunks_matches_by_content_wherever_a_chunk_moved():
+    old = hash_texts(["a", "b", "c", "d"])
+    new = hash_texts(["b", "a", "x", "d"])
+    changes = diff_chunks(old, new)
+
+    assert changes.reused == {0: 1, 1: 0, 3: 3}
+    assert (changes.unchanged, changes.added, changes.removed) == (3, 1, 1)
+
+
+def test_diff_sections_tells_changed_from_added_and_removed():
+    previous = _previous([("Rent", "rent text"), ("Term", "term text"), ("Pets", "pets text")])
+    changes = diff_sections(previous, [
+        ("Rent", text_hash("rent text")),
+        ("ARTICLE 2 - Term", text_hash("amended term text")),
+        ("Parking", text_hash("parking text")),
+    ])
+
+    assert (changes.unchanged, changes.changed, changes.added, changes.removed) == (1, 1, 1, 1)
+    assert diff_sections(None, [("Rent", "h")]).added == 1
+
+
+def test_assemble_embeddings_places_reused_and_new_vectors_by_position():
+    previous_vectors = np.array([[1, 1], [3, 3]], dtype=np.float32)
+    new_vectors = np.array([[2, 2]], dtype=np.float32)
+    embeddings = assemble_embeddings(3, {0: 5, 2: 7}, previous_vectors, new_vectors)
+
+    np.testing.assert_array_equal(embeddings, [[1, 1], [2, 2], [3, 3]])
+    assert embeddings.dtype == np.float32
+
+
+def _record(document_id: str, version: int = 1, previous_document_id: str | None = None):
+    document_store.save_version(document_id, {
+        "document_id": document_id, "version": version, "previous_document_id": previous_document_id
+    })
+
+
+def test_a_cached_amendment_is_linked_only_when_its_history_allows(data_dir):
+    _record("v1")
+    _record("v2", 2, "v1")
+    _record("fresh")
+    _record("other-v2", 2, "other-v1")
+
+    def previous(document_id, number):
+        return PreviousVersion(document_id, number, None, None, [], [], [])
+
+    assert link_to_previous_version("fresh", previous("v2", 2))
+    assert version_info("fresh") == {"number": 3, "previous_document_id": "v2"}
+    # It already has a predecessor: left alone.
+    assert not link_to_previous_version("other-v2", previous("v2", 2))
+    # "v2" descends from "v1"; linking "v1" after it would form a cycle.
+    assert not link_to_previous_version("v1", previous("v2", 2))
+    assert version_info("v1") == {"number": 1, "previous_document_id": None}
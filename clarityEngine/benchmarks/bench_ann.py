@@ -0,0 +1,125 @@
+"""
+Recall@k versus query latency for each vector index type.
+
+Builds every index type from app.core.ann_index over the same synthetic
+corpus (clustered, normalized vectors with the embedding model's dimension),
+then sweeps the recall/latency knob of each type (HNSW efSearch, IVF nprobe)
+and reports recall@k against exact search, p50/p95 single-query latency,
+build time and approximate memory.
+
+Usage (from the clarityEngine directory):
+    python -m benchmarks.bench_ann
+    python -m benchmarks.bench_ann --sizes 10000,200000 --k 10 --queries 500 --json ann.json
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from benchmarks.bench_pipeline import summarize
+
+
+def make_corpus(num_vectors: int, dim: int, num_clusters: int, seed: int) -> np.ndarray:
+    """Unit vectors scattered around random topic centres, like chunk embeddings of many contracts."""
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((num_clusters, dim)).astype(np.float32)
+    assignments = rng.integers(0, num_clusters, num_vectors)
+    vectors = centres[assignments] + 0.6 * rng.standard_normal((num_vectors, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(set(f.tolist()) & set(t.tolist())) for f, t in zip(found, truth))
+    return hits / truth.size
+
+
+def _time_queries(index, queries: np.ndarray, k: int) -> tuple[np.ndarray, list[float]]:
+    from app.core import ann_index
+
+    ids, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        _, found = ann_index.search(index, query[None, :], k)
+        latencies.append(time.perf_counter() - start)
+        ids.append(found[0])
+    return np.array(ids), latencies
+
+
+def run_size(num_vectors: int, args) -> dict:
+    from app.config import settings
+    from app.core import ann_index
+
+    corpus = make_corpus(num_vectors, args.dim, args.clusters, args.seed)
+    queries = make_corpus(args.queries, args.dim, args.clusters, args.seed + 1)
+    exact = ann_index.build_index(corpus, ann_index.INDEX_FLAT)
+    _, truth = exact.search(queries, args.k)
+
+    results = []
+    for index_type, knob, values in (
+        (ann_index.INDEX_FLAT, None, [None]),
+        (ann_index.INDEX_HNSW, "hnsw_ef_search", args.ef_search),
+        (ann_index.INDEX_IVFPQ, "ivf_nprobe", args.nprobe),
+    ):
+        start = time.perf_counter()
+        index = ann_index.build_index(corpus, index_type)
+        build_seconds = time.perf_counter() - start
+        built_type = type(index).__name__
+        for value in values:
+            if knob is not None:
+                setattr(settings, knob, value)
+            found, latencies = _time_queries(index, queries, args.k)
+            stats = summarize(latencies)
+            entry = {
+                "index": index_type,
+                "built": built_type,
+                "param": f"{knob}={value}" if knob else "exact",
+                "recall_at_k": recall_at_k(found, truth),
+                "p50_ms": stats["p50_ms"],
+                "p95_ms": stats["p95_ms"],
+                "build_s": build_seconds,
+                "memory_mb": ann_index.index_size_bytes(index) / (1024 * 1024)
+            }
+            results.append(entry)
+            print(f"  {index_type:<6} {entry['param']:<20} recall@{args.k} {entry['recall_at_k']:.3f}   "
+                  f"p50 {entry['p50_ms']:7.3f} ms   p95 {entry['p95_ms']:7.3f} ms   "
+                  f"build {build_seconds:6.1f} s   ~{entry['memory_mb']:.0f} MB   ({built_type})")
+    return {"vectors": num_vectors, "results": results}
+
+
+def _int_list(value: str) -> list[int]:
+    return [int(v) for v in value.split(",") if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=_int_list, default=[10_000, 100_000], help="corpus sizes in vectors")
+    parser.add_argument("--dim", type=int, default=384, help="all-MiniLM-L6-v2 produces 384 dimensions")
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--ef-search", type=_int_list, default=[16, 32, 64, 128, 256])
+    parser.add_argument("--nprobe", type=_int_list, default=[1, 4, 16, 64])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", dest="json_path", help="also write the full report to this file")
+    args = parser.parse_args()
+
+    for name, value in (("GOOGLE_CLOUD_PROJECT", "benchmark"), ("GOOGLE_CLOUD_LOCATION", "us"),
+                        ("DOCAI_PROCESSOR_ID", "benchmark")):
+        os.environ.setdefault(name, value)
+
+    report = {"config": vars(args), "sizes": []}
+    for num_vectors in args.sizes:
+        print(f"\n=== {num_vectors} vectors, {args.dim} dimensions, {args.queries} queries ===")
+        report["sizes"].append(run_size(num_vectors, args))
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.json_path}")
+
+
+if __name__ == "__main__":
+    main()
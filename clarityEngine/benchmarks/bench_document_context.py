@@ -0,0 +1,124 @@
+"""
+Document context benchmark: Gemini input tokens and latency per document,
+with the text cached once versus pasted into every prompt.
+
+Starts the local fake Gemini server (benchmarks/fake_gemini.py), points the
+app's Gemini client at it and runs the pipeline's Gemini stages (summary,
+structure, section summaries) on the lease fixture tiled to each page count,
+once with settings.document_context_enabled off and once on. Reports the
+requests and estimated tokens the server received, the tokens it read from
+caches, and wall time. The fake server's latency grows with the tokens a
+request carries, standing in for prompt processing time.
+
+Usage (from the clarityEngine directory):
+    python -m benchmarks.bench_document_context
+    python -m benchmarks.bench_document_context --pages 3,10,25 --llm-latency-ms 200 --per-1k-tokens-ms 40
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import time
+
+from benchmarks.fake_gemini import FakeGeminiServer
+from benchmarks.replay import CHARS_PER_PAGE, LatencyModel, load_fixture
+
+
+def make_text(pages: int) -> str:
+    document_text = load_fixture("docai_lease.txt")
+    target_chars = pages * CHARS_PER_PAGE
+    copies = target_chars // len(document_text) + 1
+    # Article and clause numbers continue from copy to copy, as in one long contract;
+    # identical copies could not be told apart in the cached text and would be sent inline.
+    articles = len(re.findall(r"(?m)^ARTICLE \d+$", document_text))
+
+    def renumbered(copy: int) -> str:
+        offset = copy * articles
+        text = re.sub(r"(?m)^ARTICLE (\d+)$", lambda m: f"ARTICLE {int(m.group(1)) + offset}", document_text)
+        return re.sub(r"(?m)^(\d+)\.(\d+) ", lambda m: f"{int(m.group(1)) + offset}.{m.group(2)} ", text)
+
+    return ("\n\n".join(renumbered(copy) for copy in range(copies)))[:target_chars]
+
+
+async def analyse(text: str) -> int:
+    """The pipeline's Gemini stages for one document. Returns the number of sections summarized."""
+    from app.config import settings
+    from app.core.concurrency import gather_bounded, run_io
+    from app.core.document_context import close_document_context
+    from app.core.long_document import (
+        open_document_context, summarize_document, identify_document_sections, summarize_section
+    )
+
+    context = await open_document_context(text)
+    try:
+        summary_task = asyncio.create_task(summarize_document(text, context))
+        spans = await identify_document_sections(text, context)
+        await gather_bounded(
+            (summarize_section(span.title, text[span.start:span.end], context, span.start) for span in spans),
+            limit=settings.section_summary_concurrency
+        )
+        await summary_task
+    finally:
+        if context is not None:
+            await run_io(close_document_context, context)
+    return len(spans)
+
+
+def _int_list(value: str) -> list[int]:
+    return [int(v) for v in value.split(",") if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=_int_list, default=[3, 10, 25])
+    parser.add_argument("--llm-latency-ms", type=float, default=200)
+    parser.add_argument("--per-1k-tokens-ms", type=float, default=40)
+    parser.add_argument("--json", dest="json_path", help="also write the full report to this file")
+    args = parser.parse_args()
+
+    server = FakeGeminiServer(LatencyModel(args.llm_latency_ms, per_1k_tokens_ms=args.per_1k_tokens_ms)).start()
+    for name, value in (("GOOGLE_CLOUD_PROJECT", "benchmark"), ("GOOGLE_CLOUD_LOCATION", "us"),
+                        ("DOCAI_PROCESSOR_ID", "benchmark"), ("GEMINI_API_ENDPOINT", server.endpoint)):
+        os.environ[name] = value
+    from app.config import settings
+    # Pacing requests to the real quota would only measure the token bucket.
+    settings.llm_requests_per_minute = {}
+
+    report = []
+    try:
+        for pages in args.pages:
+            text = make_text(pages)
+            print(f"\n=== {pages} pages ({len(text)} characters) ===")
+            for cached in (False, True):
+                settings.document_context_enabled = cached
+                server.stats.reset()
+                start = time.perf_counter()
+                sections = asyncio.run(analyse(text))
+                seconds = time.perf_counter() - start
+                received = server.stats.snapshot()
+                entry = {
+                    "pages": pages,
+                    "mode": "cached" if cached else "inline",
+                    "seconds": seconds,
+                    "sections": sections,
+                    "requests": sum(t["requests"] for t in received.values()),
+                    "tokens_received": sum(t["tokens"] for t in received.values()),
+                    "tokens_read_from_cache": sum(t["cached_tokens"] for t in received.values()),
+                    "by_kind": received,
+                }
+                report.append(entry)
+                print(f"  {entry['mode']:<7} {seconds * 1000:8.0f} ms   {entry['requests']:3d} requests   "
+                      f"{entry['tokens_received']:7d} tokens received   "
+                      f"{entry['tokens_read_from_cache']:7d} read from cache")
+    finally:
+        server.stop()
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.json_path}")
+
+
+if __name__ == "__main__":
+    main()
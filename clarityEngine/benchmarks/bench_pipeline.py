@@ -0,0 +1,191 @@
+"""
+End-to-end benchmark of the /process-document and /ask paths.
+
+Runs the real FastAPI app in-process with Document AI and Gemini replayed
+from local fixtures (see benchmarks/replay.py), and reports per-stage
+p50/p95 latency, throughput under N concurrent clients, peak RSS, and
+embedding/FAISS timings for each document size.
+
+Usage (from the clarityEngine directory):
+    python -m benchmarks.bench_pipeline
+    python -m benchmarks.bench_pipeline --pages 5,50,300 --clients 1,8 --llm-latency-ms 800 --json bench.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    if not samples:
+        return float("nan")
+    ordered = sorted(samples)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(samples: list[float]) -> dict:
+    return {
+        "count": len(samples),
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p95_ms": percentile(samples, 95) * 1000,
+        "mean_ms": statistics.fmean(samples) * 1000 if samples else float("nan"),
+    }
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is kilobytes on Linux and bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _configure_environment(data_dir: str):
+    """Points every on-disk store at a scratch directory and disables caches that would hide work."""
+    os.environ.setdefault("GOOGLE_CLOUD_PROJECT", "benchmark")
+    os.environ.setdefault("GOOGLE_CLOUD_LOCATION", "us")
+    os.environ.setdefault("DOCAI_PROCESSOR_ID", "replay")
+    os.environ.setdefault("GEMINI_API_KEY", "replay")
+    os.environ["DOCUMENT_STORE_DIR"] = os.path.join(data_dir, "documents")
+    os.environ["RESULT_CACHE_DIR"] = os.path.join(data_dir, "results")
+    os.environ["JOB_STORE_PATH"] = os.path.join(data_dir, "jobs.sqlite3")
+    os.environ["JOB_SPOOL_DIR"] = os.path.join(data_dir, "uploads")
+    # A similarity above 1.0 never matches, so every question reaches retrieval and Gemini.
+    os.environ["ANSWER_CACHE_SIMILARITY_THRESHOLD"] = "1.01"
+
+
+async def _run_clients(num_clients: int, requests_per_client: int, make_request) -> tuple[list[float], float]:
+    """Runs num_clients concurrent loops of requests_per_client requests. Returns latencies and wall time."""
+    latencies = []
+
+    async def client(client_number: int):
+        for i in range(requests_per_client):
+            start = time.perf_counter()
+            await make_request(client_number, i)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(n) for n in range(num_clients)))
+    return latencies, time.perf_counter() - start
+
+
+async def run_benchmark(args) -> dict:
+    import httpx
+    from app.main import app
+    from benchmarks import replay
+
+    timings = replay.install(
+        llm_latency=replay.LatencyModel(args.llm_latency_ms, args.llm_jitter_ms, args.llm_per_1k_tokens_ms),
+        docai_latency=replay.LatencyModel(args.docai_latency_ms, args.docai_jitter_ms)
+    )
+    questions = replay.load_fixture("questions.json")
+    report = {"config": vars(args), "sizes": []}
+
+    # ASGITransport does not run the lifespan; run it here so the benchmark starts the app as a server does.
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app), \
+            httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as http:
+        # Load the embedding model once so the first measured upload does not pay for it.
+        from app.core.vector_store import initialize_embedding_model
+        initialize_embedding_model()
+
+        for pages in args.pages:
+            for num_clients in args.clients:
+                timings.reset()
+                document_ids = []
+
+                async def upload(client_number: int, i: int):
+                    payload = replay.make_pdf_bytes(pages, nonce=uuid.uuid4().hex)
+                    response = await http.post(
+                        "/api/process-document",
+                        files={"file": (f"bench-{pages}p.pdf", payload, "application/pdf")}
+                    )
+                    response.raise_for_status()
+                    document_ids.append(response.json()["document_id"])
+
+                upload_latencies, upload_wall = await _run_clients(num_clients, args.uploads_per_client, upload)
+                upload_stages = timings.snapshot()
+
+                timings.reset()
+
+                async def ask(client_number: int, i: int):
+                    response = await http.post("/api/ask", json={
+                        "question": random.choice(questions),
+                        "document_id": random.choice(document_ids)
+                    })
+                    response.raise_for_status()
+
+                ask_latencies, ask_wall = await _run_clients(num_clients, args.asks_per_client, ask)
+                ask_stages = timings.snapshot()
+
+                entry = {
+                    "pages": pages,
+                    "clients": num_clients,
+                    "process_document": {
+                        **summarize(upload_latencies),
+                        "throughput_per_s": len(upload_latencies) / upload_wall,
+                        "stages": {stage: summarize(s) for stage, s in sorted(upload_stages.items())}
+                    },
+                    "ask": {
+                        **summarize(ask_latencies),
+                        "throughput_per_s": len(ask_latencies) / ask_wall,
+                        "stages": {stage: summarize(s) for stage, s in sorted(ask_stages.items())}
+                    },
+                    "peak_rss_mb": peak_rss_mb()
+                }
+                report["sizes"].append(entry)
+                _print_entry(entry)
+    return report
+
+
+def _print_entry(entry: dict):
+    print(f"\n=== {entry['pages']} pages, {entry['clients']} concurrent client(s) "
+          f"(peak RSS {entry['peak_rss_mb']:.0f} MB) ===")
+    for path in ("process_document", "ask"):
+        result = entry[path]
+        print(f"  /{path.replace('_', '-')}: p50 {result['p50_ms']:.1f} ms, p95 {result['p95_ms']:.1f} ms, "
+              f"{result['throughput_per_s']:.2f} req/s over {result['count']} requests")
+        for stage, stats in result["stages"].items():
+            print(f"      {stage:<28} n={stats['count']:<5} p50 {stats['p50_ms']:9.1f} ms   p95 {stats['p95_ms']:9.1f} ms")
+
+
+def _int_list(value: str) -> list[int]:
+    return [int(v) for v in value.split(",") if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=_int_list, default=[5, 50, 200], help="document sizes in pages")
+    parser.add_argument("--clients", type=_int_list, default=[1, 4], help="concurrent client counts")
+    parser.add_argument("--uploads-per-client", type=int, default=2)
+    parser.add_argument("--asks-per-client", type=int, default=10)
+    parser.add_argument("--llm-latency-ms", type=float, default=200.0)
+    parser.add_argument("--llm-jitter-ms", type=float, default=100.0)
+    parser.add_argument("--llm-per-1k-tokens-ms", type=float, default=5.0)
+    parser.add_argument("--docai-latency-ms", type=float, default=500.0)
+    parser.add_argument("--docai-jitter-ms", type=float, default=200.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", dest="json_path", help="also write the full report to this file")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    with tempfile.TemporaryDirectory(prefix="clarity-bench-") as data_dir:
+        _configure_environment(data_dir)
+        report = asyncio.run(run_benchmark(args))
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.json_path}")
+
+
+if __name__ == "__main__":
+    main()
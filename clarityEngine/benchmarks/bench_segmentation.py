@@ -0,0 +1,147 @@
+"""
+Section segmentation micro-benchmark.
+
+Builds synthetic contracts of increasing size from the lease fixture (ARTICLE
+headings, a table of contents, body text that mentions the titles), derives
+the title list Gemini would report with some titles misspelled by one
+character, and times app.core.segmentation.segment_sections against the
+previous regex split (re.split on an alternation of every title, then a
+search of the remaining parts per title). Reports wall time, peak traced
+memory and how many titles each placed.
+
+Usage (from the clarityEngine directory):
+    python -m benchmarks.bench_segmentation
+    python -m benchmarks.bench_segmentation --sizes-mb 0.1,1,5 --sections 20,200 --repeat 3
+"""
+import argparse
+import json
+import os
+import random
+import re
+import time
+import tracemalloc
+
+from benchmarks.replay import load_fixture
+
+_WORDS = ("Payment Terms", "Insurance", "Assignment", "Indemnification", "Confidentiality", "Utilities",
+          "Parking", "Pets", "Subletting", "Access", "Dispute Resolution", "Force Majeure")
+
+
+def legacy_split_text_into_sections(full_text: str, section_titles: list[str]) -> list:
+    """The split used before app.core.segmentation, kept here as the baseline."""
+    if not section_titles:
+        return [("Overall Summary", full_text)]
+
+    structured_content = []
+    split_pattern = '|'.join([re.escape(title.strip()) for title in section_titles])
+    parts = re.split(f'({split_pattern})', full_text, flags=re.IGNORECASE)
+
+    content_cursor = 0
+    if len(parts) > 1:
+        content_cursor = parts.index(next((s for s in parts if s.strip() in section_titles), None)) + 1
+
+    for title in section_titles:
+        title = title.strip()
+        try:
+            temp_parts = [p.lower().strip() for p in parts[content_cursor:]]
+            title_index_in_temp = temp_parts.index(title.lower())
+            title_index_in_parts = content_cursor + title_index_in_temp
+            content = parts[title_index_in_parts + 1]
+            structured_content.append((title, content))
+            content_cursor = title_index_in_parts + 2
+        except (ValueError, IndexError):
+            continue
+    return structured_content
+
+
+def _misspell(title: str, rng: random.Random) -> str:
+    position = rng.randrange(1, len(title) - 1)
+    return title[:position] + title[position + 1:]
+
+
+def make_document(target_chars: int, num_sections: int, typo_rate: float, seed: int) -> tuple[str, list[str]]:
+    """A contract of about target_chars characters with num_sections numbered articles, and the titles list."""
+    rng = random.Random(seed)
+    body = [line for line in load_fixture("docai_lease.txt").splitlines() if re.match(r"\d+\.\d+ ", line)]
+    titles = [f"{_WORDS[i % len(_WORDS)]} {i + 1}" if i >= len(_WORDS) else _WORDS[i] for i in range(num_sections)]
+
+    section_chars = max(200, target_chars // num_sections)
+    parts = ["MASTER SERVICES AGREEMENT\n\nTABLE OF CONTENTS\n"]
+    parts += [f"{i + 1}. {title}\n" for i, title in enumerate(titles)]
+    for i, title in enumerate(titles):
+        section = [f"\nARTICLE {i + 1}\n{title.upper()}\n"]
+        written = 0
+        while written < section_chars:
+            line = rng.choice(body)
+            if rng.random() < 0.1:
+                # Body text that mentions another section by name.
+                line += f" See {rng.choice(titles)} for details."
+            section.append(line + "\n")
+            written += len(line) + 1
+        parts.append("".join(section))
+    reported = [_misspell(t, rng) if rng.random() < typo_rate and len(t) >= 8 else t for t in titles]
+    return "".join(parts), reported
+
+
+def _measure(func, text: str, titles: list[str], repeat: int) -> tuple[float, float, int]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(text, titles)
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    func(text, titles)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(timings), peak / (1024 * 1024), len(result)
+
+
+def _float_list(value: str) -> list[float]:
+    return [float(v) for v in value.split(",") if v]
+
+
+def _int_list(value: str) -> list[int]:
+    return [int(v) for v in value.split(",") if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes-mb", type=_float_list, default=[0.1, 1, 4])
+    parser.add_argument("--sections", type=_int_list, default=[20, 200])
+    parser.add_argument("--typo-rate", type=float, default=0.1, help="fraction of titles reported with a typo")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--skip-legacy-above-mb", type=float, default=4,
+                        help="the legacy split is quadratic; skip it for larger documents")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", dest="json_path", help="also write the full report to this file")
+    args = parser.parse_args()
+
+    for name, value in (("GOOGLE_CLOUD_PROJECT", "benchmark"), ("GOOGLE_CLOUD_LOCATION", "us"),
+                        ("DOCAI_PROCESSOR_ID", "benchmark")):
+        os.environ.setdefault(name, value)
+    from app.core.segmentation import segment_sections
+
+    report = []
+    for size_mb in args.sizes_mb:
+        for num_sections in args.sections:
+            text, titles = make_document(int(size_mb * 1024 * 1024), num_sections, args.typo_rate, args.seed)
+            print(f"\n=== {len(text) / (1024 * 1024):.1f} MB, {num_sections} sections ===")
+            runs = [("segment_sections", segment_sections)]
+            if size_mb <= args.skip_legacy_above_mb:
+                runs.append(("legacy_split", legacy_split_text_into_sections))
+            for name, func in runs:
+                seconds, peak_mb, placed = _measure(func, text, titles, args.repeat)
+                entry = {"size_mb": size_mb, "sections": num_sections, "method": name,
+                         "seconds": seconds, "peak_mb": peak_mb, "placed": placed}
+                report.append(entry)
+                print(f"  {name:<18} {seconds * 1000:9.1f} ms   peak {peak_mb:7.1f} MB   "
+                      f"placed {placed}/{num_sections}")
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.json_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+A local HTTP stand-in for the Gemini REST API that counts what it receives.
+
+Serves generateContent, streamGenerateContent and cachedContents (create and
+delete) well enough for google.generativeai with transport="rest", answering
+from the recorded fixture responses (see replay.classify_prompt). Each request
+is charged an estimated token count (characters / 4) for the text it carries;
+text referenced from a cache is counted separately as cached tokens. A
+LatencyModel delays each reply in proportion to the tokens received.
+
+Point the app at it with GEMINI_API_ENDPOINT=http://127.0.0.1:<port> (read
+when app.core.llm_client is first imported).
+
+Usage:
+    server = FakeGeminiServer(LatencyModel(50, per_1k_tokens_ms=20)).start()
+    ...
+    print(server.stats.snapshot())
+    server.stop()
+"""
+import datetime
+import json
+import threading
+import uuid
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.replay import LatencyModel, classify_prompt, load_fixture
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+def _text_of(contents: list[dict]) -> str:
+    return "".join(part.get("text", "") for content in contents for part in content.get("parts", []))
+
+
+class ReceivedTokens:
+    """Thread-safe per-kind totals: requests, tokens received and tokens read from caches."""
+
+    def __init__(self):
+        self._totals = defaultdict(lambda: {"requests": 0, "tokens": 0, "cached_tokens": 0})
+        self._lock = threading.Lock()
+
+    def add(self, kind: str, tokens: int, cached_tokens: int = 0):
+        with self._lock:
+            totals = self._totals[kind]
+            totals["requests"] += 1
+            totals["tokens"] += tokens
+            totals["cached_tokens"] += cached_tokens
+
+    def snapshot(self) -> dict[str, dict]:
+        with self._lock:
+            return {kind: dict(totals) for kind, totals in self._totals.items()}
+
+    def reset(self):
+        with self._lock:
+            self._totals.clear()
+
+
+class FakeGeminiServer:
+    def __init__(self, latency: LatencyModel | None = None, port: int = 0):
+        self.latency = latency or LatencyModel(0)
+        self.responses = load_fixture("gemini_responses.json")
+        self.stats = ReceivedTokens()
+        self.caches: dict[str, dict] = {}
+        self._caches_lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler_class())
+        self._thread = None
+
+    @property
+    def endpoint(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeGeminiServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _create_cache(self, body: dict) -> dict:
+        text = _text_of(body.get("contents", []))
+        now = datetime.datetime.now(datetime.timezone.utc)
+        cache = {
+            "name": f"cachedContents/{uuid.uuid4().hex[:12]}",
+            "model": body["model"],
+            "createTime": now.isoformat().replace("+00:00", "Z"),
+            "updateTime": now.isoformat().replace("+00:00", "Z"),
+            "expireTime": (now + datetime.timedelta(hours=1)).isoformat().replace("+00:00", "Z"),
+            "usageMetadata": {"totalTokenCount": estimate_tokens(text)},
+        }
+        with self._caches_lock:
+            self.caches[cache["name"]] = {"text": text, "metadata": cache}
+        self.stats.add("context_cache", estimate_tokens(text))
+        return cache
+
+    def _generate(self, model: str, body: dict) -> dict:
+        prompt = _text_of(body.get("contents", []))
+        cached_tokens = 0
+        if body.get("cachedContent"):
+            with self._caches_lock:
+                cache = self.caches.get(body["cachedContent"])
+            if cache is None:
+                raise KeyError(body["cachedContent"])
+            cached_tokens = estimate_tokens(cache["text"])
+        kind = classify_prompt(prompt)
+        tokens = estimate_tokens(prompt)
+        self.stats.add(kind, tokens, cached_tokens)
+        self.latency.sleep(len(prompt))
+
+        response = self.responses[kind]
+        text = response if isinstance(response, str) else json.dumps(response)
+        return {
+            "candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "finishReason": "STOP", "index": 0}],
+            "usageMetadata": {
+                "promptTokenCount": tokens + cached_tokens,
+                "cachedContentTokenCount": cached_tokens,
+                "candidatesTokenCount": estimate_tokens(text),
+                "totalTokenCount": tokens + cached_tokens + estimate_tokens(text),
+            },
+            "modelVersion": model,
+        }
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status: int, payload):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("content-type", "application/json")
+                self.send_header("content-length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("content-length", 0))) or b"{}")
+                path = self.path.split("?", 1)[0]
+                try:
+                    if path.endswith("/cachedContents"):
+                        return self._reply(200, server._create_cache(body))
+                    model = path.split("/models/", 1)[1].split(":", 1)[0]
+                    reply = server._generate(model, body)
+                except KeyError as e:
+                    return self._reply(404, {"error": {"code": 404, "message": f"Not found: {e}", "status": "NOT_FOUND"}})
+                except ValueError as e:
+                    return self._reply(400, {"error": {"code": 400, "message": str(e), "status": "INVALID_ARGUMENT"}})
+                # The REST transport reads a streamed reply as one JSON array of chunks.
+                self._reply(200, [reply] if ":streamGenerateContent" in path else reply)
+
+            def do_DELETE(self):
+                name = self.path.split("?", 1)[0].split("/v1beta/", 1)[-1]
+                with server._caches_lock:
+                    found = server.caches.pop(name, None)
+                if found is None:
+                    return self._reply(404, {"error": {"code": 404, "message": "Not found", "status": "NOT_FOUND"}})
+                self._reply(200, {})
+
+            def do_GET(self):
+                name = self.path.split("?", 1)[0].split("/v1beta/", 1)[-1]
+                with server._caches_lock:
+                    found = server.caches.get(name)
+                if found is None:
+                    return self._reply(404, {"error": {"code": 404, "message": "Not found", "status": "NOT_FOUND"}})
+                self._reply(200, found["metadata"])
+
+        return Handler
@@ -0,0 +1,185 @@
+"""
+Replays recorded Document AI and Gemini responses from local fixtures.
+
+install() swaps the Gemini model class and the Document AI call inside the
+app for replay versions, so the real pipeline, FastAPI app, embedding model
+and FAISS indexes run end to end with no network access. Every replayed
+call sleeps for a configurable synthetic latency to stand in for the
+remote service.
+
+Fixtures (benchmarks/fixtures/):
+    docai_lease.txt        text Document AI returned for a short lease; tiled to any page count
+    gemini_responses.json  one recorded response per prompt kind (see classify_prompt)
+    questions.json         questions used for the /ask benchmark
+"""
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+# Roughly one printed page of contract text.
+CHARS_PER_PAGE = 3000
+
+
+def load_fixture(name: str):
+    path = os.path.join(FIXTURES_DIR, name)
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f) if name.endswith(".json") else f.read()
+
+
+class StageTimings:
+    """Thread-safe collection of wall-clock samples (seconds) per stage name."""
+
+    def __init__(self):
+        self._samples = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float):
+        with self._lock:
+            self._samples[stage].append(seconds)
+
+    @contextmanager
+    def measure(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def snapshot(self) -> dict[str, list[float]]:
+        with self._lock:
+            return {stage: list(samples) for stage, samples in self._samples.items()}
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+
+
+class LatencyModel:
+    """Synthetic service latency: base + uniform jitter + a per-1k-token component."""
+
+    def __init__(self, base_ms: float, jitter_ms: float = 0.0, per_1k_tokens_ms: float = 0.0):
+        self.base_ms = base_ms
+        self.jitter_ms = jitter_ms
+        self.per_1k_tokens_ms = per_1k_tokens_ms
+
+    def sleep(self, prompt_chars: int = 0):
+        tokens = prompt_chars / 4
+        delay_ms = self.base_ms + random.uniform(0, self.jitter_ms) + self.per_1k_tokens_ms * tokens / 1000
+        time.sleep(delay_ms / 1000)
+
+
+def classify_prompt(prompt: str) -> str:
+    """Maps a prompt built by app.core.clarity_engine to the fixture key of its recorded response."""
+    if "act as a document parser" in prompt:
+        return "section_titles"
+    if "core semantic chunks" in prompt:
+        return "chunks"
+    if "PART 1 SUMMARY" in prompt:
+        return "combined_summary"
+    if re.search(r"is part \d+ of \d+ of a longer document", prompt):
+        return "partial_summary"
+    if "**SECTION TITLE:**" in prompt:
+        return "section_summary"
+    if 'AI advisor named "Clarity' in prompt:
+        return "answer"
+    if "Summarize the following document" in prompt:
+        return "summary"
+    raise ValueError(f"No recorded response matches this prompt: {prompt[:200]!r}")
+
+
+class _ReplayResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class _ReplayStream(_ReplayResponse):
+    """What generate_content(stream=True) returns: iterating yields the text a few words at a time."""
+
+    def __iter__(self):
+        words = self.text.split(" ")
+        for start in range(0, len(words), 8):
+            yield _ReplayResponse(" ".join(words[start:start + 8]) + (" " if start + 8 < len(words) else ""))
+
+
+def make_replay_model(responses: dict, latency: LatencyModel, timings: StageTimings):
+    """Builds a stand-in for genai.GenerativeModel that answers from recorded responses."""
+
+    class ReplayGenerativeModel:
+        def __init__(self, model_name, generation_config=None, **kwargs):
+            self.model_name = model_name
+            self.generation_config = generation_config
+
+        def generate_content(self, prompt, **kwargs):
+            kind = classify_prompt(prompt)
+            with timings.measure(f"llm:{kind}"):
+                latency.sleep(len(prompt))
+                response = responses[kind]
+                text = response if isinstance(response, str) else json.dumps(response)
+            return _ReplayStream(text) if kwargs.get("stream") else _ReplayResponse(text)
+
+    return ReplayGenerativeModel
+
+
+def make_pdf_bytes(pages: int, nonce: str) -> bytes:
+    """Upload payload for the benchmark; the replayed extraction reads the page count back out."""
+    return f"%PDF-replay pages={pages} nonce={nonce}\n".encode("ascii")
+
+
+def make_replay_docai(document_text: str, latency: LatencyModel, timings: StageTimings):
+    """Builds a stand-in for process_document_with_docai returning the fixture text tiled to the requested pages."""
+
+    def replay_process_document_with_docai(file_content: bytes, mime_type: str) -> str:
+        with timings.measure("extraction"):
+            match = re.search(rb"pages=(\d+)", file_content)
+            pages = int(match.group(1)) if match else 1
+            latency.sleep()
+            target_chars = pages * CHARS_PER_PAGE
+            copies = target_chars // len(document_text) + 1
+            return ("\n\n".join([document_text] * copies))[:target_chars]
+
+    return replay_process_document_with_docai
+
+
+def _timed(func, stage: str, timings: StageTimings):
+    def wrapper(*args, **kwargs):
+        with timings.measure(stage):
+            return func(*args, **kwargs)
+    wrapper.__name__ = func.__name__
+    return wrapper
+
+
+def install(llm_latency: LatencyModel, docai_latency: LatencyModel) -> StageTimings:
+    """
+    Patches the app for replay and wraps the local stages with timers.
+    Must be called after the app modules are imported and before any request is sent.
+    """
+    from app.api import endpoints
+    from app.config import settings
+    from app.core import document_processor, pipeline, resources, vector_store
+
+    timings = StageTimings()
+    responses = load_fixture("gemini_responses.json")
+    document_text = load_fixture("docai_lease.txt")
+
+    resources.genai.GenerativeModel = make_replay_model(responses, llm_latency, timings)
+    resources.clear_generative_models()
+    # Replayed calls cost nothing; pacing them to the real quota would only skew the timings.
+    settings.llm_requests_per_minute = {}
+    # The replayed model has no context cache; prompts carry their text inline as without one.
+    settings.document_context_enabled = False
+    document_processor.process_document_with_docai = make_replay_docai(document_text, docai_latency, timings)
+
+    pipeline.chunk_text_locally = _timed(pipeline.chunk_text_locally, "local_chunking", timings)
+    vector_store.embed_chunks = _timed(vector_store.embed_chunks, "embedding", timings)
+    vector_store.store_embeddings = _timed(vector_store.store_embeddings, "index_build", timings)
+    endpoints.embed_query = _timed(endpoints.embed_query, "query_embedding", timings)
+    endpoints.search_document = _timed(endpoints.search_document, "vector_search", timings)
+    endpoints.select_context = _timed(endpoints.select_context, "context_selection", timings)
+    return timings
@@ -70,7 +70,7 @@ const DocumentView = ({ document, onBack }) => {
       setIsAiThinking(true);
   
       try {
-        const response = await fetch(`${BACKEND_URL}/api/chat`, {
+        const response = await fetch(`${BACKEND_URL}/api/chat/stream`, {
           method: 'POST',
           headers: { 'Content-Type': 'application/json' },
           body: JSON.stringify({
@@ -78,16 +78,47 @@ const DocumentView = ({ document, onBack }) => {
             documentId: document.documentId
           }),
         });
-  
+
         if (!response.ok) {
           const errData = await response.json();
           throw new Error(errData.detail || 'Failed to get a response from the AI.');
         }
-  
-        const data = await response.json();
-        const aiResponse = { sender: 'ai', text: data.answer };
-        setChatMessages(prev => [...prev, aiResponse]);
-  
+
+        // Server-sent events: append each token to the AI message as it arrives.
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let started = false;
+        const appendToAnswer = (text) => {
+          if (!started) {
+            started = true;
+            setIsAiThinking(false);
+            setChatMessages(prev => [...prev, { sender: 'ai', text }]);
+            return;
+          }
+          setChatMessages(prev => [...prev.slice(0, -1), { sender: 'ai', text: prev[prev.length - 1].text + text }]);
+        };
+
+        while (true) {
+          const { done, value } = await reader.read();
+          if (done) break;
+          buffer += decoder.decode(value, { stream: true });
+          const events = buffer.split('\n\n');
+          buffer = events.pop();
+          for (const rawEvent of events) {
+            const lines = rawEvent.split('\n');
+            const eventName = (lines.find(line => line.startsWith('event: ')) || '').slice(7);
+            const dataLine = lines.find(line => line.startsWith('data: '));
+            if (!dataLine) continue;
+            const data = JSON.parse(dataLine.slice(6));
+            if (eventName === 'token') {
+              appendToAnswer(data.text);
+            } else if (eventName === 'error') {
+              throw new Error(data.message);
+            }
+          }
+        }
+
       } catch (error) {
         console.error("Chat error:", error);
         const errorResponse = { sender: 'ai', text: `Sorry, an error occurred: ${error.message}` };